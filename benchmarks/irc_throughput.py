@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+"""
+Measures how much IRC traffic a bot keeps up with.
+
+A minimal IRC server runs in the same process on localhost and a real bot,
+with an IrcBackend connection, signs on to it and joins its rooms. The server
+then sends synthetic channel traffic from a crowd of users at a given rate: a
+mix of commands the bot answers and chatter it only has to look at. It
+reports the message and reply throughput, the command to reply latency and
+how much the process grew while the traffic ran.
+
+    $ python benchmarks/irc_throughput.py --rooms 10 --users 200 --rate 2000 --duration 20
+    $ python benchmarks/irc_throughput.py --mix ping=1,chatter=9 -o fair_scheduling=True --json
+
+With --json the results are printed as one json line, to keep track of them
+across revisions.
+"""
+import os
+import gc
+import sys
+import ast
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+NICK = 'bench'
+SERVER_NAME = 'bench.local'
+# seconds between two batches of traffic
+TICK = 0.01
+# seconds to wait for the last replies once the traffic stopped
+DRAIN_TIMEOUT = 10.0
+# generates each kind of message, given its id
+MESSAGES = {
+    'ping': lambda message_id: '!ping {0}'.format(message_id),
+    'echo': lambda message_id: '!echo {0} the quick brown fox jumps over the lazy dog'.format(message_id),
+    'work': lambda message_id: '!work {0}'.format(message_id),
+    'chatter': lambda message_id: 'just chatting, nothing for the bot here {0}'.format(message_id),
+}
+# kinds of messages the bot replies to
+COMMANDS = ('ping', 'echo', 'work')
+
+
+# the bot's plugin, replies start with the id of the message they answer
+def ping(event):
+    return '{0} pong'.format(event.args[0])
+
+
+def echo(event):
+    return ' '.join(event.args)
+
+
+def work(event):
+    return '{0} {1}'.format(event.args[0], sum(i * i for i in range(2000)))
+
+
+def parse_mix(mix):
+    """
+    'ping=2,chatter=8' -> [('ping', 2.0), ('chatter', 8.0)]
+    """
+    weights = []
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in MESSAGES:
+            raise argparse.ArgumentTypeError('unknown message kind {0!r}, use one of {1}'.format(
+                kind, ', '.join(sorted(MESSAGES))))
+        try:
+            weights.append((kind, float(weight or 1)))
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid weight for {0!r}: {1!r}'.format(kind, weight))
+    return weights
+
+
+def parse_option(option):
+    """
+    'queue_drain_limit=100' -> ('queue_drain_limit', 100)
+    """
+    name, _, value = option.partition('=')
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        pass
+    return name.strip(), value
+
+
+def memory():
+    """
+    resident set size of the process in bytes
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        import resource
+        # the peak, in kilobytes on linux and bytes on os x
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def percentile(times, fraction):
+    return times[min(int(len(times) * fraction), len(times) - 1)]
+
+
+class Traffic(object):
+    """
+    sends the synthetic messages and times the replies to them
+    """
+    def __init__(self, reactor, rooms, users, mix, rate, duration):
+        from twisted.internet import task
+
+        self.reactor = reactor
+        self.rooms = rooms
+        self.users = ['user{0}!u{0}@{1}'.format(i, SERVER_NAME) for i in range(users)]
+        self.kinds = [kind for kind, _ in mix]
+        self.cumulative_weights = []
+        total = 0.0
+        for _, weight in mix:
+            total += weight
+            self.cumulative_weights.append(total)
+        self.rate = rate
+        self.duration = duration
+
+        self.connection = None
+        self.joined = set()
+        self.loop = task.LoopingCall(self.tick)
+        self.budget = 0.0
+        self.next_id = 0
+
+        # message id -> time sent, for commands without a reply yet
+        self.outstanding = {}
+        self.counts = dict((kind, 0) for kind in MESSAGES)
+        self.times = []
+        self.started = None
+        self.stopped = None
+        self.last_reply = None
+        self.memory = {}
+        self.objects = {}
+        self.done = None
+
+    def pick_kind(self):
+        point = random.random() * self.cumulative_weights[-1]
+        for kind, weight in zip(self.kinds, self.cumulative_weights):
+            if point < weight:
+                return kind
+        return self.kinds[-1]
+
+    def room_joined(self, connection, room):
+        self.connection = connection
+        self.joined.add(room)
+        if self.joined.issuperset(self.rooms) and self.started is None:
+            self.start()
+
+    def start(self):
+        gc.collect()
+        self.memory['start'] = memory()
+        self.objects['start'] = len(gc.get_objects())
+        self.started = time.time()
+        self.loop.start(TICK)
+        self.reactor.callLater(self.duration, self.stop)
+
+    def tick(self):
+        self.budget += self.rate * TICK
+        while self.budget >= 1:
+            self.budget -= 1
+            self.send()
+
+    def send(self):
+        kind = self.pick_kind()
+        message_id = self.next_id
+        self.next_id += 1
+        self.counts[kind] += 1
+
+        room = self.rooms[message_id % len(self.rooms)]
+        user = random.choice(self.users)
+        if kind in COMMANDS:
+            self.outstanding[message_id] = time.time()
+        self.connection.sendLine(':{0} PRIVMSG {1} :{2}'.format(user, room, MESSAGES[kind](message_id)))
+
+    def replied(self, target, text):
+        now = time.time()
+        try:
+            message_id = int(text.split(' ', 1)[0])
+        except ValueError:
+            return
+
+        sent = self.outstanding.pop(message_id, None)
+        if sent is not None:
+            self.times.append(now - sent)
+            self.last_reply = now
+            if self.stopped is not None and not self.outstanding:
+                self.finish()
+
+    def stop(self):
+        self.loop.stop()
+        self.stopped = time.time()
+        if not self.outstanding:
+            self.finish()
+        else:
+            self.done = self.reactor.callLater(DRAIN_TIMEOUT, self.finish)
+
+    def finish(self):
+        if self.done is not None and self.done.active():
+            self.done.cancel()
+        gc.collect()
+        self.memory['end'] = memory()
+        self.objects['end'] = len(gc.get_objects())
+        self.reactor.stop()
+
+    def results(self):
+        times = sorted(self.times)
+        sent = sum(self.counts.values())
+        elapsed = max(self.last_reply or self.stopped, self.stopped) - self.started
+        return {'rooms': len(self.rooms),
+                'users': len(self.users),
+                'rate': self.rate,
+                'duration': self.duration,
+                'sent': sent,
+                'counts': self.counts,
+                'replies': len(times),
+                'missing': len(self.outstanding),
+                'messages_per_second': sent / elapsed if elapsed else None,
+                'replies_per_second': len(times) / elapsed if elapsed else None,
+                'latency_mean': sum(times) / len(times) if times else None,
+                'latency_p50': percentile(times, 0.5) if times else None,
+                'latency_p99': percentile(times, 0.99) if times else None,
+                'latency_max': times[-1] if times else None,
+                'memory_start': self.memory.get('start'),
+                'memory_growth': self.memory['end'] - self.memory['start'] if 'end' in self.memory else None,
+                'objects_growth': self.objects['end'] - self.objects['start'] if 'end' in self.objects else None}
+
+
+def build_server(traffic):
+    """
+    just enough of an IRC server for the bot: sign on, join, names, privmsg
+    """
+    from twisted.internet import protocol
+    from twisted.protocols import basic
+
+    class BenchServer(basic.LineReceiver):
+        def connectionMade(self):
+            self.nick = None
+
+        def send(self, *lines):
+            for line in lines:
+                self.sendLine(line)
+
+        def lineReceived(self, line):
+            command, _, rest = line.partition(' ')
+            command = command.upper()
+            if command == 'NICK':
+                self.nick = rest.strip()
+            elif command == 'USER':
+                self.send(':{0} 001 {1} :welcome to the benchmark'.format(SERVER_NAME, self.nick))
+            elif command == 'JOIN':
+                for room in rest.split(' ', 1)[0].split(','):
+                    self.send(':{0}!bot@{1} JOIN :{2}'.format(self.nick, SERVER_NAME, room),
+                              ':{0} 353 {1} = {2} :{1} {3}'.format(SERVER_NAME, self.nick, room,
+                                                                   ' '.join(user.split('!')[0]
+                                                                            for user in traffic.users[:50])),
+                              ':{0} 366 {1} {2} :end of names'.format(SERVER_NAME, self.nick, room))
+                    traffic.room_joined(self, room)
+            elif command == 'PRIVMSG':
+                target, _, text = rest.partition(' :')
+                traffic.replied(target, text)
+            elif command == 'PING':
+                self.send(':{0} PONG {0} {1}'.format(SERVER_NAME, rest))
+
+    factory = protocol.ServerFactory()
+    factory.protocol = BenchServer
+    return factory
+
+
+def run(args):
+    from brutal.core.runtime import install_reactor
+    reactor = install_reactor(args.reactor)
+
+    from brutal.conf import config
+    from brutal.core.bot import Bot
+    from brutal.core.plugin import cmd
+
+    config.configure()
+
+    rooms = ['#room{0}'.format(i) for i in range(args.rooms)]
+    traffic = Traffic(reactor, rooms, args.users, args.mix, args.rate, args.duration)
+    port = reactor.listenTCP(0, build_server(traffic), interface='127.0.0.1')
+
+    connection = {'protocol': 'irc', 'server': '127.0.0.1', 'port': port.getHost().port, 'channels': rooms,
+                  'flood_rate': args.flood_rate, 'flood_burst': args.flood_burst}
+    bot = Bot(NICK, [connection], **dict(args.options))
+    bot.plugin_manager._build_parser([('ping', cmd(ping)), ('echo', cmd(echo)), ('work', cmd(work))],
+                                     sys.modules[__name__], __name__)
+    bot.connection_manager.connect()
+
+    reactor.run()
+    return traffic.results()
+
+
+def report(results):
+    def ms(seconds):
+        return '{0:.3f} ms'.format(1000 * seconds) if seconds is not None else '-'
+
+    print 'rooms {0}, users {1}, offered rate {2}/s for {3}s'.format(results['rooms'], results['users'],
+                                                                   results['rate'], results['duration'])
+    print 'sent        {0} ({1})'.format(results['sent'], ', '.join('{0} {1}'.format(kind, count) for kind, count
+                                                                   in sorted(results['counts'].items()) if count))
+    print 'replies     {0}, {1} missing'.format(results['replies'], results['missing'])
+    print 'throughput  {0:.1f} messages/s, {1:.1f} replies/s'.format(results['messages_per_second'] or 0,
+                                                                     results['replies_per_second'] or 0)
+    print 'latency     mean {0}, p50 {1}, p99 {2}, max {3}'.format(ms(results['latency_mean']),
+                                                                   ms(results['latency_p50']),
+                                                                   ms(results['latency_p99']),
+                                                                   ms(results['latency_max']))
+    print 'memory      {0:.1f} MB at start, {1:+.1f} MB, {2:+d} objects'.format(
+        results['memory_start'] / 1048576.0, (results['memory_growth'] or 0) / 1048576.0,
+        results['objects_growth'] or 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='throughput and latency of a bot against a local irc server')
+    parser.add_argument('--rooms', type=int, default=5, help='rooms the bot joins')
+    parser.add_argument('--users', type=int, default=50, help='users the traffic comes from')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('ping=2,echo=1,work=1,chatter=6'),
+                        help='weights of the message kinds: {0} (default: ping=2,echo=1,work=1,chatter=6)'.format(
+                            ', '.join(sorted(MESSAGES))))
+    parser.add_argument('--rate', type=float, default=1000, help='messages sent per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to send traffic for')
+    parser.add_argument('--flood-rate', type=float, help='lines a second the bot sends, no flood control by default')
+    parser.add_argument('--flood-burst', type=int, default=5, help='lines the bot sends at once under flood control')
+    parser.add_argument('-o', '--option', type=parse_option, action='append', dest='options', default=[],
+                        help='bot option as name=value, e.g. -o queue_drain_limit=100')
+    parser.add_argument('-r', '--reactor', help='reactor to run on, see brutal.core.runtime')
+    parser.add_argument('--seed', type=int, help='seed for the traffic')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    results = run(args)
+    if args.json:
+        print json.dumps(results, sort_keys=True)
+    else:
+        report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks of the hot paths: building events and actions, matching
+parsers, dispatching events to 10, 100 and 1000 of them, parsing irc
+messages and the helpers in brutal.core.utils.
+
+Every benchmark is timed with gc off, as timeit does, over a few repeats;
+the fastest repeat is the number to compare. objects/op is how many gc
+tracked objects (instances, dicts, lists, tuples, ...) one call leaves alive,
+its result included, so it goes up when a model grows or a dispatch starts
+holding on to more.
+
+    $ python benchmarks/micro.py
+    $ python benchmarks/micro.py 'process_event.*' --repeat 10
+    $ python benchmarks/micro.py --json > before.json
+
+With --json every benchmark is printed as one json line.
+"""
+import os
+import gc
+import sys
+import json
+import timeit
+import fnmatch
+import argparse
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PARSER_COUNTS = (10, 100, 1000)
+
+# name -> function setting the benchmark up and returning the operation
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def build_bot():
+    from brutal.core.bot import Bot
+
+    return Bot('bench', [{'protocol': 'irc', 'channels': ['#bench']}])
+
+
+def raw_event(bot, body, source='room'):
+    client = bot.connection_manager.clients.values()[0]
+    return {'type': 'message', 'scope': 'public', 'source': source, 'channel': '#bench', 'client': client,
+            'client_id': client.id,
+            'meta': {'from': 'user!u@host', 'nick': 'user', 'host': 'host', 'body': body, 'recipients': []}}
+
+
+def handlers(count, decorator, name):
+    """
+    count distinct handler functions named name0, name1, ...
+    """
+    functions = []
+    for i in range(count):
+        def handler(event, *args):
+            return 'ok'
+        handler.__name__ = '{0}{1}'.format(name, i)
+        functions.append((handler.__name__, decorator(handler)))
+    return functions
+
+
+@benchmark('event.message')
+def bench_event_message():
+    from brutal.core.models import Event
+
+    bot = build_bot()
+    details = raw_event(bot, 'nothing for the bot in this one')
+    return lambda: Event(bot, details)
+
+
+@benchmark('event.cmd')
+def bench_event_cmd():
+    from brutal.core.models import Event
+
+    bot = build_bot()
+    details = raw_event(bot, '!weather bratislava tomorrow')
+    return lambda: Event(bot, details)
+
+
+@benchmark('event.cmd_args')
+def bench_event_cmd_args():
+    from brutal.core.models import Event
+
+    bot = build_bot()
+    details = raw_event(bot, '!weather bratislava tomorrow')
+
+    def op():
+        event = Event(bot, details)
+        return event.cmd, event.args
+    return op
+
+
+@benchmark('event.parse_details')
+def bench_parse_details():
+    from brutal.core.models import Event
+
+    bot = build_bot()
+    event = Event(bot, raw_event(bot, '!weather bratislava tomorrow'))
+    return event.parse_details
+
+
+@benchmark('event.parse_event_cmd')
+def bench_parse_event_cmd():
+    from brutal.core.models import Event
+
+    bot = build_bot()
+    event = Event(bot, raw_event(bot, 'hello'))
+    return lambda: event.parse_event_cmd('!weather bratislava tomorrow', '!')
+
+
+@benchmark('action.reply')
+def bench_action_reply():
+    from brutal.core.models import Event, Action
+
+    bot = build_bot()
+    event = Event(bot, raw_event(bot, '!ping'))
+    return lambda: Action(source_bot=bot, source_event=event).msg('pong')
+
+
+@benchmark('action.default_room')
+def bench_action_default_room():
+    from brutal.core.models import Action
+
+    bot = build_bot()
+    return lambda: Action(source_bot=bot).msg('hello everyone')
+
+
+@benchmark('parser.matches_hit')
+def bench_parser_matches_hit():
+    from brutal.core.models import Event
+    from brutal.core.plugin import Parser, cmd
+
+    bot = build_bot()
+    parser = Parser(handlers(1, cmd, 'weather')[0][1], sys.modules[__name__])
+    event = Event(bot, raw_event(bot, '!weather0 bratislava'))
+    event.cmd
+    return lambda: parser.matches(event)
+
+
+@benchmark('parser.matches_miss')
+def bench_parser_matches_miss():
+    from brutal.core.models import Event
+    from brutal.core.plugin import Parser, cmd
+
+    bot = build_bot()
+    parser = Parser(handlers(1, cmd, 'weather')[0][1], sys.modules[__name__])
+    event = Event(bot, raw_event(bot, '!forecast bratislava'))
+    event.cmd
+    return lambda: parser.matches(event)
+
+
+def bench_process_event(count, decorator, name, body):
+    def setup():
+        from brutal.core.models import Event
+
+        bot = build_bot()
+        bot.plugin_manager._build_parser(handlers(count, decorator, name), sys.modules[__name__], __name__)
+        details = raw_event(bot, body)
+        return lambda: bot.plugin_manager.process_event(Event(bot, details))
+    return setup
+
+
+def register_process_event():
+    from brutal.core.plugin import cmd, match
+
+    for count in PARSER_COUNTS:
+        middle = count // 2
+        # one of the commands runs and gets its action built
+        benchmark('process_event.cmd_hit.{0}'.format(count))(
+            bench_process_event(count, cmd, 'cmd', '!cmd{0} some args'.format(middle)))
+        benchmark('process_event.cmd_miss.{0}'.format(count))(
+            bench_process_event(count, cmd, 'cmd', '!unknown some args'))
+        # chatter checked against every match parser, one of them matching
+        benchmark('process_event.match_hit.{0}'.format(count))(
+            bench_process_event(count, lambda func: match(func, regex='^{0}\\b'.format(func.__name__)), 'word',
+                                'word{0} is in this message'.format(middle)))
+        benchmark('process_event.match_miss.{0}'.format(count))(
+            bench_process_event(count, lambda func: match(func, regex='^{0}\\b'.format(func.__name__)), 'word',
+                                'nothing for the bot in this one'))
+
+
+def bench_privmsg(message):
+    def setup():
+        from brutal.core.capture import ReplayTransport
+
+        bot = build_bot()
+        protocol = bot.connection_manager.clients.values()[0].client.buildProtocol(None)
+        protocol.makeConnection(ReplayTransport())
+        # just the parsing, not what the bot does with the event
+        protocol._bot_process_event = lambda raw_event: None
+        return lambda: protocol.privmsg('user!u@host', '#bench', message)
+    return setup
+
+
+benchmark('irc.privmsg_chatter')(bench_privmsg('just chatting, nothing for the bot here'))
+benchmark('irc.privmsg_url')(bench_privmsg('have a look at http://example.org/some/page'))
+benchmark('irc.privmsg_highlight')(bench_privmsg('bench: !weather bratislava tomorrow'))
+
+
+@benchmark('utils.split_args_by')
+def bench_split_args_by():
+    from brutal.core.utils import split_args_by
+
+    args = 'add meeting tomorrow , 10:00 , room 4 , bring coffee'.split()
+    return lambda: split_args_by(args, ',')
+
+
+@benchmark('utils.change_cmd')
+def bench_change_cmd():
+    from brutal.core.models import Event
+    from brutal.core.utils import change_cmd
+
+    bot = build_bot()
+    event = Event(bot, raw_event(bot, '!w bratislava tomorrow'))
+    event.cmd
+    return lambda: change_cmd(event, 'weather')
+
+
+def time_per_op(op, repeat, min_time):
+    """
+    seconds per call of op in each repeat, each repeat running at least
+    min_time seconds
+    """
+    timer = timeit.Timer(op)
+    number = 1
+    while True:
+        if timer.timeit(number) >= min_time / 10:
+            break
+        number *= 10
+    number = max(int(number * 10 * min_time / max(timer.timeit(number), 1e-9) / 10), 1)
+    return [seconds / number for seconds in timer.repeat(repeat, number)], number
+
+
+def objects_per_op(op, number=1000):
+    """
+    gc tracked objects a call of op leaves alive, its result included
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        # the count gc.get_count() starts from never goes below zero, so
+        # give it room for objects op frees
+        padding = [[] for _ in xrange(number * 10)]
+        before = gc.get_count()[0]
+        kept = [op() for _ in xrange(number)]
+        after = gc.get_count()[0]
+        del kept, padding
+    finally:
+        gc.enable()
+    return (after - before) / float(number)
+
+
+def run(name, repeat, min_time):
+    op = BENCHMARKS[name]()
+    # warm up caches, lazy builds and the like
+    for _ in xrange(100):
+        op()
+
+    times, number = time_per_op(op, repeat, min_time)
+    times.sort()
+    return OrderedDict([('name', name),
+                        ('ns_per_op', times[0] * 1e9),
+                        ('median_ns_per_op', times[len(times) // 2] * 1e9),
+                        ('objects_per_op', objects_per_op(op)),
+                        ('ops', number),
+                        ('repeat', repeat)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='microbenchmarks of the brutal hot paths')
+    parser.add_argument('patterns', nargs='*', help='run the benchmarks matching these glob patterns')
+    parser.add_argument('--repeat', type=int, default=5, help='times to repeat each benchmark')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds each repeat runs for at least')
+    parser.add_argument('--list', action='store_true', help='list the benchmarks')
+    parser.add_argument('--json', action='store_true', help='print the results as json lines')
+    args = parser.parse_args()
+
+    from brutal.conf import config
+    config.configure()
+    register_process_event()
+
+    names = [name for name in BENCHMARKS
+             if not args.patterns or any(fnmatch.fnmatch(name, pattern) for pattern in args.patterns)]
+    if args.list:
+        print '\n'.join(names)
+        return
+
+    if not args.json:
+        print '{0:<32} {1:>12} {2:>12} {3:>11}'.format('benchmark', 'ns/op', 'median', 'objects/op')
+    for name in names:
+        result = run(name, args.repeat, args.min_time)
+        if args.json:
+            print json.dumps(result)
+        else:
+            print '{name:<32} {ns_per_op:>12.1f} {median_ns_per_op:>12.1f} {objects_per_op:>11.2f}'.format(**result)
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
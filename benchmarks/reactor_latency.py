@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Compares message round trip latency of brutal on different reactors.
+
+A client sends '!ping' lines over a loopback TCP connection to a fake
+protocol backend feeding a bot, the bot's reply goes back the same way. Each
+reactor runs in a process of its own, since a process can only install one.
+
+    $ python benchmarks/reactor_latency.py -n 5000 -r default -r poll -r asyncio
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WARMUP = 200
+
+
+def ping(event):
+    return 'pong'
+
+
+def run(reactor_name, count):
+    """
+    runs the benchmark on one reactor, prints the round trip times in json
+    """
+    from brutal.core.runtime import install_reactor
+    reactor = install_reactor(reactor_name)
+
+    from twisted.internet import protocol
+    from twisted.protocols import basic
+
+    from brutal.conf import config
+    from brutal.core.bot import Bot
+    from brutal.core.plugin import cmd
+
+    config.configure()
+
+    bot = Bot('bench', [])
+    bot.plugin_manager._build_parser([('ping', cmd(ping))], sys.modules[__name__], __name__)
+
+    def process_action(action):
+        action.source_event.raw_details['connection'].sendLine(action.meta['body'])
+    bot.process_action = process_action
+
+    class BotSide(basic.LineReceiver):
+        def lineReceived(self, line):
+            bot.new_event({'type': 'message', 'source': 'room', 'channel': '#bench', 'connection': self,
+                           'meta': {'body': line, 'recipients': []}})
+
+    class ClientSide(basic.LineReceiver):
+        def connectionMade(self):
+            self.times = []
+            self.send()
+
+        def send(self):
+            self.sent = time.time()
+            self.sendLine('!ping')
+
+        def lineReceived(self, line):
+            self.times.append(time.time() - self.sent)
+            if len(self.times) < WARMUP + count:
+                self.send()
+            else:
+                print json.dumps({'reactor': reactor.__class__.__name__, 'times': self.times[WARMUP:]})
+                reactor.stop()
+
+    server = protocol.ServerFactory()
+    server.protocol = BotSide
+    port = reactor.listenTCP(0, server, interface='127.0.0.1')
+
+    client = protocol.ClientFactory()
+    client.protocol = ClientSide
+    reactor.connectTCP('127.0.0.1', port.getHost().port, client)
+    reactor.run()
+
+
+def percentile(times, fraction):
+    return times[min(int(len(times) * fraction), len(times) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='message round trip latency per reactor')
+    parser.add_argument('-n', '--messages', type=int, default=5000, help='round trips to time')
+    parser.add_argument('-r', '--reactor', action='append', dest='reactors',
+                        help='reactor to try, see brutal.core.runtime (default: default and asyncio)')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run, args.messages)
+        return
+
+    print '{0:<10} {1:<24} {2:>10} {3:>10} {4:>10}'.format('reactor', 'class', 'mean ms', 'p50 ms', 'p99 ms')
+    for name in args.reactors or ['default', 'asyncio']:
+        child = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run', name,
+                                  '-n', str(args.messages)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = child.communicate()
+        if child.returncode != 0:
+            error = err.strip().splitlines()[-1] if err.strip() else 'exit code {0}'.format(child.returncode)
+            print '{0:<10} unavailable: {1}'.format(name, error)
+            continue
+
+        result = json.loads(out.strip().splitlines()[-1])
+        times = sorted(result['times'])
+        print '{0:<10} {1:<24} {2:>10.3f} {3:>10.3f} {4:>10.3f}'.format(
+            name, result['reactor'], 1000 * sum(times) / len(times), 1000 * percentile(times, 0.5),
+            1000 * percentile(times, 0.99))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,7 @@ import os
 import logging
 
 from brutal.conf import global_config
+from brutal.core.runtime import install_reactor
 
 ENV_VAR = 'BRUTAL_CONFIG_MODULE'
 
@@ -69,6 +70,10 @@ class BrutalConfig(object):
             if setting == setting.upper():
                 setattr(self, setting, getattr(config, setting))
 
+        # plugins import the reactor, so the configured one has to be in
+        # place before they get loaded
+        install_reactor(getattr(self, 'REACTOR', None))
+
         INSTALLED_PLUGINS = getattr(self, 'INSTALLED_PLUGINS', [])
         # bots = getattr(self, 'BOTS', None)
         # self.log.debug('bots: {0!r}'.format(bots))
@@ -12,6 +12,29 @@ LOG_FORMAT = LOG_FORMAT.format('asctime',
                                'thread',
                                'message')
 
+# twisted reactor to run on: None for the platform default, or one of
+# 'select', 'poll', 'epoll', 'kqueue', 'asyncio' (see brutal.core.runtime)
+REACTOR = None
+
+# serve prometheus metrics over http on this port, None to turn it off. with
+# --supervise every bot gets its own port: METRICS_PORT + its index in BOTS
+METRICS_PORT = None
+METRICS_INTERFACE = '127.0.0.1'
+
+# supervisor mode (brutal-overlord run --supervise), in seconds
+SUPERVISOR_HEARTBEAT_INTERVAL = 5.0
+SUPERVISOR_HEARTBEAT_TIMEOUT = 30.0
+
+# handlers decorated with process=True, timeout in seconds
+PROCESS_POOL_SIZE = 2
+PROCESS_POOL_TIMEOUT = 30.0
+PROCESS_POOL_MAX_TASKS = 100  # replace a worker process after this many calls
+
+# profiling runs started by kill -USR1 or the profile command, in seconds
+PROFILE_DURATION = 30.0
+PROFILE_TOP = 10  # slowest handlers to report
+PROFILE_MAX_DURATION = 600.0  # longer runs get cut to this
+
 INSTALLED_PLUGINS = ()
 DATA_DIR = './data/'
 STORAGE_SUFFIX = '.db'
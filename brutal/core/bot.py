@@ -1,4 +1,5 @@
 import uuid
+import signal
 import logging
 
 from twisted.internet import reactor
@@ -7,6 +8,11 @@ from brutal.core.connections import ConnectionManager
 
 from brutal.core.plugin import PluginManager
 from brutal.core.models import Event, Action
+from brutal.core.queues import BatchQueue, FairQueue
+from brutal.core.workers import WorkerPool
+from brutal.core.tracing import Tracer
+from brutal.core.metrics import QUEUE_DEPTH, QUEUE_ITEMS, QUEUE_DROPPED, start_server, watch_thread_pool
+from brutal.core.profiling import profiler, handler_summary
 
 from brutal.core.constants import *
 
@@ -30,18 +36,62 @@ class Bot(object):
         #bot manager instance
         self.bot_manager = None
 
+        # max number of queued items handled in one go before yielding
+        # back to the reactor
+        self.queue_drain_limit = kwargs.get('queue_drain_limit', DEFAULT_QUEUE_DRAIN_LIMIT)
+        self.queue_stats = {}
+
+        # event queue bounds, None means unbounded. on overflow the policy
+        # decides whether to drop events or to pause reading from the
+        # connections until the queue is down to the low water mark
+        self.event_queue_size = kwargs.get('event_queue_size')
+        self.event_queue_policy = kwargs.get('event_queue_policy', QUEUE_DROP_OLDEST)
+        if self.event_queue_policy not in QUEUE_POLICIES:
+            self.log.error('unknown event_queue_policy {0!r}, using {1!r}'.format(self.event_queue_policy,
+                                                                                 QUEUE_DROP_OLDEST))
+            self.event_queue_policy = QUEUE_DROP_OLDEST
+        self.event_queue_low_water = kwargs.get('event_queue_low_water')
+        if self.event_queue_low_water is None and self.event_queue_size:
+            self.event_queue_low_water = self.event_queue_size // 2
+        self.reading_paused = False
+
         # setup this bots event queue / consumer, action queue/consumer
-        self.event_queue = defer.DeferredQueue()
+        # with fair scheduling, events are taken round-robin per room
+        # instead of in arrival order, room_weights gives busy rooms a
+        # bigger share
+        if kwargs.get('fair_scheduling', False):
+            self.event_queue = FairQueue(weights=kwargs.get('room_weights'))
+        else:
+            self.event_queue = BatchQueue()
         self._consume_events(self.event_queue)
 
-        self.action_queue = defer.DeferredQueue()
+        self.action_queue = BatchQueue()
         self._consume_actions(self.action_queue)
 
+        # per stage latency of events and the actions answering them, with
+        # a fraction of the traces (and the slow ones) logged
+        self.tracer = None
+        if kwargs.get('tracing', False):
+            self.tracer = Tracer(self.nick, sample_rate=kwargs.get('trace_sample_rate', 0.0),
+                                 slow_threshold=kwargs.get('trace_slow_threshold'))
+
+        # handlers and plugin tasks still running after handler_timeout
+        # seconds get cancelled, and handler_timeout_reply (if any) is sent
+        # instead. decorators can set their own timeout, None turns it off
+        self.handler_timeout = kwargs.get('handler_timeout', DEFAULT_HANDLER_TIMEOUT)
+        self.handler_timeout_reply = kwargs.get('handler_timeout_reply')
+
         # setup plugins
         self.enabled_plugins = kwargs.get('enabled_plugins')
         self.plugin_manager = PluginManager(bot=self)
         # self.manager.config.PLUGINS:
 
+        # run plugins in worker processes instead of in the reactor thread
+        self.worker_pool = None
+        plugin_workers = kwargs.get('plugin_workers')
+        if plugin_workers:
+            self.worker_pool = WorkerPool(bot=self, size=int(plugin_workers))
+
         # build connections
         # TODO: create connection manager
         self.connection_manager = ConnectionManager(config=connections,
@@ -62,11 +112,18 @@ class Bot(object):
 
     # CORE
 
-    def start(self):
+    def start(self, connect=True):
+        """
+        starts the plugins and connects, replays start without connecting
+        """
         #TODO: catch failures?
         #TODO: pass enabled plugins
-        self.plugin_manager.start(self.enabled_plugins)
-        self.connection_manager.connect()
+        if self.worker_pool is not None:
+            self.worker_pool.start()
+        else:
+            self.plugin_manager.start(self.enabled_plugins)
+        if connect:
+            self.connection_manager.connect()
         self.state = ON
 
     # review
@@ -94,43 +151,137 @@ class Bot(object):
 
     def shutdown(self, *args, **kwargs):
         """A method that is called on bot shutdown"""
+        if self.worker_pool is not None:
+            self.worker_pool.stop()
         self.plugin_manager.shutdown(*args, **kwargs)
 
     def update(self):
         """A method that is called on update from the bot manager."""
         self.plugin_manager.update()
 
+    # QUEUES
+    def _consume_queue(self, queue, handler, name, drained=None):
+        """
+        drains everything waiting on queue in one loop, up to
+        queue_drain_limit items per reactor turn, passing each item to
+        handler. the number of items each drain handled ends up in
+        queue_stats[name]. if given, drained is called after every drain.
+        """
+        stats = self.queue_stats[name] = {'drains': 0, 'items': 0, 'last': 0, 'max': 0, 'dropped': 0}
+        if isinstance(queue, FairQueue):
+            stats['rooms'] = queue.stats
+
+        # read when the metrics get scraped
+        QUEUE_DEPTH.labels(self.nick, name).set_function(queue.__len__)
+        QUEUE_ITEMS.labels(self.nick, name).set_function(lambda: stats['items'])
+        QUEUE_DROPPED.labels(self.nick, name).set_function(lambda: stats['dropped'])
+
+        def drain(item):
+            limit = max(self.queue_drain_limit, 1)
+            batch = queue.take(limit - 1)
+
+            handled = 0
+            for queued in [item] + batch:
+                try:
+                    handler(queued)
+                except Exception as e:
+                    self.log.exception('failed handling {0} item {1!r}: {2!r}'.format(name, queued, e))
+                handled += 1
+
+            stats['drains'] += 1
+            stats['items'] += handled
+            stats['last'] = handled
+            stats['max'] = max(stats['max'], handled)
+            if handled > 1:
+                self.log.debug('drained {0} {1} on {2!r}'.format(handled, name, self))
+
+            if drained is not None:
+                drained()
+
+            # let other i/o run before picking up the rest
+            if len(queue):
+                reactor.callLater(0, drain, queue.take(1)[0])
+            else:
+                queue.get().addCallback(drain)
+        queue.get().addCallback(drain)
+
     # EVENT QUEUE
     # default event consumer queue.
     def _consume_events(self, queue):
-        def consumer(event):
-            # check if Event, else try to make it one
-            if not isinstance(event, Event):
-                try:
-                    event = self.build_event(event)
-                except Exception as e:
-                    self.log.exception('unable to parse data to Event, {0!r}: {1!r}'.format(event, e))
-                    event = None
-
-            if event is not None:
-                self.log.debug('EVENT on {0!r} {1!r}'.format(self, event))
-                responses = self.plugin_manager.process_event(event)
-                # this is going to be a list of deferreds,
-                # TODO: should probably do this differently
-                #self.log.debug('HERE: {0!r}'.format(responses))
-                for response in responses:
-                    #self.log.debug('adding response router')
-                    response.addCallback(self.route_response, event)
-
-            queue.get().addCallback(consumer)
-        queue.get().addCallback(consumer)
+        self._consume_queue(queue, self.handle_event, 'events', drained=self._events_drained)
+
+    def _events_drained(self):
+        if self.reading_paused and len(self.event_queue) <= self.event_queue_low_water:
+            self.log.info('event queue down to {0}, resuming reading'.format(len(self.event_queue)))
+            self.reading_paused = False
+            self.connection_manager.resume_reading()
+
+    def handle_event(self, event):
+        # check if Event, else try to make it one
+        if not isinstance(event, Event):
+            try:
+                event = self.build_event(event)
+            except Exception as e:
+                self.log.exception('unable to parse data to Event, {0!r}: {1!r}'.format(event, e))
+                event = None
+
+        if event is not None and self.worker_pool is not None:
+            self.worker_pool.process_event(event)
+        elif event is not None:
+            self.log.debug('EVENT on {0!r} {1!r}'.format(self, event))
+            responses = self.plugin_manager.process_event(event)
+            # this is going to be a list of deferreds,
+            # TODO: should probably do this differently
+            #self.log.debug('HERE: {0!r}'.format(responses))
+            for response in responses:
+                #self.log.debug('adding response router')
+                response.addCallback(self.route_response, event)
 
     def new_event(self, event):
         """
         this is what protocol backends call when they get an event.
         """
+        if self.event_queue_size:
+            if self.event_queue_policy == QUEUE_DROP_MESSAGES and not isinstance(event, Event):
+                # needs to know which events are commands, so build it now
+                event = self.build_event(event)
+                if event is None:
+                    return
+
+            if len(self.event_queue) >= self.event_queue_size:
+                if not self._event_queue_overflow(event):
+                    return
+
         self.event_queue.put(event)
 
+    def _event_queue_overflow(self, event):
+        """
+        applies event_queue_policy to a full event queue, returns whether the
+        new event should still be queued.
+        """
+        stats = self.queue_stats['events']
+
+        if self.event_queue_policy == QUEUE_PAUSE:
+            if not self.reading_paused:
+                self.log.warning('event queue full ({0}), pausing reading'.format(len(self.event_queue)))
+                self.reading_paused = True
+                self.connection_manager.pause_reading()
+            # lines already read off the wire still get queued
+            return True
+
+        if self.event_queue_policy == QUEUE_DROP_MESSAGES:
+            if event.event_type == 'message':
+                stats['dropped'] += 1
+                return False
+
+            if self.event_queue.drop(lambda queued: queued.event_type == 'message'):
+                stats['dropped'] += 1
+                return True
+
+        self.event_queue.drop()
+        stats['dropped'] += 1
+        return True
+
     def build_event(self, event_data):
         # todo: needs to be safe
         try:
@@ -138,24 +289,25 @@ class Bot(object):
         except Exception as e:
             self.log.exception('failed to build event from {0!r}: {1!r}'.format(event_data, e))
         else:
+            if self.tracer is not None:
+                e.trace = self.tracer.start(received=event_data.get('received'))
             return e
 
     # ACTION QUEUE
     # default action consumer
     def _consume_actions(self, queue):
-        def consumer(action):
-            # check if Action, else try to make it one
-            if not isinstance(action, Action):
-                try:
-                    action = self.build_action(action)
-                except Exception as e:
-                    self.log.exception('unable to build Action with {0!r}: {1!r}'.format(action, e))
+        self._consume_queue(queue, self.handle_action, 'actions')
 
-            if action is not None:
-                res = defer.maybeDeferred(self.process_action, action)
+    def handle_action(self, action):
+        # check if Action, else try to make it one
+        if not isinstance(action, Action):
+            try:
+                action = self.build_action(action)
+            except Exception as e:
+                self.log.exception('unable to build Action with {0!r}: {1!r}'.format(action, e))
 
-            queue.get().addCallback(consumer)
-        queue.get().addCallback(consumer)
+        if action is not None:
+            res = defer.maybeDeferred(self.process_action, action)
 
     def build_action(self, action_data, event=None):
         if type(action_data) in (str, unicode):
@@ -172,6 +324,8 @@ class Bot(object):
             self.log.debug('got {0!r} from {1!r}'.format(response, event))
             #TODO: update to actually route to correct bot, for now we just assume its ours
             if isinstance(response, Action):
+                if response.trace is not None:
+                    response.trace.mark('routed')
                 self.action_queue.put(response)
             else:
                 self.log.error('got invalid response type')
@@ -189,13 +343,18 @@ class BotManager(object):
     Handles herding of all bottes, responsible for spinning up and shutting down
     """
     #TODO: fill this out, needs to read config or handle config object?
-    def __init__(self, config=None):
+    def __init__(self, config=None, bot_nicks=None):
+        """
+        bot_nicks limits the manager to the given bots of the config, used when
+        each bot runs in its own process.
+        """
         if config is None:
             raise AttributeError("No config passed to manager.")
 
         self.log = logging.getLogger('{0}.{1}'.format(self.__class__.__module__, self.__class__.__name__))
 
         self.config = config
+        self.bot_nicks = bot_nicks
         self.log.debug('config: {0!r}'.format(self.config))
 
         self.bots = {}
@@ -226,6 +385,8 @@ class BotManager(object):
         if bots is not None and isinstance(bots, list):
             for bot_config in bots:
                 if isinstance(bot_config, dict):
+                    if self.bot_nicks is not None and bot_config.get('nick') not in self.bot_nicks:
+                        continue
                     self.create_bot(**bot_config)
         else:
             self.log.warning('no bots found in configuration')
@@ -254,12 +415,64 @@ class BotManager(object):
         starts the manager
         """
         self.start_bots()
+        self.start_metrics()
+
+        # kill -USR1 profiles the running bots, see profile
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: reactor.callFromThread(self.profile))
 
         loop = task.LoopingCall(self.update)
         loop.start(30.0)
 
         reactor.run()
 
+    def start_metrics(self):
+        """
+        serves brutal.core.metrics on METRICS_PORT. when each bot runs in its
+        own process, a bot uses METRICS_PORT plus its position in BOTS.
+        """
+        port = getattr(self.config, 'METRICS_PORT', None)
+        if not port:
+            return
+
+        if self.bot_nicks:
+            nicks = [bot.get('nick') for bot in self.config.BOTS if isinstance(bot, dict)]
+            if self.bot_nicks[0] in nicks:
+                port += nicks.index(self.bot_nicks[0])
+
+        watch_thread_pool('reactor', reactor.getThreadPool())
+        interface = getattr(self.config, 'METRICS_INTERFACE', '127.0.0.1')
+        try:
+            start_server(port, interface)
+        except Exception as e:
+            self.log.exception('failed to serve metrics on {0}:{1}: {2!r}'.format(interface, port, e))
+        else:
+            self.log.info('serving metrics on http://{0}:{1}/metrics'.format(interface, port))
+
+    def profile(self, duration=None, top=None):
+        """
+        profiles the process for duration seconds (PROFILE_DURATION by
+        default, PROFILE_MAX_DURATION at most) and logs the slowest handlers
+        once done, see brutal.core.profiling. returns a deferred firing with
+        the summary lines.
+        """
+        duration = min(duration or self.config.PROFILE_DURATION, self.config.PROFILE_MAX_DURATION)
+        top = top or self.config.PROFILE_TOP
+        name = '-'.join(sorted(self.bots)) or 'brutal'
+
+        def summarize(result):
+            path, stats = result
+            parsers = []
+            for bot in self.bots.values():
+                for event_parsers in bot['bot'].plugin_manager.event_parsers.values():
+                    parsers.extend(event_parsers)
+
+            lines = handler_summary(stats, parsers, top)
+            self.log.info('profile written to {0}, slowest handlers:\n{1}'.format(path, '\n'.join(lines) or 'none'))
+            return lines
+
+        return profiler.start(duration, self.config.DATA_DIR, name).addCallback(summarize)
+
     def shutdown(self, *args, **kwargs):
         """A method that is called on shutdown"""
         self.log.info("Shutting down ...")
@@ -0,0 +1,59 @@
+"""
+Caches the replies of commands whose answer only depends on their arguments
+for a while, see the cache_ttl of cmd. The PluginManager looks a command up
+before running its handler and stores the reply once it's there.
+"""
+from collections import OrderedDict
+
+from brutal.core.tracing import clock
+
+DEFAULT_CACHE_SIZE = 128
+
+
+class ResponseCache(object):
+    """
+    LRU of up to size replies, each expiring ttl seconds after it was stored
+    """
+    def __init__(self, ttl, size=None):
+        self.ttl = ttl
+        self.size = size or DEFAULT_CACHE_SIZE
+
+        # key -> (expires, reply), least recently used first
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
+    def __repr__(self):
+        return '<{0}: {1}/{2}, ttl {3}s>'.format(self.__class__.__name__, len(self.entries), self.size, self.ttl)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        the reply stored for key, None if there's none or it expired
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.stats['misses'] += 1
+            return
+
+        expires, reply = entry
+        if expires <= clock():
+            self.stats['expired'] += 1
+            self.stats['misses'] += 1
+            return
+
+        # back to the most recently used end
+        self.entries[key] = entry
+        self.stats['hits'] += 1
+        return reply
+
+    def put(self, key, reply):
+        self.entries.pop(key, None)
+        self.entries[key] = (clock() + self.ttl, reply)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        self.entries.clear()
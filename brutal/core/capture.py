@@ -0,0 +1,250 @@
+"""
+Recording raw protocol traffic and replaying it through a bot.
+
+With log_traffic on an irc connection, every line the bot receives gets
+appended to a capture file as '<unix time> <line>', one per line. Replaying a
+capture feeds the lines back into the connection's protocol, with no network
+behind it, either as they were timed (optionally sped up) or as fast as the
+bot takes them. See brutal-overlord replay.
+"""
+import os
+import time
+import logging
+
+from twisted.internet import reactor, defer, address
+
+# seconds between flushes of a capture file
+FLUSH_INTERVAL = 1.0
+
+
+class CaptureWriter(object):
+    """
+    appends timestamped lines to a capture file, opened on the first line
+    """
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.log = logging.getLogger('{0}.{1}'.format(self.__class__.__module__, self.__class__.__name__))
+        self.path = path
+        self.flush_interval = flush_interval
+        self.file = None
+        self.failed = False
+        self.flushed = 0
+        self.lines = 0
+
+    def __repr__(self):
+        return '<{0} {1}: {2} lines>'.format(self.__class__.__name__, self.path, self.lines)
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.file = open(self.path, 'ab')
+        self.log.info('capturing traffic to {0}'.format(self.path))
+
+    def write(self, line, at=None):
+        if self.file is None:
+            if self.failed:
+                return
+            try:
+                self.open()
+            except (IOError, OSError) as e:
+                self.log.error('unable to open capture {0}: {1!r}'.format(self.path, e))
+                self.failed = True
+                return
+
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        now = time.time()
+        self.file.write('{0:.6f} {1}\n'.format(now if at is None else at, line))
+        self.lines += 1
+
+        if now - self.flushed >= self.flush_interval:
+            self.file.flush()
+            self.flushed = now
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_capture(path):
+    """
+    yields (timestamp, line) of the records in a capture file, skipping the
+    ones that can't be parsed, e.g. a last line cut short
+    """
+    with open(path, 'rb') as capture:
+        for record in capture:
+            at, separator, line = record.rstrip('\n').partition(' ')
+            if not separator:
+                continue
+            try:
+                at = float(at)
+            except ValueError:
+                continue
+            yield at, line
+
+
+class Replayer(object):
+    """
+    hands captured lines to deliver. with a speed, lines keep the time
+    between them, divided by speed. without one they go as fast as possible,
+    batch lines per reactor turn. pause and resume are the producer side of
+    the replay, the bot pauses it when its event queue is full.
+    """
+    def __init__(self, records, deliver, speed=None, batch=100):
+        self.records = iter(records)
+        self.deliver = deliver
+        self.speed = speed
+        self.batch = batch
+
+        self.next_record = None
+        self.first = None
+        self.started = None
+        self.paused_at = None
+        self.call = None
+        self.count = 0
+        self.done = defer.Deferred()
+
+    def __repr__(self):
+        return '<{0}: {1} lines>'.format(self.__class__.__name__, self.count)
+
+    @property
+    def finished(self):
+        return self.done.called
+
+    def start(self):
+        """
+        returns a deferred firing with the number of lines replayed
+        """
+        self.started = reactor.seconds()
+        self.step()
+        return self.done
+
+    def pause(self):
+        if self.paused_at is None and not self.finished:
+            self.paused_at = reactor.seconds()
+            if self.call is not None and self.call.active():
+                self.call.cancel()
+            self.call = None
+
+    def resume(self):
+        if self.paused_at is not None:
+            # timed replays carry on where they stopped
+            self.started += reactor.seconds() - self.paused_at
+            self.paused_at = None
+            self.call = reactor.callLater(0, self.step)
+
+    def step(self):
+        self.call = None
+        delivered = 0
+        while self.paused_at is None:
+            if self.next_record is None:
+                try:
+                    self.next_record = next(self.records)
+                except StopIteration:
+                    self.done.callback(self.count)
+                    return
+
+            if delivered >= self.batch:
+                self.call = reactor.callLater(0, self.step)
+                return
+
+            at, line = self.next_record
+            if self.speed:
+                if self.first is None:
+                    self.first = at
+                delay = (at - self.first) / self.speed - (reactor.seconds() - self.started)
+                if delay > 0:
+                    self.call = reactor.callLater(delay, self.step)
+                    return
+
+            self.next_record = None
+            self.count += 1
+            delivered += 1
+            self.deliver(line)
+
+
+class ReplayTransport(object):
+    """
+    transport of a protocol fed by a Replayer, counts and drops what the
+    protocol sends. messages counts the privmsgs and notices among the
+    lines, leaving out signing on and the like
+    """
+    disconnecting = False
+
+    def __init__(self, replayer=None):
+        self.replayer = replayer
+        self.written = 0
+        self.messages = 0
+
+    def write(self, data):
+        for line in data.split('\n')[:-1]:
+            self.written += 1
+            if line.startswith(('PRIVMSG ', 'NOTICE ')):
+                self.messages += 1
+
+    def writeSequence(self, data):
+        for chunk in data:
+            self.write(chunk)
+
+    def loseConnection(self):
+        pass
+
+    def getPeer(self):
+        return address.IPv4Address('TCP', '127.0.0.1', 0)
+
+    def getHost(self):
+        return address.IPv4Address('TCP', '127.0.0.1', 0)
+
+    def pauseProducing(self):
+        if self.replayer is not None:
+            self.replayer.pause()
+
+    def resumeProducing(self):
+        if self.replayer is not None:
+            self.replayer.resume()
+
+
+def replay(bot, path, speed=None):
+    """
+    replays a capture into the first irc connection of a started bot,
+    returns a deferred firing with a dict of replay stats once the capture
+    and the bot's queues are done.
+    """
+    from brutal.protocols.irc import IrcBackend
+
+    for backend in bot.connection_manager.clients.values():
+        if isinstance(backend, IrcBackend):
+            break
+    else:
+        return defer.fail(ValueError('{0!r} has no irc connection to replay into'.format(bot)))
+
+    # don't record the replay into a capture of its own, nor hold its
+    # replies back for a server that isn't there
+    backend.client.capture = None
+    backend.client.flood_rate = None
+    protocol = backend.client.buildProtocol(None)
+    replayer = Replayer(read_capture(path), protocol.lineReceived, speed=speed)
+    transport = ReplayTransport(replayer)
+    protocol.makeConnection(transport)
+
+    started = time.time()
+    result = defer.Deferred()
+
+    def drained(count, replayed=None):
+        if len(bot.event_queue) or len(bot.action_queue) or backend.action_queue.pending:
+            reactor.callLater(0.01, drained, count, replayed)
+            return
+
+        elapsed = time.time() - started
+        result.callback({'lines': count,
+                         'seconds': elapsed,
+                         'replay_seconds': replayed,
+                         'lines_per_second': count / elapsed if elapsed else None,
+                         'sent': transport.messages})
+
+    def finished(count):
+        drained(count, time.time() - started)
+
+    replayer.start().addCallback(finished)
+    return result
@@ -84,12 +84,29 @@ class ConnectionManager(object):
         """
         pass
 
+    def pause_reading(self):
+        """
+        stops reading incoming data on all clients
+        """
+        for conn_id, conn in self.clients.items():
+            conn.pause_reading()
+
+    def resume_reading(self):
+        """
+        resumes reading incoming data on all clients
+        """
+        for conn_id, conn in self.clients.items():
+            conn.resume_reading()
+
     def route_action(self, action):
         if isinstance(action, Action):
             self.log.debug('destination_bots: {0!r}'.format(action.destination_bots))
             self.log.debug('destination_client_ids: {0!r}'.format(action.destination_client_ids))
             self.log.debug('destination_rooms: {0!r}'.format(action.destination_rooms))
 
+            if action.trace is not None:
+                action.trace.mark('dispatched')
+
             if self.bot in action.destination_bots:
                 for client_id in action.destination_client_ids:
                     if client_id in self.clients:
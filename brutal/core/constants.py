@@ -4,4 +4,18 @@ DISCONNECTED = 20
 CONNECTED = 30
 
 DEFAULT_EVENT_VERSION = 1
-DEFAULT_ACTION_VERSION = 1
\ No newline at end of file
+DEFAULT_ACTION_VERSION = 1
+DEFAULT_QUEUE_DRAIN_LIMIT = 100
+
+# seconds a handler or plugin task gets before it's cancelled
+DEFAULT_HANDLER_TIMEOUT = 60.0
+
+# backoff for restarting crashed child processes, in seconds
+DEFAULT_RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+
+# event queue overflow policies
+QUEUE_DROP_OLDEST = 'drop_oldest'
+QUEUE_DROP_MESSAGES = 'drop_messages'
+QUEUE_PAUSE = 'pause'
+QUEUE_POLICIES = (QUEUE_DROP_OLDEST, QUEUE_DROP_MESSAGES, QUEUE_PAUSE)
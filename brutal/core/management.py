@@ -69,11 +69,18 @@ def spawn_command(spawn_name):
 
 
 #TODO: get rid of config_name, rename func to start_bots
-def run_command(config_name):
+def run_command(config_name, supervise=False):
     import brutal.run
     from brutal.conf import config
 
-    brutal.run.main(config)
+    brutal.run.main(config, supervise=supervise)
+
+
+def replay_command(capture, nick=None, speed=None):
+    import brutal.run
+    from brutal.conf import config
+
+    brutal.run.replay(config, capture, nick=nick, speed=speed)
 
 
 # django general design pattern mimicked
@@ -95,7 +102,17 @@ class Overlord(object):
         spawn_cmd.add_argument('name', action='store', help='new bot spawn name')
 
         # run
-        subparsers.add_parser('run', help='run the bot in the cwd')
+        run_cmd = subparsers.add_parser('run', help='run the bot in the cwd')
+        run_cmd.add_argument('--supervise', action='store_true',
+                             help='run each bot in its own process, restarting it if it dies or hangs')
+
+        # replay
+        replay_cmd = subparsers.add_parser('replay', help='replay captured traffic through a bot, without a network')
+        replay_cmd.add_argument('capture', action='store', help='capture file recorded with log_traffic')
+        replay_cmd.add_argument('--bot', help='nick of the bot to replay into (default: the first one)')
+        replay_cmd.add_argument('--speed', type=float,
+                                help='replay at this many times the captured pace, 1 is real time '
+                                     '(default: as fast as possible)')
 
         return parser
 
@@ -109,7 +126,7 @@ class Overlord(object):
             config = parsed_args.config or config_name
             if config is None:
                 raise
-            run_command(config)
+            run_command(config, supervise=parsed_args.supervise)
 
         elif command == 'spawn':
             project_name = parsed_args.name
@@ -117,6 +134,9 @@ class Overlord(object):
 
             spawn_command(project_name)
 
+        elif command == 'replay':
+            replay_command(parsed_args.capture, nick=parsed_args.bot, speed=parsed_args.speed)
+
 
 def exec_overlord(config_name=None):
     overlord = Overlord()
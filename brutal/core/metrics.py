@@ -0,0 +1,236 @@
+"""
+Runtime numbers of the bot, in the Prometheus text format.
+
+Metrics are registered once in a Registry and updated through their labeled
+children, which the hot paths keep around, so an update is an attribute add
+or a histogram bucket lookup. Things that are already counted somewhere, like
+queue depths, are gauges reading them with a function when scraped.
+
+With METRICS_PORT set, BotManager serves the registry over http.
+"""
+import logging
+from collections import OrderedDict
+
+from brutal.core.tracing import Histogram, DEFAULT_BUCKETS
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        if value.is_integer():
+            return str(int(value))
+        return repr(value)
+    return str(value)
+
+
+def escape_label(value):
+    return unicode(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(names, values, extra=None):
+    pairs = zip(names, values)
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return u'{{{0}}}'.format(u','.join(u'{0}="{1}"'.format(name, escape_label(value)) for name, value in pairs))
+
+
+class Value(object):
+    """
+    value of a counter or gauge, or a function returning it
+    """
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        # label values -> child
+        self.children = OrderedDict()
+
+    def __repr__(self):
+        return '<{0} {1}>'.format(self.__class__.__name__, self.name)
+
+    def labels(self, *values):
+        """
+        the child for the given label values, created on first use
+        """
+        if len(values) != len(self.label_names):
+            raise ValueError('{0} takes labels {1!r}'.format(self.name, self.label_names))
+
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.new_child()
+        return child
+
+    def remove(self, *values):
+        self.children.pop(values, None)
+
+    def new_child(self):
+        return Value()
+
+    def samples(self, log):
+        """
+        lines of the metric's samples in the text format
+        """
+        for values, child in self.children.items():
+            try:
+                value = child.get()
+            except Exception as e:
+                log.error('failed to read {0} {1!r}: {2!r}'.format(self.name, values, e))
+                continue
+            if value is not None:
+                yield u'{0}{1} {2}'.format(self.name, format_labels(self.label_names, values), format_value(value))
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+
+class HistogramMetric(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, description, labels)
+        self.buckets = buckets
+
+    def new_child(self):
+        return Histogram(self.buckets)
+
+    def samples(self, log):
+        for values, histogram in self.children.items():
+            seen = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                seen += count
+                yield u'{0}_bucket{1} {2}'.format(self.name,
+                                                  format_labels(self.label_names, values, ('le', format_value(bound))),
+                                                  seen)
+            labels = format_labels(self.label_names, values)
+            yield u'{0}_sum{1} {2}'.format(self.name, labels, format_value(histogram.sum))
+            yield u'{0}_count{1} {2}'.format(self.name, labels, histogram.count)
+
+
+class Registry(object):
+    """
+    the metrics there are, registering one that exists returns it
+    """
+    def __init__(self):
+        self.log = logging.getLogger('{0}.{1}'.format(self.__class__.__module__, self.__class__.__name__))
+        self.metrics = OrderedDict()
+
+    def __repr__(self):
+        return '<{0}: {1} metrics>'.format(self.__class__.__name__, len(self.metrics))
+
+    def register(self, metric):
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            if existing.kind != metric.kind or existing.label_names != metric.label_names:
+                raise ValueError('{0} already registered as a different metric'.format(metric.name))
+            return existing
+
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labels=()):
+        return self.register(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=()):
+        return self.register(Gauge(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(HistogramMetric(name, description, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(u'# HELP {0} {1}'.format(metric.name, metric.description))
+            lines.append(u'# TYPE {0} {1}'.format(metric.name, metric.kind))
+            lines.extend(metric.samples(self.log))
+        return u'\n'.join(lines).encode('utf-8') + '\n'
+
+
+registry = Registry()
+
+# metrics of the core, labeled by bot nick
+QUEUE_DEPTH = registry.gauge('brutal_queue_depth', 'items waiting in a queue of the bot', ('bot', 'queue'))
+QUEUE_ITEMS = registry.counter('brutal_queue_items_total', 'items taken off a queue of the bot', ('bot', 'queue'))
+QUEUE_DROPPED = registry.counter('brutal_queue_dropped_total', 'items dropped from a full queue', ('bot', 'queue'))
+CONNECTION_QUEUE_DEPTH = registry.gauge('brutal_connection_queue_depth', 'actions waiting to be sent on a connection',
+                                        ('bot', 'protocol', 'client'))
+SEND_QUEUE_DEPTH = registry.gauge('brutal_send_queue_depth', 'lines held back by flood control, per priority lane',
+                                  ('bot', 'client', 'lane'))
+SEND_DROPPED = registry.counter('brutal_send_dropped_total', 'lines dropped from a full flood control lane',
+                                ('bot', 'client', 'lane'))
+RECONNECTS = registry.counter('brutal_reconnects_total', 'connections lost or failed', ('bot', 'protocol'))
+HANDLER_SECONDS = registry.histogram('brutal_handler_seconds', 'time plugin handlers take until their response',
+                                     ('bot', 'handler'))
+HANDLER_ERRORS = registry.counter('brutal_handler_errors_total', 'plugin handler calls that failed',
+                                  ('bot', 'handler'))
+HANDLER_TIMEOUTS = registry.counter('brutal_handler_timeouts_total', 'plugin handler calls cancelled for taking too long',
+                                    ('bot', 'handler'))
+HANDLER_CACHE = registry.counter('brutal_handler_cache_total', 'response cache hits, misses, evictions and '
+                                 'expired replies of plugin handlers', ('bot', 'handler', 'result'))
+HANDLER_COALESCED = registry.counter('brutal_handler_coalesced_total', 'commands answered by a call of their handler '
+                                     'that was already running', ('bot', 'handler'))
+THREADS = registry.gauge('brutal_threads', 'threads busy with or calls waiting for handlers, per thread pool',
+                         ('pool', 'state'))
+
+
+def watch_thread_pool(name, pool):
+    """
+    exports the load of a twisted ThreadPool
+    """
+    THREADS.labels(name, 'active').set_function(lambda: len(pool.working))
+    THREADS.labels(name, 'queued').set_function(lambda: pool.q.qsize())
+
+
+def start_server(port, interface='127.0.0.1', metrics=None):
+    """
+    serves the registry over http on port, returns the listening port
+    """
+    from twisted.internet import reactor
+    from twisted.web import server, resource
+
+    metrics = metrics or registry
+
+    class MetricsResource(resource.Resource):
+        isLeaf = True
+
+        def render_GET(self, request):
+            request.setHeader('Content-Type', CONTENT_TYPE)
+            return metrics.render()
+
+    return reactor.listenTCP(port, server.Site(MetricsResource()), interface=interface)
@@ -66,7 +66,17 @@ class Event(object):
     """
     This is the generic object which is used to handle objects received
     Gets generated for every single event the bot _receives_.
+
+    Events are short lived and built for every line the bot sees, so they
+    use __slots__ and only split a command into cmd / args once something
+    actually asks for them.
     """
+    __slots__ = ('source_bot', 'raw_details', 'time_stamp', 'event_version',
+                 'event_type', 'source_client', 'source_client_id',
+                 'source_room', 'scope', 'source', 'meta', 'from_bot',
+                 '_cmd', '_args', '_cmd_body', '_cmd_skip', 'trace', 'timed_out')
+
+    log = logging.getLogger('{0}.Event'.format(__name__))
 
     def __init__(self, source_bot, raw_details):  # channel, type, meta=None, server_info=None, version=None):
         """
@@ -78,8 +88,6 @@ class Event(object):
             meta
             version
         """
-        self.log = logging.getLogger('{0}.{1}'.format(self.__class__.__module__, self.__class__.__name__))
-
         self.source_bot = source_bot
         self.raw_details = raw_details
         #self.raw_line =
@@ -87,8 +95,12 @@ class Event(object):
 
         self.event_version = DEFAULT_EVENT_VERSION
         self.event_type = None
-        self.cmd = None
-        self.args = None
+        self._cmd = None
+        self._args = None
+
+        # body still waiting to be split into cmd / args, see _split_cmd
+        self._cmd_body = None
+        self._cmd_skip = 0
 
         self.source_client = None
         self.source_client_id = None
@@ -100,6 +112,13 @@ class Event(object):
         self.meta = None
         self.from_bot = None
 
+        # brutal.core.tracing.Trace, set by bots with tracing on
+        self.trace = None
+
+        # sources (plugins or modules) of the handlers of the event that timed
+        # out, their late replies get dropped. None until one does
+        self.timed_out = None
+
         # TODO: move so that the bot actually calls this and passes in its list of accepted tokens
         self.parse_details()
 
@@ -118,6 +137,42 @@ class Event(object):
     def __str__(self):
         return repr(self)
 
+    @property
+    def cmd(self):
+        if self._cmd_body is not None:
+            self._split_cmd()
+        return self._cmd
+
+    @cmd.setter
+    def cmd(self, value):
+        if self._cmd_body is not None:
+            self._split_cmd()
+        self._cmd = value
+
+    @property
+    def args(self):
+        if self._cmd_body is not None:
+            self._split_cmd()
+        return self._args
+
+    @args.setter
+    def args(self, value):
+        if self._cmd_body is not None:
+            self._split_cmd()
+        self._args = value
+
+    def snapshot(self):
+        """
+        picklable copy of the details the event was built from, without the
+        client object. Event(bot, event.snapshot()) rebuilds the event for
+        another bot, e.g. in a worker process.
+        """
+        details = dict(self.raw_details)
+        details.pop('client', None)
+        details['client_id'] = self.source_client_id
+        details['channel'] = self.source_room
+        return details
+
     def parse_details(self):
         if not isinstance(self.raw_details, dict):
             raise TypeError
@@ -161,39 +216,45 @@ class Event(object):
             return match
 
     def parse_event_cmd(self, body, token=None):
+        """
+        decides whether body is a command. the body only gets split into
+        cmd / args later on, the first time one of them is read.
+        """
         token = token or '!'  # TODO: make this configurable
         if type(body) not in (str, unicode):
             return False
 
-        split = body.split()
+        stripped = body.lstrip()
 
-        if len(split):
+        if stripped:
 
-            if split[0].startswith(token) and self.source == 'room':
-                try:
-                    cmd = split[0][1:]
-                    args = split[1:]
-                except Exception as e:
-                    self.log.exception('failed parsing cmd from {0!r}: {1!r}'.format(body, e))
-                else:
-                    self.event_type = 'cmd'
-                    self.cmd = cmd
-                    self.args = args
-                    return True
-            elif self.source_bot.nick in self.meta['recipients']:
-                try:
-                    cmd = split[0]
-                    args = split[1:]
-                except Exception as e:
-                    self.log.exception('failed parsing cmd from {0!r}: {1!r}'.format(body, e))
-                else:
-                    self.event_type = 'cmd'
-                    self.cmd = cmd
-                    self.args = args
-                    return True
+            if stripped.startswith(token) and self.source == 'room':
+                skip = 1
+            elif self.source == 'highlight' or self.source_bot.nick in self.meta['recipients']:
+                # protocols mark messages addressed to the bot as highlights,
+                # its aliases and differently cased nick included
+                skip = 0
+            else:
+                return False
+
+            self.event_type = 'cmd'
+            self._cmd_body = body
+            self._cmd_skip = skip
+            return True
 
         return False
 
+    def _split_cmd(self):
+        body = self._cmd_body
+        self._cmd_body = None
+
+        try:
+            split = body.split()
+            self._cmd = split[0][self._cmd_skip:]
+            self._args = split[1:]
+        except Exception as e:
+            self.log.exception('failed parsing cmd from {0!r}: {1!r}'.format(body, e))
+
 
 class Action(object):
     """
@@ -205,15 +266,20 @@ class Action(object):
         join
         part
     """
+    __slots__ = ('source_bot', 'source_event', 'destination_bots', 'destination_client_ids', 'destination_rooms',
+                 'time_stamp', 'action_version', 'action_type', 'meta', 'scope', 'source', 'destination_room',
+                 'channel', 'type', 'trace')
+
+    log = logging.getLogger('{0}.Action'.format(__name__))
+
     def __init__(self, source_bot, source_event=None, destination_bots=None, destination_client_ids=None, rooms=None,
                  action_type=None, meta=None):
         """
         represents an action that the bot should handle.
         """
-        self.log = logging.getLogger('{0}.{1}'.format(self.__class__.__module__, self.__class__.__name__))
-
         self.source_bot = source_bot
         self.source_event = source_event
+        self.trace = self._fork_trace(source_event)
 
         #TODO: this logic is so broken. fix
         # default to source_bot if no destinations given
@@ -271,13 +337,56 @@ class Action(object):
                 self.destination_rooms.append(self.source_event.meta['nick'])
 
 
-
-        self.log.debug('source_event {0!r}'.format(self.source_event))
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('source_event {0!r}'.format(self.source_event))
 
     def __repr__(self):
         return "<{0} {1}:{2} dest:{3}>".format(self.__class__.__name__, self.source_bot.nick, self.action_type,
                                                [bot.nick for bot in self.destination_bots])
 
+    def snapshot(self):
+        """
+        picklable copy of the action, including a snapshot of its source
+        event. see from_snapshot.
+        """
+        return {'destination_client_ids': self.destination_client_ids,
+                'destination_rooms': self.destination_rooms,
+                'time_stamp': self.time_stamp,
+                'action_version': self.action_version,
+                'action_type': self.action_type,
+                'meta': self.meta,
+                'scope': self.scope,
+                'source': self.source,
+                'source_event': self.source_event.snapshot() if self.source_event is not None else None}
+
+    @classmethod
+    def from_snapshot(cls, source_bot, details, source_event=None):
+        """
+        rebuilds an action made by snapshot for source_bot. the destinations
+        are taken as they are. without a source_event, one gets rebuilt from
+        the snapshot.
+        """
+        action = cls.__new__(cls)
+        action.source_bot = source_bot
+        action.destination_bots = [source_bot, ]
+        for key in ('destination_client_ids', 'destination_rooms', 'time_stamp', 'action_version', 'action_type',
+                    'meta', 'scope', 'source'):
+            setattr(action, key, details[key])
+
+        if source_event is None and details.get('source_event') is not None:
+            source_event = Event(source_bot=source_bot, raw_details=details['source_event'])
+        action.source_event = source_event
+        action.trace = cls._fork_trace(source_event)
+        return action
+
+    @staticmethod
+    def _fork_trace(source_event):
+        """
+        actions continue the trace of the event they answer
+        """
+        if source_event is not None and source_event.trace is not None:
+            return source_event.trace.fork('handled')
+
     def _is_valid(self):
         """
         check contents of action to ensure that it has all required fields.
@@ -3,9 +3,18 @@ import logging
 import inspect
 import functools
 from twisted.internet import reactor, task, defer, threads
+from twisted.python import failure
 from twisted.python.threadable import isInIOThread
 
 from brutal.core.models import Action, Event
+from brutal.core.pools import PluginThreadPool, ProcessPool
+from brutal.core.metrics import HANDLER_SECONDS, HANDLER_ERRORS, HANDLER_TIMEOUTS, \
+    HANDLER_CACHE, HANDLER_COALESCED
+from brutal.core.cache import ResponseCache
+from brutal.core.constants import DEFAULT_HANDLER_TIMEOUT
+from brutal.core.tracing import clock
+from brutal.core.profiling import profiler
+from brutal.core.ratelimit import LANE_TASK
 from brutal.conf import config
 
 import shelve
@@ -13,6 +22,67 @@ import os
 
 SRE_MATCH_TYPE = type(re.match("", ""))
 
+# characters that make a trigger a real pattern rather than a plain word
+REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+
+# coroutines (async def handlers and tasks) need python 3 and a twisted
+# with ensureDeferred
+iscoroutine = getattr(inspect, 'iscoroutine', None)
+ensureDeferred = getattr(defer, 'ensureDeferred', None)
+
+
+def as_deferred(result):
+    """
+    wraps whatever a handler or task returned in a deferred, coroutines get
+    driven by twisted through ensureDeferred
+    """
+    if isinstance(result, defer.Deferred):
+        return result
+    if iscoroutine is not None and ensureDeferred is not None \
+       and iscoroutine(result):
+        return ensureDeferred(result)
+    return defer.succeed(result)
+
+
+def literal_trigger(pattern):
+    """
+    returns the plain command a trigger pattern stands for, or None if the
+    pattern needs real regex matching. only fully anchored patterns such as
+    the ^name$ built by cmd() count as literal.
+    """
+    if not pattern or pattern[0] != '^' or pattern[-1] != '$':
+        return
+
+    literal = pattern[1:-1]
+    if not literal or REGEX_SPECIAL_CHARS.intersection(literal):
+        return
+
+    return literal
+
+
+def add_timeout(d, timeout, on_timeout=None):
+    """
+    cancels d unless it fires within timeout seconds, calling on_timeout
+    right before. returns d. results of work that keeps going after being
+    cancelled are ignored by the deferred.
+    """
+    if d.called:
+        return d
+
+    def expired():
+        if on_timeout is not None:
+            on_timeout()
+        d.cancel()
+    call = reactor.callLater(timeout, expired)
+
+    def finished(result):
+        if call.active():
+            call.cancel()
+        return result
+    d.addBoth(finished)
+    return d
+
 
 def threaded(func=None):
     """
@@ -32,9 +102,17 @@ def threaded(func=None):
         return decorator(func)
 
 
-def cmd(func=None, command=None, thread=False):
+def cmd(func=None, command=None, thread=False, process=False, timeout=None,
+        cache_ttl=None, cache_size=None, cache_per_room=False, coalesce=False):
     """
     this decorator is used to create a command the bot will respond to.
+
+    with cache_ttl, text replies are cached for that many seconds per
+    command and args (and room, with cache_per_room), keeping up to
+    cache_size of them.
+
+    with coalesce, the command waits for a call of the handler with the same
+    args that's still running, rather than making one of its own.
     """
     def decorator(func):
         func.__brutal_event = True
@@ -63,6 +141,19 @@ def cmd(func=None, command=None, thread=False):
         if thread is True:
             func.__brutal_threaded = True
 
+        if process is True:
+            func.__brutal_process = True
+
+        if timeout is not None:
+            func.__brutal_timeout = timeout
+
+        if cache_ttl:
+            func.__brutal_cache = {'ttl': cache_ttl, 'size': cache_size,
+                                   'per_room': cache_per_room}
+
+        if coalesce is True:
+            func.__brutal_coalesce = True
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
@@ -98,7 +189,7 @@ def cmd(func=None, command=None, thread=False):
 
 
 # make event_type required?
-def event(func=None, event_type=None, thread=False):
+def event(func=None, event_type=None, thread=False, process=False, timeout=None):
     """
     this decorator is used to register an event parser that the bot will
     respond to.
@@ -111,6 +202,12 @@ def event(func=None, event_type=None, thread=False):
         if thread is True:
             func.__brutal_threaded = True
 
+        if process is True:
+            func.__brutal_process = True
+
+        if timeout is not None:
+            func.__brutal_timeout = timeout
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
@@ -123,7 +220,7 @@ def event(func=None, event_type=None, thread=False):
 
 
 # TODO: maybe swap this to functools.partial
-def match(func=None, regex=None, thread=False):
+def match(func=None, regex=None, thread=False, process=False, timeout=None):
     """
     this decorator is used to create a command the bot will respond to.
     """
@@ -151,6 +248,12 @@ def match(func=None, regex=None, thread=False):
         if thread is True:
             func.__brutal_threaded = True
 
+        if process is True:
+            func.__brutal_process = True
+
+        if timeout is not None:
+            func.__brutal_timeout = timeout
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
@@ -189,8 +292,29 @@ class Parser(object):
 
         self.event_type = None
         self.regex = None
+        self.literal = None
         self.threaded = getattr(self.func, '__brutal_threaded', False)
+        self.process = getattr(self.func, '__brutal_process', False)
+        # seconds, None for the bot's handler_timeout
+        self.timeout = getattr(self.func, '__brutal_timeout', None)
+
+        # metrics children, set by the PluginManager
+        self.latency = None
+        self.errors = None
+        self.timeouts = None
         self.parse_bot_events = False
+
+        # ResponseCache of the replies, for commands with a cache_ttl
+        self.cache = None
+        self.cache_per_room = False
+        cache = getattr(self.func, '__brutal_cache', None)
+        if cache is not None:
+            self.cache = ResponseCache(cache['ttl'], cache['size'])
+            self.cache_per_room = cache['per_room']
+
+        # identical commands share a running call, see _run_coalesced
+        self.coalesce = getattr(self.func, '__brutal_coalesce', False)
+        self.coalesced = None
         self.command = getattr(self.func, '__brutal_command', None)
 
         cls = self.__class__
@@ -198,6 +322,14 @@ class Parser(object):
         self.log = logging.getLogger('{0}.{1}'.format(cls.__module__,
                                                       cls.__name__))
 
+        if self.process and inspect.ismethod(self.func):
+            # the process pool can only import module level functions
+            self.log.error('{0!r} of {1} can not run in a process, running '
+                           'it in a thread'.format(self.func_name,
+                                                   self.source_name))
+            self.process = False
+            self.threaded = True
+
         # future use:
         # if true, wont run any more parsers after this.
         # self.stop_parsing = False
@@ -216,6 +348,8 @@ class Parser(object):
             else:
                 # should probably check that its a compiled re
                 self.healthy = True
+                if self.event_type == 'cmd':
+                    self.literal = literal_trigger(self.regex.pattern)
         else:
             self.healthy = True
 
@@ -280,6 +414,108 @@ class Parser(object):
             return cls(func, source)
 
 
+class MessageMatcher(object):
+    """
+    runs the regexes of many message parsers in a single pass. every pattern
+    is wrapped in a lookahead followed by an empty marker group, so one match
+    against the combined regex tells which of the parsers match the text.
+    patterns that can't be combined safely (flags, named groups, backrefs)
+    are still matched one by one.
+    """
+    # sre in python 2 refuses patterns with 100 or more groups
+    MAX_GROUPS = 99
+    UNSAFE_REGEX = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+
+    def __init__(self, parsers):
+        self.log = logging.getLogger('{0}.{1}'.format(self.__class__.__module__,
+                                                      self.__class__.__name__))
+        self.parsers = [p for p in parsers if p.regex is not None]
+
+        # [(compiled regex, [(position, marker group), ...]), ...]
+        self.combined = []
+        # [(position, parser), ...] that are matched on their own
+        self.single = []
+
+        self._build()
+
+    def __repr__(self):
+        return '<{0}: {1} combined, {2} single>'.format(self.__class__.__name__,
+                                                        len(self.combined),
+                                                        len(self.single))
+
+    def _combinable(self, regex):
+        if regex.flags & ~re.UNICODE or regex.groupindex:
+            return False
+
+        if regex.groups + 1 > self.MAX_GROUPS:
+            return False
+
+        return self.UNSAFE_REGEX.search(regex.pattern) is None
+
+    def _build(self):
+        chunk = []
+        groups = 0
+
+        for position, parser in enumerate(self.parsers):
+            regex = parser.regex
+            if not self._combinable(regex):
+                self.single.append((position, parser))
+                continue
+
+            if groups + regex.groups + 1 > self.MAX_GROUPS:
+                self._add_chunk(chunk)
+                chunk = []
+                groups = 0
+
+            chunk.append((position, parser))
+            groups += regex.groups + 1
+
+        self._add_chunk(chunk)
+
+    def _add_chunk(self, chunk):
+        if not chunk:
+            return
+
+        parts = []
+        markers = []
+        group = 0
+        for position, parser in chunk:
+            parts.append('(?:(?={0})())?'.format(parser.regex.pattern))
+            group += parser.regex.groups + 1
+            markers.append((position, group))
+
+        try:
+            regex = re.compile(''.join(parts))
+        except Exception:
+            self.log.exception('failed to combine message regexes, matching'
+                               ' them one by one')
+            self.single.extend(chunk)
+            self.single.sort(key=lambda item: item[0])
+        else:
+            self.combined.append((regex, markers))
+
+    def candidates(self, text):
+        """
+        returns the parsers whose regex matches the start of text, in the
+        order they were given.
+        """
+        hits = []
+        for regex, markers in self.combined:
+            match = regex.match(text)
+            for position, group in markers:
+                if match.start(group) != -1:
+                    hits.append(position)
+
+        for position, parser in self.single:
+            if parser.match_with_regex(text) is not None:
+                hits.append(position)
+
+        if self.single and self.combined:
+            hits.sort()
+
+        return [self.parsers[position] for position in hits]
+
+
 class PluginManager(object):
     def __init__(self, bot):
         cls = self.__class__
@@ -288,9 +524,34 @@ class PluginManager(object):
         self.bot = bot
         self.event_parsers = {None: [], }
 
+        # cmd dispatch: literal command name -> [(position, parser), ...],
+        # only parsers with real patterns get scanned with their regex
+        self.cmd_index = {}
+        self.cmd_patterns = []
+
+        # combined matcher for message parsers, rebuilt on first use after
+        # new parsers get registered
+        self.message_matcher = None
+
         self.plugin_modules = {}
         self.plugin_instances = {}
 
+        # source (module or plugin instance) -> PluginThreadPool, None for
+        # sources using the reactor's shared thread pool
+        self.thread_pools = {}
+        # pool for process=True handlers, started on first use
+        self.process_pool = None
+
+        # (parser, cmd, args) -> deferreds of the commands waiting for the
+        # running call of a coalescing handler
+        self.in_flight = {}
+
+        # seconds handlers get by default, see add_timeout
+        self.handler_timeout = getattr(bot, 'handler_timeout',
+                                       DEFAULT_HANDLER_TIMEOUT)
+        self.handler_timeout_reply = getattr(bot, 'handler_timeout_reply',
+                                             None)
+
         self.status = None
 
         self.cmd_docs = {}
@@ -306,6 +567,15 @@ class PluginManager(object):
         for plugin, _ in self.plugin_instances.iteritems():
             plugin.close_storages()
 
+        for pool in self.thread_pools.values():
+            if pool is not None:
+                pool.stop()
+        self.thread_pools.clear()
+
+        if self.process_pool is not None:
+            self.process_pool.stop()
+            self.process_pool = None
+
     def update(self):
         """The metod which is executed every 30 seconds, gets propagated from
         BotManager."""
@@ -363,6 +633,97 @@ class PluginManager(object):
 
         self._register_plugins(self.plugin_modules, self.plugin_instances)
 
+    def _thread_pool_settings(self, source):
+        """
+        thread pool settings of a plugin module or instance, the bot config's
+        enabled_plugins entry wins over the plugin's own thread_pool
+        """
+        if inspect.ismodule(source):
+            module_name = source.__name__
+        else:
+            module_name = source.__class__.__module__
+
+        enabled_plugins = getattr(self.bot, 'enabled_plugins', None)
+        if isinstance(enabled_plugins, dict):
+            cfg = enabled_plugins.get(module_name)
+            if isinstance(cfg, dict) and cfg.get('thread_pool') is not None:
+                return cfg['thread_pool']
+
+        return getattr(source, 'thread_pool', None)
+
+    def thread_pool_for(self, source):
+        """
+        the dedicated thread pool of a plugin module or instance, None if it
+        didn't ask for one
+        """
+        try:
+            return self.thread_pools[source]
+        except KeyError:
+            pass
+
+        pool = None
+        settings = self._thread_pool_settings(source)
+        if settings:
+            if inspect.ismodule(source):
+                name = source.__name__
+            else:
+                name = '{0}.{1}'.format(source.__class__.__module__,
+                                        source.__class__.__name__)
+            try:
+                pool = PluginThreadPool.from_settings(name, settings)
+            except Exception:
+                self.log.exception('invalid thread pool settings {0!r} for '
+                                   '{1!r}'.format(settings, name))
+                pool = None
+            else:
+                pool.start()
+                self.log.debug('started {0!r}'.format(pool))
+
+        self.thread_pools[source] = pool
+        return pool
+
+    def defer_to_thread(self, source, func, *args, **kwargs):
+        """
+        runs func in the thread pool of source, or in the reactor's shared
+        one if source has none
+        """
+        func = profiler.wrap(func)
+        pool = self.thread_pool_for(source)
+        if pool is None:
+            return threads.deferToThread(func, *args, **kwargs)
+        return pool.run(func, *args, **kwargs)
+
+    def defer_to_process(self, func, event, *args):
+        """
+        runs func(event, *args) in the process pool, which gets started the
+        first time it's needed
+        """
+        if self.process_pool is None:
+            self.process_pool = ProcessPool(getattr(self.bot, 'nick', None),
+                                            config.PROCESS_POOL_SIZE,
+                                            config.PROCESS_POOL_TIMEOUT,
+                                            config.PROCESS_POOL_MAX_TASKS)
+        return self.process_pool.run(func, event, *args)
+
+    def thread_pool_stats(self):
+        return dict((pool.name, pool.stats())
+                    for pool in self.thread_pools.values()
+                    if pool is not None)
+
+    def cache_stats(self):
+        """
+        {'source.handler': cache stats} of the commands with a cache
+        """
+        stats = {}
+        for parsers in self.event_parsers.values():
+            for parser in parsers:
+                if parser.cache is not None:
+                    handler = '{0}.{1}'.format(parser.source_name,
+                                               parser.func_name)
+                    stats[handler] = dict(parser.cache.stats,
+                                          size=len(parser.cache))
+        return stats
+
     def _register_plugins(self, plugin_modules, plugin_instances):
         """
         TODO: add default plugins
@@ -413,42 +774,256 @@ class PluginManager(object):
                 continue
             else:
                 if parser is not None:
+                    handler = '{0}.{1}'.format(name, func_name)
+                    nick = getattr(self.bot, 'nick', None)
+                    parser.latency = HANDLER_SECONDS.labels(nick, handler)
+                    parser.errors = HANDLER_ERRORS.labels(nick, handler)
+                    parser.timeouts = HANDLER_TIMEOUTS.labels(nick, handler)
+                    if parser.cache is not None:
+                        self._watch_cache(parser, nick, handler)
+                    if parser.coalesce:
+                        parser.coalesced = HANDLER_COALESCED.labels(nick,
+                                                                    handler)
+
                     if parser.event_type in self.event_parsers:
                         self.event_parsers[parser.event_type].append(parser)
                     else:
                         self.event_parsers[parser.event_type] = [parser, ]
 
+                    self._index_parser(parser)
+
                     # let's recall the documentation (docstring) of a function
                     # so that we can get a quick help.
                     if parser.event_type == 'cmd' and\
                        parser.command is not None:
                         self.cmd_docs[parser.command] = func.__doc__
 
+    def _watch_cache(self, parser, nick, handler):
+        stats = parser.cache.stats
+        for result, key in (('hit', 'hits'), ('miss', 'misses'),
+                            ('eviction', 'evictions'), ('expired', 'expired')):
+            HANDLER_CACHE.labels(nick, handler, result).set_function(
+                lambda key=key: stats[key])
+
+    def _index_parser(self, parser):
+        """Adds a cmd parser to the dispatch index, keeping track of its
+        position so that responses keep the registration order."""
+        if parser.event_type == 'message':
+            self.message_matcher = None
+            return
+
+        if parser.event_type != 'cmd' or parser.regex is None:
+            return
+
+        position = len(self.event_parsers['cmd']) - 1
+        if parser.literal is not None:
+            self.cmd_index.setdefault(parser.literal, []).append((position,
+                                                                  parser))
+        else:
+            self.cmd_patterns.append((position, parser))
+
+    def _matching_cmd_parsers(self, event):
+        if event.cmd is None:
+            self.log.error('invalid event passed in')
+            return []
+
+        found = [(position, parser, True) for position, parser
+                 in self.cmd_index.get(event.cmd, ())]
+
+        patterns_found = False
+        for position, parser in self.cmd_patterns:
+            match = parser.match_with_regex(event.cmd)
+            if match is not None:
+                found.append((position, parser, match))
+                patterns_found = True
+
+        if patterns_found:
+            found.sort(key=lambda item: item[0])
+
+        return [(parser, match) for _, parser, match in found]
+
+    def _matching_message_parsers(self, event):
+        if self.message_matcher is None:
+            self.message_matcher = MessageMatcher(self.event_parsers['message'])
+
+        body = event.meta['body']
+        found = []
+        for parser in self.message_matcher.candidates(body):
+            # rerun the parser's own regex so it gets its usual match object
+            match = parser.match_with_regex(body)
+            if match is not None:
+                found.append((parser, match))
+
+        return found
+
+    def _matching_parsers(self, event):
+        """Returns (parser, match) pairs for all the parsers of the event's
+        type that should run on it, in registration order."""
+        if event.event_type == 'cmd':
+            return self._matching_cmd_parsers(event)
+
+        if event.event_type == 'message' and \
+                isinstance(event.meta, dict) and \
+                type(event.meta.get('body')) in (str, unicode):
+            return self._matching_message_parsers(event)
+
+        return [(event_parser, event_parser.matches(event))
+                for event_parser in self.event_parsers[event.event_type]]
+
     # event processing
-    @defer.inlineCallbacks
     def _run_event_processor(self, event_parser, event, *args):
-        run = True
-        response = None
+        """
+        runs a parser's handler, returns a deferred with its response. plain
+        handlers get called right away, without an inlineCallbacks generator.
+        """
         # TODO: make this check if from_bot == _this_ bot
         if event.from_bot is True:
             if event_parser.parse_bot_events is not True:
                 self.log.info('ignoring event from bot: {0!r}'.format(event))
-                run = False
-
-        if run is True:
-            if event_parser.threaded is True:
-                self.log.debug('executing event_parser {0!r} '
-                               'in thread'.format(event_parser))
-                response = yield threads.deferToThread(event_parser.func,
-                                                       event,
-                                                       *args)
+                return defer.succeed(None)
+
+        started = clock()
+        if event_parser.process is True:
+            self.log.debug('executing event_parser {0!r} '
+                           'in process'.format(event_parser))
+            d = self.defer_to_process(event_parser.func, event, *args)
+        elif event_parser.threaded is True:
+            self.log.debug('executing event_parser {0!r} '
+                           'in thread'.format(event_parser))
+            d = self.defer_to_thread(event_parser.source,
+                                     event_parser.func,
+                                     event,
+                                     *args)
+        else:
+            if self.log.isEnabledFor(logging.DEBUG):
+                self.log.debug('executing event_parser '
+                               '{0!r}'.format(event_parser))
+            try:
+                d = as_deferred(event_parser.func(event, *args))
+            except Exception:
+                d = defer.fail()
+
+        timeout = event_parser.timeout
+        if timeout is None:
+            timeout = self.handler_timeout
+        if timeout and not d.called:
+            d = self._add_handler_timeout(d, timeout, event_parser, event)
+
+        if event_parser.latency is not None:
+            d.addBoth(self._handler_finished, event_parser, started)
+        return d
+
+    def _run_handler(self, event_parser, event, *args):
+        """
+        answers from the parser's cache if it has a reply for the command,
+        otherwise runs it (or joins a running call of a coalescing one) and
+        caches a text reply
+        """
+        if event.event_type != 'cmd' or event.from_bot or \
+                (event_parser.cache is None and not event_parser.coalesce):
+            return self._run_event_processor(event_parser, event, *args)
+
+        cache = event_parser.cache
+        if cache is not None:
+            key = (event.cmd, tuple(event.args or ()))
+            if event_parser.cache_per_room:
+                key += (event.source_client_id, event.source_room)
+
+            reply = cache.get(key)
+            if reply is not None:
+                return defer.succeed(reply)
+
+        if event_parser.coalesce:
+            d = self._run_coalesced(event_parser, event, *args)
+        else:
+            d = self._run_event_processor(event_parser, event, *args)
+
+        if cache is not None:
+            d.addCallback(self._cache_reply, cache, key, event, event_parser)
+        return d
+
+    def _run_coalesced(self, event_parser, event, *args):
+        """
+        runs the handler unless a call for the same command and args is
+        still running, in which case the event gets that call's reply
+        """
+        key = (event_parser, event.cmd, tuple(event.args or ()))
+        waiting = self.in_flight.get(key)
+        if waiting is not None:
+            if event_parser.coalesced is not None:
+                event_parser.coalesced.inc()
+            d = defer.Deferred()
+            waiting.append((d, event))
+            return d
+
+        waiting = self.in_flight[key] = []
+        d = self._run_event_processor(event_parser, event, *args)
+        if d.called:
+            del self.in_flight[key]
+        else:
+            d.addBoth(self._coalesced_reply, key, event, event_parser)
+        return d
+
+    def _coalesced_reply(self, result, key, event, event_parser):
+        # every waiting event gets its own action built from the reply
+        shared = result
+        if isinstance(result, Action):
+            shared = result.meta.get('body') \
+                if result.action_type == 'message' else None
+
+        # a timed out call timed out for its waiters too, so that the
+        # timeout reply doesn't get cached for them
+        timed_out = event.timed_out and event_parser.source in event.timed_out
+
+        for d, waiting_event in self.in_flight.pop(key, ()):
+            if timed_out:
+                if waiting_event.timed_out is None:
+                    waiting_event.timed_out = set()
+                waiting_event.timed_out.add(event_parser.source)
+            if isinstance(shared, failure.Failure):
+                d.errback(shared)
             else:
-                self.log.debug('executing'
-                               ' event_parser {0!r}'.format(event_parser))
-                # try:
-                response = yield event_parser.func(event, *args)
+                d.callback(shared)
+        return result
 
-        defer.returnValue(response)
+    def _cache_reply(self, reply, cache, key, event, event_parser):
+        # actions belong to their event and the timeout reply to the timeout
+        if type(reply) in (str, unicode) and \
+                not (event.timed_out and event_parser.source in event.timed_out):
+            cache.put(key, reply)
+        return reply
+
+    def _add_handler_timeout(self, d, timeout, event_parser, event):
+        """
+        cancels a handler's deferred after timeout seconds, its response
+        becomes the handler_timeout_reply
+        """
+        expired = []
+
+        def on_timeout():
+            self.log.warning('{0!r} timed out after {1}s on '
+                             '{2!r}'.format(event_parser, timeout, event))
+            expired.append(True)
+            if event.timed_out is None:
+                event.timed_out = set()
+            event.timed_out.add(event_parser.source)
+            if event_parser.timeouts is not None:
+                event_parser.timeouts.inc()
+
+        def timed_out(failure):
+            if not expired:
+                return failure
+            failure.trap(defer.CancelledError)
+            return self.handler_timeout_reply
+
+        add_timeout(d, timeout, on_timeout)
+        return d.addErrback(timed_out)
+
+    def _handler_finished(self, result, event_parser, started):
+        event_parser.latency.observe(clock() - started)
+        if isinstance(result, failure.Failure):
+            event_parser.errors.inc()
+        return result
 
     def process_event(self, event):
         # TODO: this needs some love
@@ -462,28 +1037,28 @@ class PluginManager(object):
             raise
 
         self.log.debug('processing {0!r}'.format(event))
+        if event.trace is not None:
+            event.trace.mark('processing')
 
         # run only processors of this event_type
         if event.event_type is not None \
            and event.event_type in self.event_parsers:
             self.log.debug('detected'
                            ' event_type {0!r}'.format(event.event_type))
-            for event_parser in self.event_parsers[event.event_type]:
-                # check if match
-                match = event_parser.matches(event)
+            for event_parser, match in self._matching_parsers(event):
                 response = None
                 if match is True:
                     self.log.debug('running'
                                    ' event_parser {0!r}'.format(event_parser))
-                    response = self._run_event_processor(event_parser, event)
+                    response = self._run_handler(event_parser, event)
                 elif isinstance(match, SRE_MATCH_TYPE):
                     self.log.debug('running event_parser {0!r}'
                                    ' with regex results'
                                    '{1!r}'.format(event_parser,
                                                   match.groups()))
-                    response = self._run_event_processor(event_parser,
-                                                         event,
-                                                         *match.groups())
+                    response = self._run_handler(event_parser,
+                                                event,
+                                                *match.groups())
 
                 if response is not None:
                     responses.append(response)
@@ -546,6 +1121,10 @@ class BotPlugin(object):
     event_version = '1'
     built_in = False  # is this a packaged plugin
 
+    # dedicated thread pool for threaded handlers and tasks, e.g.
+    # {'size': 2, 'queue_limit': 10, 'policy': 'reject'}, see PluginThreadPool
+    thread_pool = None
+
     # TODO: make a 'task' decorator...
     def __init__(self, bot=None, config=None):
         """
@@ -592,6 +1171,8 @@ class BotPlugin(object):
         else:
             self.log.debug('wat: {0!r}'.format(a))
             if a is not None:
+                # behind direct replies when flood control holds lines back
+                a.meta.setdefault('priority', LANE_TASK)
                 self._queue_action(a, event)
 
     def build_action(self, action_data, event=None):
@@ -607,31 +1188,67 @@ class BotPlugin(object):
             else:
                 return a
 
+    def _task_timeout(self, func, timeout=None):
+        """
+        seconds a task gets: the one it was scheduled with, the one of its
+        decorator or the bot's handler_timeout
+        """
+        if timeout is None:
+            timeout = getattr(func, '__brutal_timeout', None)
+        if timeout is None:
+            timeout = getattr(self.bot, 'handler_timeout',
+                              DEFAULT_HANDLER_TIMEOUT)
+        return timeout
+
+    def _task_timed_out(self, func, timeout):
+        self.log.warning('task {0!r} timed out after '
+                         '{1}s'.format(func.__name__, timeout))
+        HANDLER_TIMEOUTS.labels(getattr(self.bot, 'nick', None),
+                                '{0}.{1}'.format(self.__class__.__name__,
+                                                 func.__name__)).inc()
+
     @defer.inlineCallbacks
-    def _plugin_task_runner(self, func, *args, **kwargs):
+    def _plugin_task_runner(self, timeout, func, *args, **kwargs):
         try:
             if getattr(func, '__brutal_threaded', False):
                 # add func details
                 self.log.debug('executing plugin task in thread')
-                response = yield threads.deferToThread(func, *args, **kwargs)
+                d = self._defer_to_thread(func, *args, **kwargs)
             else:
                 self.log.debug('executing plugin task')  # add func details
-                response = yield func(*args, **kwargs)
+                d = as_deferred(func(*args, **kwargs))
+
+            if timeout:
+                add_timeout(d, timeout,
+                            lambda: self._task_timed_out(func, timeout))
+            response = yield d
 
             yield self._handle_task_response(response, *args, **kwargs)
             # defer.returnValue(response)
         except Exception as e:
             self.log.error('_plugin_task_runner failed: {0!r}'.format(e))
 
+    def _defer_to_thread(self, func, *args, **kwargs):
+        manager = getattr(self.bot, 'plugin_manager', None)
+        if manager is None:
+            return threads.deferToThread(func, *args, **kwargs)
+        return manager.defer_to_thread(self, func, *args, **kwargs)
+
     def delay_task(self, delay, func, *args, **kwargs):
+        """Runs ``func`` once in ``delay`` seconds.
+
+        Note: a ``timeout`` parameter sets the seconds the task gets before
+        it's cancelled, the bot's ``handler_timeout`` by default."""
         if inspect.isfunction(func) or inspect.ismethod(func):
             self.log.debug('scheduling task {0!r} to run in '
                            '{1} seconds'.format(func.__name__,
                                                 delay))
+            timeout = self._task_timeout(func, kwargs.pop('timeout', None))
             # trying this.. but should probably just use callLater
             d = task.deferLater(reactor,
                                 delay,
                                 self._plugin_task_runner,
+                                timeout,
                                 func,
                                 *args,
                                 **kwargs)
@@ -641,14 +1258,17 @@ class BotPlugin(object):
         """Starts looping a function ``func`` every ``loop_time`` seconds.
 
         Note: If the ``now`` parameter is present and set to True the function
-        is called right after declaration too."""
+        is called right after declaration too. A ``timeout`` parameter sets
+        the seconds each run gets, as with ``delay_task``."""
         if inspect.isfunction(func) or inspect.ismethod(func):
             self.log.debug('scheduling task {0!r} to'
                            ' run every {1} seconds'.format(func.__name__,
                                                            loop_time))
             now = kwargs.pop('now', True)
+            timeout = self._task_timeout(func, kwargs.pop('timeout', None))
             # event = kwargs.pop('event', None)
             t = task.LoopingCall(self._plugin_task_runner,
+                                 timeout,
                                  func,
                                  *args,
                                  **kwargs)
@@ -661,8 +1281,17 @@ class BotPlugin(object):
         return self.loop_task(loop_time, func, *args)
 
     def open_storage(self, name):
-        """Opens persistent storage with a given name."""
+        """Opens persistent storage with a given name. Fails in bots running
+        their plugins in more than one worker process, they can't share the
+        file."""
         if name not in self.shelves:
+            workers = getattr(self.bot, 'workers', 1)
+            if workers > 1:
+                msg = "Storage '{0}' can't be shared by {1} plugin " \
+                      "workers!".format(name, workers)
+                self.log.error(msg)
+                raise RuntimeError(msg)
+
             path = config.DATA_DIR + os.sep + \
                 self.bot.nick + '.' + name + config.STORAGE_SUFFIX
             self.shelves[name] = shelve.DbfilenameShelf(path, protocol=2)
@@ -686,6 +1315,12 @@ class BotPlugin(object):
 
     def _queue_action(self, action, event=None):
         if isinstance(action, Action):
+            if event is not None and event.timed_out and \
+                    self in event.timed_out:
+                self.log.info('dropping late reply to {0!r}, a handler of '
+                              'this plugin timed out'.format(event))
+                return
+
             if isInIOThread():
                 self.bot.route_response(action, event)
             else:
@@ -694,8 +1329,15 @@ class BotPlugin(object):
             self.log.error('tried to queue invalid action: '
                            '{0!r}'.format(action))
 
-    def msg(self, msg, room=None, event=None):
+    def msg(self, msg, room=None, event=None, priority=None):
+        """Sends ``msg`` to ``room``, or the room of ``event``.
+
+        Note: ``priority`` is the flood control lane the message waits in
+        when the connection holds lines back, e.g. ``'bulk'`` for
+        announcements that can wait behind everything else."""
         a = Action(source_bot=self.bot, source_event=event).msg(msg, room=room)
+        if priority is not None:
+            a.meta['priority'] = priority
         self._queue_action(a, event)
 
     # internal
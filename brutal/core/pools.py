@@ -0,0 +1,438 @@
+"""
+Pools plugin handlers run in when they shouldn't run in the reactor thread.
+
+PluginThreadPool gives a plugin threads of its own for blocking i/o.
+ProcessPool runs CPU bound handlers (process=True) in child processes, which
+get a snapshot of the event and send back the handler's return value. The
+children use the framing of brutal.core.workers, reading calls from stdin and
+writing results to fd 3.
+"""
+import os
+import sys
+import logging
+import itertools
+import threading
+import traceback
+import importlib
+import cPickle as pickle
+from collections import deque
+
+from twisted.internet import defer, threads, protocol
+from twisted.python.threadpool import ThreadPool
+
+# this module is the entry point of worker processes, see LazyReactor
+from brutal.core.runtime import lazy_reactor as reactor, install_reactor
+from brutal.core.models import Event
+from brutal.core.metrics import THREADS
+from brutal.core.workers import PREFIX, WORKER_OUT_FD, pack_message, MessageReader
+
+# what a pool does with calls once its queue is full
+POOL_QUEUE = 'queue'
+POOL_REJECT = 'reject'
+POOL_DROP = 'drop'
+POOL_POLICIES = (POOL_QUEUE, POOL_REJECT, POOL_DROP)
+
+DEFAULT_POOL_SIZE = 1
+DEFAULT_BUSY_REPLY = 'busy, try again later'
+
+
+class PluginThreadPool(object):
+    """
+    a thread pool of its own for the threaded handlers and tasks of a plugin,
+    so a plugin stuck on slow i/o only uses up its own threads instead of the
+    reactor's shared pool.
+
+    size is the max number of threads, queue_limit the max number of calls
+    waiting for a thread (None for no limit). once the queue is full, policy
+    decides what happens to new calls: 'queue' still queues them, 'reject'
+    answers with busy_reply right away and 'drop' ignores them.
+    """
+    def __init__(self, name, size=DEFAULT_POOL_SIZE, queue_limit=None, policy=POOL_QUEUE,
+                 busy_reply=DEFAULT_BUSY_REPLY):
+        self.log = logging.getLogger('{0}.{1}.{2}'.format(self.__class__.__module__, self.__class__.__name__, name))
+        self.name = name
+        self.size = max(int(size), 1)
+        self.queue_limit = queue_limit
+
+        if policy not in POOL_POLICIES:
+            self.log.error('unknown thread pool policy {0!r}, using {1!r}'.format(policy, POOL_QUEUE))
+            policy = POOL_QUEUE
+        self.policy = policy
+        self.busy_reply = busy_reply
+
+        self.pool = ThreadPool(minthreads=0, maxthreads=self.size, name=name)
+        self._shutdown_trigger = None
+
+        # counters, changed from the pool's threads too
+        self.lock = threading.Lock()
+        self.active = 0
+        self.queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.dropped = 0
+        # calls handed to the pool and not finished yet, only touched from
+        # the reactor thread, so admission doesn't depend on how quick the
+        # pool's threads pick calls up
+        self.pending = 0
+
+    def __repr__(self):
+        return '<{0} {1}: {2} threads>'.format(self.__class__.__name__, self.name, self.size)
+
+    @classmethod
+    def from_settings(cls, name, settings):
+        """
+        builds a pool from a plugin's thread_pool setting, either a dict of
+        the keyword arguments or just the size.
+        """
+        if isinstance(settings, dict):
+            return cls(name, **settings)
+        return cls(name, size=settings)
+
+    def start(self):
+        THREADS.labels(self.name, 'active').set_function(lambda: self.active)
+        THREADS.labels(self.name, 'queued').set_function(lambda: self.queued)
+        self.pool.start()
+        self._shutdown_trigger = reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+
+    def stop(self):
+        if self._shutdown_trigger is not None:
+            try:
+                reactor.removeSystemEventTrigger(self._shutdown_trigger)
+            except (ValueError, KeyError):
+                # already fired
+                pass
+            self._shutdown_trigger = None
+        self.pool.stop()
+
+    def stats(self):
+        with self.lock:
+            return {'size': self.size,
+                    'active': self.active,
+                    'queued': self.queued,
+                    'completed': self.completed,
+                    'rejected': self.rejected,
+                    'dropped': self.dropped}
+
+    def run(self, func, *args, **kwargs):
+        """
+        runs func in the pool, returns a deferred firing with its result
+        """
+        if self.queue_limit is not None and self.pending - self.size >= self.queue_limit:
+            if self.policy == POOL_REJECT:
+                self.log.warning('pool full, rejecting {0!r}'.format(func))
+                with self.lock:
+                    self.rejected += 1
+                return defer.succeed(self.busy_reply)
+            elif self.policy == POOL_DROP:
+                self.log.warning('pool full, dropping {0!r}'.format(func))
+                with self.lock:
+                    self.dropped += 1
+                return defer.succeed(None)
+
+        with self.lock:
+            self.queued += 1
+        self.pending += 1
+        d = threads.deferToThreadPool(reactor, self.pool, self._call, func, args, kwargs)
+        d.addBoth(self._finished)
+
+        # the call keeps its thread until it returns, even if whoever waits
+        # for it cancels the result (see handler timeouts)
+        result = defer.Deferred()
+        d.chainDeferred(result)
+        return result
+
+    def _finished(self, result):
+        self.pending -= 1
+        return result
+
+    def _call(self, func, args, kwargs):
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.completed += 1
+
+
+class ProcessCallError(Exception):
+    """
+    a handler failed in its worker process, or the process died running it
+    """
+
+
+class ProcessWorker(protocol.ProcessProtocol):
+    """
+    the pool's end of a single worker process
+    """
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.reader = MessageReader(self.message_received)
+        self.log = logging.getLogger('{0}.{1}'.format(pool.log.name, index))
+
+        # call id of the call the worker is busy with
+        self.call_id = None
+        self.tasks = 0
+
+    def connectionMade(self):
+        self.pool.worker_idle(self)
+
+    def start_call(self, call_id, message):
+        self.call_id = call_id
+        self.transport.write(pack_message(call_id, *message))
+
+    def childDataReceived(self, fd, data):
+        if fd == WORKER_OUT_FD:
+            try:
+                self.reader.feed(data)
+            except Exception:
+                self.log.exception('invalid data from worker {0}, killing it'.format(self.index))
+                self.kill()
+        else:
+            for line in data.splitlines():
+                if line.strip():
+                    self.log.info(line)
+
+    def message_received(self, message):
+        kind = message[0]
+        if kind == 'result':
+            self.call_id = None
+            self.tasks += 1
+            self.pool.call_finished(self, *message[1:])
+        else:
+            self.log.error('unknown message from worker: {0!r}'.format(kind))
+
+    def processEnded(self, reason):
+        self.pool.worker_ended(self, reason)
+
+    def retire(self):
+        try:
+            self.transport.closeStdin()
+        except Exception:
+            pass
+
+    def kill(self):
+        try:
+            self.transport.signalProcess('KILL')
+        except Exception:
+            # already gone
+            pass
+
+
+class ProcessPool(object):
+    """
+    runs handlers in up to size worker processes, one call per process at a
+    time. a call taking longer than timeout seconds fails with
+    defer.TimeoutError and its process gets killed, processes are replaced
+    with fresh ones after max_tasks calls.
+
+    handlers have to be module level functions returning something
+    picklable, they get called with an Event rebuilt from a snapshot.
+    """
+    def __init__(self, name, size, timeout=None, max_tasks=None):
+        self.log = logging.getLogger('{0}.{1}.{2}'.format(self.__class__.__module__, self.__class__.__name__, name))
+        self.name = name
+        self.size = max(int(size), 1)
+        self.timeout = timeout
+        self.max_tasks = max_tasks
+
+        self.running = True
+        self.indexes = itertools.count()
+        self.call_ids = itertools.count(1)
+
+        self.workers = []
+        self.idle = deque()
+        # (call id, message, deferred) of calls waiting for a worker
+        self.waiting = deque()
+        # call id -> (deferred, worker, timeout call)
+        self.calls = {}
+
+        self.stats = {'completed': 0, 'failed': 0, 'timeouts': 0, 'crashes': 0, 'recycled': 0}
+
+    def __repr__(self):
+        return '<{0} {1}: {2} processes>'.format(self.__class__.__name__, self.name, self.size)
+
+    def run(self, func, event, *args):
+        """
+        calls func(event, *args) in a worker process, returns a deferred
+        firing with its return value
+        """
+        if not self.running:
+            return defer.fail(ProcessCallError('process pool stopped'))
+
+        bot = {'nick': event.source_bot.nick, 'command_token': event.source_bot.command_token}
+        message = (func.__module__, func.__name__, bot, event.snapshot(), args)
+
+        d = defer.Deferred()
+        self.waiting.append((next(self.call_ids), message, d))
+        self._dispatch()
+        return d
+
+    def stop(self):
+        self.running = False
+        while self.waiting:
+            self.waiting.popleft()[2].errback(ProcessCallError('process pool stopped'))
+        for call_id in list(self.calls):
+            self._fail(call_id, ProcessCallError('process pool stopped'))
+        for worker in self.workers:
+            worker.retire()
+
+    def spawn(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+
+        worker = ProcessWorker(self, next(self.indexes))
+        self.workers.append(worker)
+        reactor.spawnProcess(worker, sys.executable, [sys.executable, '-m', __name__], env=env,
+                             path=os.getcwd(), childFDs={0: 'w', 1: 'r', 2: 'r', WORKER_OUT_FD: 'r'})
+
+    def _dispatch(self):
+        while self.waiting and self.running:
+            if self.waiting[0][2].called:
+                # cancelled while waiting, e.g. by a handler timeout
+                self.waiting.popleft()
+                continue
+
+            if not self.idle:
+                if len(self.workers) >= self.size:
+                    return
+                # the new worker shows up in idle once it's connected
+                self.spawn()
+                continue
+
+            worker = self.idle.popleft()
+            call_id, message, d = self.waiting.popleft()
+            try:
+                worker.start_call(call_id, message)
+            except Exception as e:
+                worker.call_id = None
+                self.idle.appendleft(worker)
+                self.stats['failed'] += 1
+                d.errback(ProcessCallError('failed to send call: {0!r}'.format(e)))
+                continue
+
+            timeout_call = None
+            if self.timeout:
+                timeout_call = reactor.callLater(self.timeout, self._timed_out, call_id)
+            self.calls[call_id] = (d, worker, timeout_call)
+
+    def _fail(self, call_id, error):
+        d, worker, timeout_call = self.calls.pop(call_id)
+        if timeout_call is not None and timeout_call.active():
+            timeout_call.cancel()
+        d.errback(error)
+
+    def _remove(self, worker):
+        if worker in self.workers:
+            self.workers.remove(worker)
+        if worker in self.idle:
+            self.idle.remove(worker)
+
+    def _timed_out(self, call_id):
+        worker = self.calls[call_id][1]
+        self.log.error('call {0} timed out after {1}s, killing worker {2}'.format(call_id, self.timeout,
+                                                                                   worker.index))
+        self.stats['timeouts'] += 1
+        self._fail(call_id, defer.TimeoutError('handler timed out after {0}s'.format(self.timeout)))
+        self._remove(worker)
+        worker.kill()
+        self._dispatch()
+
+    def worker_idle(self, worker):
+        if worker in self.workers:
+            self.idle.append(worker)
+            self._dispatch()
+
+    def call_finished(self, worker, call_id, ok, result):
+        if self.max_tasks and worker.tasks >= self.max_tasks:
+            self.stats['recycled'] += 1
+            self._remove(worker)
+            worker.retire()
+        elif worker in self.workers:
+            self.idle.append(worker)
+
+        if call_id in self.calls:
+            if ok:
+                self.stats['completed'] += 1
+                d, _, timeout_call = self.calls.pop(call_id)
+                if timeout_call is not None and timeout_call.active():
+                    timeout_call.cancel()
+                d.callback(result)
+            else:
+                self.stats['failed'] += 1
+                self._fail(call_id, ProcessCallError(result))
+
+        self._dispatch()
+
+    def worker_ended(self, worker, reason):
+        self._remove(worker)
+        if worker.call_id in self.calls:
+            self.log.error('worker {0} died running call {1}: {2}'.format(worker.index, worker.call_id,
+                                                                            reason.getErrorMessage()))
+            self.stats['crashes'] += 1
+            self._fail(worker.call_id, ProcessCallError('worker process died: {0}'.format(reason.getErrorMessage())))
+        self._dispatch()
+
+
+# worker side
+
+class ProcessBot(object):
+    """
+    the bot an event handed to a worker process claims to come from
+    """
+    def __init__(self, nick, command_token):
+        self.nick = nick
+        self.command_token = command_token
+
+    def __repr__(self):
+        return '<{0}: {1!r}>'.format(self.__class__.__name__, self.nick)
+
+
+def read_message(stream):
+    """
+    reads one pack_message message from a blocking stream, None at eof
+    """
+    data = stream.read(PREFIX.size)
+    if len(data) < PREFIX.size:
+        return None
+    length, = PREFIX.unpack(data)
+    data = stream.read(length)
+    if len(data) < length:
+        return None
+    return pickle.loads(data)
+
+
+def call_handler(module_name, func_name, bot, details, args):
+    func = getattr(importlib.import_module(module_name), func_name)
+    event = Event(source_bot=ProcessBot(**bot), raw_details=details)
+    return func(event, *args)
+
+
+def run_process_worker():
+    from brutal.conf import config
+
+    # the same reactor the bot runs on
+    install_reactor(config.REACTOR)
+    logging.basicConfig(level=config.LOG_LEVEL, format=config.LOG_FORMAT, stream=sys.stderr)
+
+    stdin = os.fdopen(0, 'rb')
+    out = os.fdopen(WORKER_OUT_FD, 'wb')
+    while True:
+        message = read_message(stdin)
+        if message is None:
+            break
+
+        call_id = message[0]
+        try:
+            data = pack_message('result', call_id, True, call_handler(*message[1:]))
+        except Exception:
+            data = pack_message('result', call_id, False, traceback.format_exc())
+        out.write(data)
+        out.flush()
+
+
+if __name__ == '__main__':
+    run_process_worker()
@@ -0,0 +1,146 @@
+"""
+Profiles a running bot for a while, without restarting it.
+
+cProfile only sees the thread it was enabled in, so the reactor thread gets
+one profile and every threaded handler call made while profiling runs under a
+profile of its own. When the time is up they're merged into a single pstats
+file in DATA_DIR. Started by SIGUSR1 (see BotManager) or by the profile
+command of brutal.plugins.profiling.
+"""
+import os
+import time
+import pstats
+import inspect
+import logging
+import cProfile
+import threading
+
+from twisted.internet import reactor, defer
+
+
+def unwrap(func):
+    """
+    the function a brutal decorator wrapped, that's the one profiles see
+    """
+    func = getattr(func, 'im_func', func)
+    for cell in getattr(func, '__closure__', None) or ():
+        inner = cell.cell_contents
+        if inspect.isfunction(inner) and inner.__name__ == func.__name__:
+            return unwrap(inner)
+    return func
+
+
+def handler_summary(stats, parsers, top=10):
+    """
+    lines about the top parser handlers by cumulative time in stats
+    """
+    rows = []
+    for parser in parsers:
+        code = getattr(unwrap(parser.func), '__code__', None)
+        if code is None:
+            continue
+        key = (code.co_filename, code.co_firstlineno, code.co_name)
+        if key in stats.stats:
+            calls, _, _, cumulative, _ = stats.stats[key][:5]
+            rows.append((cumulative, calls, parser))
+
+    rows.sort(key=lambda row: row[0], reverse=True)
+    return ['{0}.{1}: {2:.3f}s in {3} calls ({4:.2f}ms each)'.format(parser.source_name, parser.func_name,
+                                                                     cumulative, calls,
+                                                                     1000 * cumulative / calls if calls else 0)
+            for cumulative, calls, parser in rows[:top]]
+
+
+class Profiler(object):
+    """
+    one profiling run at a time, for the whole process
+    """
+    def __init__(self):
+        self.log = logging.getLogger('{0}.{1}'.format(self.__class__.__module__, self.__class__.__name__))
+        self.profile = None
+        self.lock = threading.Lock()
+        self.thread_profiles = []
+        # deferreds waiting for the current run
+        self.waiting = []
+        self.path = None
+
+    def __repr__(self):
+        return '<{0}: {1}>'.format(self.__class__.__name__, 'running' if self.active else 'idle')
+
+    @property
+    def active(self):
+        return self.profile is not None
+
+    def start(self, duration, directory, name='brutal'):
+        """
+        profiles for duration seconds, returns a deferred firing with the
+        pstats file path and the pstats.Stats once done. has to be called
+        from the reactor thread. if a run is going on already, its deferred
+        is returned. fails with ValueError unless duration is a positive
+        number of seconds.
+        """
+        d = defer.Deferred()
+        if self.active:
+            self.waiting.append(d)
+            return d
+
+        # nan compares false to anything
+        if not 0 < duration < float('inf'):
+            return defer.fail(ValueError('bad profiling duration {0!r}'.format(duration)))
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = os.path.join(directory, 'profile-{0}-{1}.pstats'.format(name, time.strftime('%Y%m%d-%H%M%S')))
+        self.log.info('profiling for {0}s into {1}'.format(duration, self.path))
+
+        # scheduled first, a run nothing is going to stop would never end
+        reactor.callLater(duration, self.stop)
+        self.waiting.append(d)
+        self.thread_profiles = []
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return d
+
+    def wrap(self, func):
+        """
+        func profiled in the thread it ends up running in, if a run is going
+        on. used for threaded handlers.
+        """
+        if not self.active:
+            return func
+
+        def profiled(*args, **kwargs):
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(func, *args, **kwargs)
+            finally:
+                with self.lock:
+                    self.thread_profiles.append(profile)
+        return profiled
+
+    def stop(self):
+        if not self.active:
+            return
+
+        profile, self.profile = self.profile, None
+        profile.disable()
+
+        waiting, self.waiting = self.waiting, []
+        try:
+            stats = pstats.Stats(profile)
+            with self.lock:
+                for thread_profile in self.thread_profiles:
+                    stats.add(thread_profile)
+                self.thread_profiles = []
+            stats.dump_stats(self.path)
+        except Exception as e:
+            self.log.exception('failed to write profile {0}: {1!r}'.format(self.path, e))
+            for d in waiting:
+                d.errback()
+        else:
+            self.log.info('wrote profile {0}'.format(self.path))
+            for d in waiting:
+                d.callback((self.path, stats))
+
+
+profiler = Profiler()
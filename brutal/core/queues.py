@@ -0,0 +1,159 @@
+import time
+from collections import deque
+
+from twisted.internet import defer
+
+
+class BatchQueue(defer.DeferredQueue):
+    """
+    DeferredQueue the bot drains in batches. adds the few calls the bot
+    consumers and overflow policies need on top of put / get.
+    """
+    def __len__(self):
+        return len(self.pending)
+
+    def take(self, count):
+        """
+        removes and returns up to count of the next queued items
+        """
+        batch = self.pending[:count]
+        del self.pending[:count]
+        return batch
+
+    def drop(self, predicate=None):
+        """
+        removes the oldest queued item for which predicate is true (any item
+        if no predicate is given), returns whether something was dropped.
+        """
+        for i, item in enumerate(self.pending):
+            if predicate is None or predicate(item):
+                del self.pending[i]
+                return True
+        return False
+
+
+def room_key(item):
+    """
+    the (client id, room) an event or raw event data comes from
+    """
+    if isinstance(item, dict):
+        return item.get('client_id'), item.get('channel') or item.get('room')
+    return item.source_client_id, item.source_room
+
+
+class FairQueue(BatchQueue):
+    """
+    event queue that keeps a queue per (client id, room) and hands out items
+    round-robin between them, so a single busy room can't hold up all the
+    others. a room with weight n gets n items per round, rooms without a
+    weight get one.
+
+    when the queue has to shed load, items are dropped from the room with
+    the most queued items first.
+    """
+    def __init__(self, weights=None, key=room_key, size=None, backlog=None):
+        BatchQueue.__init__(self, size=size, backlog=backlog)
+        # weights are given per room name
+        self.weights = weights or {}
+        self.key = key
+
+        # key -> deque of (time queued, item)
+        self.queues = {}
+        # keys with queued items, in the order they get served
+        self.active = deque()
+        # items the key at the front of active can still take this round
+        self.credit = 0
+        self.count = 0
+
+        # key -> {'depth', 'served', 'wait_last', 'wait_max', 'wait_total'}
+        self.stats = {}
+
+    def __len__(self):
+        return self.count
+
+    def put(self, obj):
+        if self.waiting:
+            self.waiting.pop(0).callback(obj)
+        elif self.size is None or self.count < self.size:
+            self._push(obj)
+        else:
+            raise defer.QueueOverflow()
+
+    def get(self):
+        if self.count:
+            return defer.succeed(self._pop())
+        return BatchQueue.get(self)
+
+    def take(self, count):
+        batch = []
+        while self.count and len(batch) < count:
+            batch.append(self._pop())
+        return batch
+
+    def drop(self, predicate=None):
+        for key in sorted(self.queues, key=lambda k: len(self.queues[k]), reverse=True):
+            queue = self.queues[key]
+            for queued in queue:
+                if predicate is None or predicate(queued[1]):
+                    queue.remove(queued)
+                    self._removed(key)
+                    return True
+        return False
+
+    def weight(self, key):
+        return max(int(self.weights.get(key[1], 1)), 1)
+
+    def _push(self, obj):
+        key = self.key(obj)
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = deque()
+            self.active.append(key)
+            if len(self.active) == 1:
+                self.credit = self.weight(key)
+        queue.append((time.time(), obj))
+        self.count += 1
+
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = {'depth': 0, 'served': 0, 'wait_last': 0.0, 'wait_max': 0.0,
+                                       'wait_total': 0.0}
+        stats['depth'] += 1
+
+    def _pop(self):
+        key = self.active[0]
+        queued_at, obj = self.queues[key].popleft()
+
+        wait = time.time() - queued_at
+        stats = self.stats[key]
+        stats['served'] += 1
+        stats['wait_last'] = wait
+        stats['wait_total'] += wait
+        if wait > stats['wait_max']:
+            stats['wait_max'] = wait
+
+        self.credit -= 1
+        self._removed(key)
+        return obj
+
+    def _removed(self, key):
+        """
+        bookkeeping after an item of key left its queue
+        """
+        self.count -= 1
+        self.stats[key]['depth'] -= 1
+
+        if not self.queues[key]:
+            del self.queues[key]
+            if self.active[0] == key:
+                self.active.popleft()
+                self._next_round()
+            else:
+                self.active.remove(key)
+        elif self.active[0] == key and self.credit <= 0:
+            self.active.rotate(-1)
+            self._next_round()
+
+    def _next_round(self):
+        if self.active:
+            self.credit = self.weight(self.active[0])
@@ -0,0 +1,212 @@
+"""
+Outbound flood control.
+
+A SendScheduler sends lines right away while its TokenBucket has tokens and
+queues them otherwise. Queued lines wait in priority lanes: protocol
+housekeeping (PONG, JOIN, ...) goes first, then direct replies, then the
+output of plugin tasks and last bulk announcements. The lanes behind control
+are bounded, when one is full its oldest line is dropped. Lines that have to
+wait anyway can be merged into the one queued before them, e.g. short
+messages to the same room, which saves tokens without delaying anything.
+"""
+from collections import deque, OrderedDict
+
+from twisted.internet import reactor, defer
+
+LANE_CONTROL = 'control'
+LANE_REPLY = 'reply'
+LANE_TASK = 'task'
+LANE_BULK = 'bulk'
+# highest priority first
+LANES = (LANE_CONTROL, LANE_REPLY, LANE_TASK, LANE_BULK)
+
+
+class LinesDropped(Exception):
+    """
+    the lines a when_sent deferred waited for were dropped instead of sent
+    """
+
+
+class TokenBucket(object):
+    """
+    holds up to burst tokens, refilled at rate tokens a second
+    """
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = reactor.seconds()
+
+    def __repr__(self):
+        return '<{0}: {1:.2f}/{2}, {3}/s>'.format(self.__class__.__name__, self.tokens, self.burst, self.rate)
+
+    def _refill(self):
+        now = reactor.seconds()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """
+        uses up a token, returns False if there's none
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self):
+        """
+        seconds until there's a token
+        """
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class SendScheduler(object):
+    """
+    sends lines through send, at most as fast as the token bucket allows
+    """
+    def __init__(self, send, rate, burst, queue_limit=None, on_drop=None, merge=None):
+        self.send = send
+        # called with the lane of every line dropped
+        self.on_drop = on_drop
+        # merge(queued, line) returns the two lines as one, or None when they
+        # don't go together
+        self.merge = merge
+        self.bucket = TokenBucket(rate, burst)
+        self.queue_limit = queue_limit
+
+        # lane -> deque of lines, and of deferreds from when_sent
+        self.lanes = OrderedDict((lane, deque()) for lane in LANES)
+        self.depth = dict((lane, 0) for lane in LANES)
+        self.dropped = dict((lane, 0) for lane in LANES)
+        self.sent = 0
+        self.merged = 0
+        self.count = 0
+        self.call = None
+
+    def __repr__(self):
+        return '<{0}: {1} queued>'.format(self.__class__.__name__, self.count)
+
+    def __len__(self):
+        return self.count
+
+    def put(self, line, lane=LANE_CONTROL):
+        if not self.count and self.bucket.take():
+            self._send(line)
+            return
+
+        queue = self.lanes[lane]
+        if self.merge is not None and self._merge(queue, line):
+            return
+
+        if self.queue_limit is not None and lane != LANE_CONTROL and self.depth[lane] >= self.queue_limit:
+            self._drop_oldest(lane)
+
+        queue.append(line)
+        self.depth[lane] += 1
+        self.count += 1
+        self._schedule()
+
+    def when_sent(self, lane):
+        """
+        deferred firing once the lines queued in lane so far are sent, None
+        if there are none. fails with LinesDropped if the last of them gets
+        dropped or the scheduler stops first
+        """
+        if not self.depth[lane]:
+            return None
+
+        d = defer.Deferred()
+        self.lanes[lane].append(d)
+        return d
+
+    def stop(self):
+        """
+        forgets the queued lines, e.g. once the connection is gone
+        """
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+        waiting = []
+        for lane, queue in self.lanes.items():
+            waiting.extend(item for item in queue if isinstance(item, defer.Deferred))
+            queue.clear()
+            self.depth[lane] = 0
+        self.count = 0
+        # lines already sent fired theirs in drain, these never will be
+        for d in waiting:
+            d.errback(LinesDropped('scheduler stopped'))
+
+    def _send(self, line):
+        self.sent += 1
+        self.send(line)
+
+    def _merge(self, queue, line):
+        """
+        merges line into the last line waiting in queue, if it can
+        """
+        for i in xrange(len(queue) - 1, -1, -1):
+            if not isinstance(queue[i], defer.Deferred):
+                merged = self.merge(queue[i], line)
+                if merged is None:
+                    return False
+                queue[i] = merged
+                self.merged += 1
+                return True
+        return False
+
+    def _drop_oldest(self, lane):
+        queue = self.lanes[lane]
+        for i, item in enumerate(queue):
+            if not isinstance(item, defer.Deferred):
+                del queue[i]
+                self.depth[lane] -= 1
+                self.count -= 1
+                self.dropped[lane] += 1
+                if self.on_drop is not None:
+                    self.on_drop(lane)
+                # the first marker after the line is the one of the reply
+                # the line belonged to, the reply didn't go out whole. lines
+                # only get merged into the last line queued, so when the
+                # markers follow the line right away, all of them are of
+                # replies with lines merged into it
+                j = i
+                while j < len(queue) and not isinstance(queue[j], defer.Deferred):
+                    j += 1
+                markers = []
+                while j < len(queue) and isinstance(queue[j], defer.Deferred):
+                    markers.append(queue[j])
+                    del queue[j]
+                    if j > i:
+                        break
+                for d in markers:
+                    d.errback(LinesDropped('line dropped from the {0} lane'.format(lane)))
+                return
+
+    def _schedule(self):
+        if self.call is None and self.count:
+            self.call = reactor.callLater(self.bucket.delay(), self.drain)
+
+    def _fire_sent(self):
+        for queue in self.lanes.values():
+            while queue and isinstance(queue[0], defer.Deferred):
+                queue.popleft().callback(None)
+
+    def drain(self):
+        """
+        sends queued lines, highest priority lane first, while there are
+        tokens
+        """
+        self.call = None
+        self._fire_sent()
+        while self.count and self.bucket.take():
+            for lane, queue in self.lanes.items():
+                if self.depth[lane]:
+                    self.depth[lane] -= 1
+                    self.count -= 1
+                    self._send(queue.popleft())
+                    break
+            self._fire_sent()
+        self._schedule()
@@ -0,0 +1,80 @@
+"""
+Picks the twisted reactor brutal runs on.
+
+The reactor gets installed by whatever imports twisted.internet.reactor first,
+so install_reactor has to run before brutal.core.bot is imported. brutal.run
+does that with the REACTOR setting of the config.
+"""
+import sys
+import importlib
+
+# REACTOR setting -> module providing the reactor
+REACTORS = {
+    'select': 'twisted.internet.selectreactor',
+    'poll': 'twisted.internet.pollreactor',
+    'epoll': 'twisted.internet.epollreactor',
+    'kqueue': 'twisted.internet.kqreactor',
+    'asyncio': 'twisted.internet.asyncioreactor',
+}
+
+
+def install_reactor(name=None):
+    """
+    installs the reactor called name and returns it, None or 'default' keeps
+    twisted's default for the platform.
+    """
+    if name in (None, 'default'):
+        from twisted.internet import reactor
+        return reactor
+
+    if name not in REACTORS:
+        raise ValueError('unknown reactor {0!r}, use one of: {1}'.format(name, ', '.join(sorted(REACTORS))))
+
+    module_name = REACTORS[name]
+    if 'twisted.internet.reactor' in sys.modules:
+        from twisted.internet import reactor
+        if reactor.__class__.__module__ != module_name:
+            raise RuntimeError('can not install the {0} reactor, {1!r} is already installed'.format(name, reactor))
+        return reactor
+
+    module = importlib.import_module(module_name)
+    if name == 'asyncio':
+        import asyncio
+        module.install(eventloop=asyncio.get_event_loop())
+    else:
+        module.install()
+
+    from twisted.internet import reactor
+    return reactor
+
+
+class LazyReactor(object):
+    """
+    stands in for twisted.internet.reactor in the modules worker processes
+    run as. importing the reactor installs the default one, so it's only
+    imported on first use, once the worker installed the configured one.
+    """
+    def __getattr__(self, name):
+        from twisted.internet import reactor
+        return getattr(reactor, name)
+
+    def __repr__(self):
+        return '<{0}>'.format(self.__class__.__name__)
+
+
+lazy_reactor = LazyReactor()
+
+
+def from_asyncio(awaitable):
+    """
+    wraps an asyncio coroutine or future in a deferred, so handlers can wait
+    on asyncio code when running on the asyncio reactor:
+
+        @cmd
+        async def fetch(event):
+            return await from_asyncio(some_asyncio_coroutine())
+    """
+    import asyncio
+    from twisted.internet import defer
+
+    return defer.Deferred.fromFuture(asyncio.ensure_future(awaitable))
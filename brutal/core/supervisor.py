@@ -0,0 +1,177 @@
+"""
+Runs every bot of the config in its own process.
+
+The supervisor starts one child per entry in BOTS, each running the usual
+BotManager limited to that single bot. Children write a heartbeat to fd 3
+from their reactor thread, a child that exits or stops sending heartbeats
+gets restarted with a backoff. Everything the children log goes to their
+stderr and is passed on to the supervisor's log.
+"""
+import os
+import sys
+import time
+import logging
+
+from twisted.internet import reactor, protocol, task
+
+from brutal.core.constants import DEFAULT_RESTART_DELAY, MAX_RESTART_DELAY
+
+HEARTBEAT_FD = 3
+
+
+class BotProcess(protocol.ProcessProtocol):
+    """
+    the supervisor's end of a bot child process
+    """
+    def __init__(self, supervisor, nick):
+        self.supervisor = supervisor
+        self.nick = nick
+        self.log = logging.getLogger('{0}.{1}'.format(supervisor.log.name, nick))
+
+        self.started = None
+        self.last_heartbeat = None
+        self.buffer = ''
+
+    def connectionMade(self):
+        self.started = self.last_heartbeat = time.time()
+        self.log.info('started bot {0!r} (pid {1})'.format(self.nick, self.transport.pid))
+
+    def childDataReceived(self, fd, data):
+        if fd == HEARTBEAT_FD:
+            self.last_heartbeat = time.time()
+            return
+
+        self.buffer += data
+        lines = self.buffer.split('\n')
+        self.buffer = lines.pop()
+        for line in lines:
+            if line.strip():
+                self.log.info(line.rstrip())
+
+    def processEnded(self, reason):
+        self.supervisor.bot_ended(self, reason)
+
+    def kill(self, sig='TERM'):
+        try:
+            self.transport.signalProcess(sig)
+        except Exception:
+            # already gone
+            pass
+
+
+class BotSupervisor(object):
+    """
+    spawns one process per bot in config.BOTS and keeps them running
+    """
+    def __init__(self, config=None):
+        if config is None:
+            raise AttributeError("No config passed to supervisor.")
+
+        self.log = logging.getLogger('{0}.{1}'.format(self.__class__.__module__, self.__class__.__name__))
+        self.config = config
+
+        self.heartbeat_timeout = config.SUPERVISOR_HEARTBEAT_TIMEOUT
+
+        # nick -> BotProcess
+        self.bots = {}
+        self.restarts = {}
+        self.running = False
+
+    def __repr__(self):
+        return '<{0}: {1!r}>'.format(self.__class__.__name__, sorted(self.bots))
+
+    def bot_nicks(self):
+        nicks = []
+        bots = getattr(self.config, 'BOTS', None)
+        if bots is not None and isinstance(bots, list):
+            for bot_config in bots:
+                if isinstance(bot_config, dict) and 'nick' in bot_config:
+                    nicks.append(bot_config['nick'])
+        return nicks
+
+    def start(self):
+        """
+        starts the children and runs the reactor
+        """
+        nicks = self.bot_nicks()
+        if not nicks:
+            self.log.warning('no bots found in configuration')
+
+        self.running = True
+        for nick in nicks:
+            self.restarts[nick] = 0
+            self.spawn(nick)
+
+        loop = task.LoopingCall(self.check_health)
+        loop.start(self.config.SUPERVISOR_HEARTBEAT_INTERVAL, now=False)
+
+        reactor.addSystemEventTrigger('before', 'shutdown', self.shutdown)
+        reactor.run()
+
+    def spawn(self, nick):
+        if not self.running:
+            return
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+
+        child = BotProcess(self, nick)
+        self.bots[nick] = child
+        args = [sys.executable, '-m', 'brutal.run', '--bot', nick, '--heartbeat-fd', str(HEARTBEAT_FD)]
+        reactor.spawnProcess(child, sys.executable, args, env=env, path=os.getcwd(),
+                             childFDs={0: 'w', 1: 'r', 2: 'r', HEARTBEAT_FD: 'r'})
+
+    def check_health(self):
+        now = time.time()
+        for nick, child in self.bots.items():
+            if child.last_heartbeat is None:
+                continue
+
+            if now - child.last_heartbeat > self.heartbeat_timeout:
+                self.log.error('no heartbeat from bot {0!r} for {1:.0f}s, killing it'.format(
+                    nick, now - child.last_heartbeat))
+                child.last_heartbeat = None
+                child.kill('KILL')
+            elif now - child.started > MAX_RESTART_DELAY:
+                # been healthy for a while, forget about earlier crashes
+                self.restarts[nick] = 0
+
+    def bot_ended(self, child, reason):
+        if self.bots.get(child.nick) is child:
+            del self.bots[child.nick]
+
+        if not self.running:
+            self.log.info('bot {0!r} stopped'.format(child.nick))
+            return
+
+        restarts = self.restarts.get(child.nick, 0)
+        delay = min(DEFAULT_RESTART_DELAY * 2 ** restarts, MAX_RESTART_DELAY)
+        self.restarts[child.nick] = restarts + 1
+        self.log.error('bot {0!r} ended ({1}), restarting in {2}s'.format(child.nick, reason.getErrorMessage(),
+                                                                         delay))
+        reactor.callLater(delay, self.spawn, child.nick)
+
+    def shutdown(self, *args, **kwargs):
+        """stops all children along with the supervisor"""
+        self.log.info("Shutting down ...")
+        self.running = False
+        for nick, child in self.bots.items():
+            child.kill()
+
+
+def heartbeat(fd):
+    """
+    tells the supervisor this bot's reactor is still responsive
+    """
+    try:
+        os.write(fd, '.')
+    except OSError:
+        # supervisor is gone, nobody to tell
+        if reactor.running:
+            reactor.stop()
+
+
+def start_heartbeat(fd, interval):
+    loop = task.LoopingCall(heartbeat, fd)
+    loop.start(interval)
+    return loop
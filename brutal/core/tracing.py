@@ -0,0 +1,172 @@
+"""
+Traces events through the bot.
+
+A traced event carries a Trace, a list of (stage, timestamp) marks made as it
+moves along: received by the protocol, built, processed by the plugins,
+handled, routed, dispatched to a connection and sent. Actions built from the
+event get a copy of its trace, once an action is sent the time between each
+pair of stages goes into the tracer's histograms. Sampled and slow traces also
+get logged.
+"""
+import time
+import random
+import bisect
+import logging
+
+# seconds, monotonic where the platform has it
+clock = getattr(time, 'monotonic', time.time)
+
+# upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+
+
+class Histogram(object):
+    """
+    counts observed values into fixed buckets
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last count is for values above the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def __repr__(self):
+        return '<{0}: {1} values>'.format(self.__class__.__name__, self.count)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, fraction):
+        """
+        upper bound of the bucket holding the given fraction of the values,
+        None if there are none or it's above the largest bucket
+        """
+        if not self.count:
+            return None
+
+        needed = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= needed:
+                return bound
+
+    def snapshot(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else None,
+                'p50': self.percentile(0.5),
+                'p99': self.percentile(0.99)}
+
+
+class Trace(object):
+    """
+    the stages an event, and the actions built from it, went through
+    """
+    __slots__ = ('tracer', 'stages', 'sampled', 'finished')
+
+    def __init__(self, tracer=None, stages=None, sampled=False):
+        self.tracer = tracer
+        self.stages = stages or []
+        self.sampled = sampled
+        self.finished = False
+
+    def __repr__(self):
+        if not self.stages:
+            return '<{0}>'.format(self.__class__.__name__)
+
+        start = self.stages[0][1]
+        marks = ' '.join('{0} +{1:.3f}ms'.format(stage, 1000 * (at - start)) for stage, at in self.stages)
+        return '<{0} {1}>'.format(self.__class__.__name__, marks)
+
+    def mark(self, stage, at=None):
+        self.stages.append((stage, clock() if at is None else at))
+
+    def fork(self, stage=None):
+        """
+        copy of the trace for an action built from the traced event
+        """
+        trace = Trace(self.tracer, list(self.stages), self.sampled)
+        if stage is not None:
+            trace.mark(stage)
+        return trace
+
+    def hops(self):
+        """
+        list of ('stage->next stage', seconds) for consecutive stages
+        """
+        return [('{0}->{1}'.format(previous[0], stage[0]), stage[1] - previous[1])
+                for previous, stage in zip(self.stages, self.stages[1:])]
+
+    def total(self):
+        if not self.stages:
+            return 0.0
+        return self.stages[-1][1] - self.stages[0][1]
+
+    def finish(self, stage=None):
+        """
+        marks the last stage and records the trace with its tracer
+        """
+        if self.finished:
+            return
+        self.finished = True
+
+        if stage is not None:
+            self.mark(stage)
+        if self.tracer is not None:
+            self.tracer.record(self)
+
+
+class Tracer(object):
+    """
+    starts the traces of a bot and keeps a latency histogram per hop.
+
+    sample_rate is the fraction of traces that get logged, traces taking
+    longer than slow_threshold seconds are always logged.
+    """
+    def __init__(self, name, sample_rate=0.0, slow_threshold=None, buckets=DEFAULT_BUCKETS):
+        self.log = logging.getLogger('{0}.{1}.{2}'.format(self.__class__.__module__, self.__class__.__name__, name))
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.buckets = buckets
+
+        # 'stage->stage' -> Histogram
+        self.histograms = {}
+        self.total = Histogram(buckets)
+
+    def __repr__(self):
+        return '<{0}: {1} traces>'.format(self.__class__.__name__, self.total.count)
+
+    def start(self, received=None):
+        """
+        trace for a newly built event, received is when the protocol got it
+        """
+        trace = Trace(self, sampled=self.sample_rate > 0 and random.random() < self.sample_rate)
+        if received is not None:
+            trace.mark('received', received)
+        trace.mark('built')
+        return trace
+
+    def record(self, trace):
+        for hop, seconds in trace.hops():
+            histogram = self.histograms.get(hop)
+            if histogram is None:
+                histogram = self.histograms[hop] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+        total = trace.total()
+        self.total.observe(total)
+
+        if self.slow_threshold is not None and total >= self.slow_threshold:
+            self.log.warning('slow trace ({0:.3f}s): {1!r}'.format(total, trace))
+        elif trace.sampled:
+            self.log.info('trace: {0!r}'.format(trace))
+
+    def stats(self):
+        stats = dict((hop, histogram.snapshot()) for hop, histogram in self.histograms.items())
+        stats['total'] = self.total.snapshot()
+        return stats
@@ -0,0 +1,380 @@
+"""
+Runs a bot's plugins in worker processes.
+
+The protocol connections stay in the bot's process, which sends every event
+to one of the workers and routes the actions coming back. Events are sharded
+by room, so events from the same room are always handled in order by the same
+worker.
+
+Messages are pickled tuples framed with a 4 byte length. The bot writes to a
+worker's stdin and reads from its fd 3, anything a worker writes to stdout /
+stderr ends up in the bot's log.
+"""
+import os
+import sys
+import zlib
+import struct
+import logging
+import itertools
+import cPickle as pickle
+from collections import OrderedDict
+
+from twisted.internet import protocol, defer
+
+# this module is the entry point of worker processes, see LazyReactor
+from brutal.core.runtime import lazy_reactor as reactor, install_reactor
+from brutal.core.models import Action, Event
+from brutal.core.constants import DEFAULT_RESTART_DELAY, MAX_RESTART_DELAY, DEFAULT_HANDLER_TIMEOUT
+
+PREFIX = struct.Struct('!I')
+MAX_MESSAGE_LENGTH = 16 * 1024 * 1024
+
+# fd the workers write their messages to
+WORKER_OUT_FD = 3
+
+
+def pack_message(*message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return PREFIX.pack(len(data)) + data
+
+
+class MessageReader(object):
+    """
+    splits a byte stream into the messages written by pack_message
+    """
+    def __init__(self, handler):
+        self.handler = handler
+        self.buffer = ''
+
+    def feed(self, data):
+        self.buffer += data
+        while len(self.buffer) >= PREFIX.size:
+            length, = PREFIX.unpack_from(self.buffer)
+            if length > MAX_MESSAGE_LENGTH:
+                raise ValueError('message too long: {0}'.format(length))
+            end = PREFIX.size + length
+            if len(self.buffer) < end:
+                return
+            data = self.buffer[PREFIX.size:end]
+            self.buffer = self.buffer[end:]
+            self.handler(pickle.loads(data))
+
+
+def shard_key(event):
+    """
+    the part of an event deciding which worker gets it, private messages go
+    by nick so each user's queries stay in order too.
+    """
+    room = event.source_room
+    if room is None and isinstance(event.meta, dict):
+        room = event.meta.get('nick')
+    return u'{0}:{1}'.format(event.source_client_id, room).encode('utf-8')
+
+
+class WorkerProcess(protocol.ProcessProtocol):
+    """
+    the bot's end of a single worker process
+    """
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.reader = MessageReader(self.message_received)
+        self.log = logging.getLogger('{0}.worker.{1}'.format(pool.log.name, index))
+
+        self.ready = False
+        self.in_flight = set()
+
+    def connectionMade(self):
+        self.log.info('worker {0} started'.format(self.index))
+        self.send('setup', self.pool.setup_details(self.index))
+
+    def send(self, *message):
+        self.transport.write(pack_message(*message))
+
+    def childDataReceived(self, fd, data):
+        if fd == WORKER_OUT_FD:
+            try:
+                self.reader.feed(data)
+            except Exception:
+                self.log.exception('invalid data from worker {0}, killing it'.format(self.index))
+                self.transport.signalProcess('KILL')
+        else:
+            # aggregate the worker's own output in our log
+            for line in data.splitlines():
+                if line.strip():
+                    self.log.info(line)
+
+    def message_received(self, message):
+        kind = message[0]
+        if kind == 'ready':
+            self.ready = True
+            self.pool.worker_ready(self)
+        elif kind == 'action':
+            self.pool.action_received(message[1], message[2])
+        elif kind == 'done':
+            self.in_flight.discard(message[1])
+            self.pool.event_done(message[1])
+        else:
+            self.log.error('unknown message from worker: {0!r}'.format(kind))
+
+    def processEnded(self, reason):
+        self.pool.worker_ended(self, reason)
+
+
+class WorkerPool(object):
+    """
+    spawns and supervises the worker processes of a bot, and hands events to
+    them. crashed workers get restarted with a backoff while the bot's
+    connections stay up, events the worker was busy with are dropped.
+    """
+    def __init__(self, bot, size, restart_delay=DEFAULT_RESTART_DELAY):
+        self.bot = bot
+        self.size = size
+        self.restart_delay = restart_delay
+        self.log = logging.getLogger('{0}.{1}.{2}'.format(self.__class__.__module__, self.__class__.__name__,
+                                                          bot.nick))
+
+        self.workers = [None] * size
+        self.restarts = [0] * size
+        self.running = False
+
+        self.event_ids = itertools.count(1)
+        # event id -> event, for events a worker is still busy with
+        self.events = {}
+        self.stats = {'sent': 0, 'dropped': 0, 'crashes': 0}
+
+    def __repr__(self):
+        return '<{0}: {1} workers>'.format(self.__class__.__name__, self.size)
+
+    def setup_details(self, index):
+        clients = OrderedDict()
+        for client_id, client in self.bot.connection_manager.clients.items():
+            clients[client_id] = client.default_room
+
+        return {'index': index,
+                'workers': self.size,
+                'nick': self.bot.nick,
+                'command_token': self.bot.command_token,
+                'enabled_plugins': self.bot.enabled_plugins,
+                'handler_timeout': getattr(self.bot, 'handler_timeout', DEFAULT_HANDLER_TIMEOUT),
+                'handler_timeout_reply': getattr(self.bot, 'handler_timeout_reply', None),
+                'clients': clients}
+
+    def start(self):
+        self.running = True
+        for index in range(self.size):
+            self.spawn(index)
+
+    def stop(self):
+        self.running = False
+        for worker in self.workers:
+            if worker is not None and worker.transport is not None:
+                worker.send('stop')
+                worker.transport.closeStdin()
+
+    def spawn(self, index):
+        if not self.running:
+            return
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+
+        worker = WorkerProcess(self, index)
+        self.workers[index] = worker
+        reactor.spawnProcess(worker, sys.executable, [sys.executable, '-m', __name__], env=env,
+                             path=os.getcwd(), childFDs={0: 'w', 1: 'r', 2: 'r', WORKER_OUT_FD: 'r'})
+
+    def worker_ready(self, worker):
+        self.restarts[worker.index] = 0
+
+    def worker_ended(self, worker, reason):
+        if self.workers[worker.index] is worker:
+            self.workers[worker.index] = None
+
+        if worker.in_flight:
+            self.log.error('dropping {0} events of worker {1}'.format(len(worker.in_flight), worker.index))
+            self.stats['dropped'] += len(worker.in_flight)
+            for event_id in worker.in_flight:
+                self.events.pop(event_id, None)
+
+        if not self.running:
+            return
+
+        self.stats['crashes'] += 1
+        delay = min(self.restart_delay * 2 ** self.restarts[worker.index], MAX_RESTART_DELAY)
+        self.restarts[worker.index] += 1
+        self.log.error('worker {0} ended ({1}), restarting in {2}s'.format(worker.index, reason.getErrorMessage(),
+                                                                          delay))
+        reactor.callLater(delay, self.spawn, worker.index)
+
+    def worker_for(self, event):
+        return (zlib.crc32(shard_key(event)) & 0xffffffff) % self.size
+
+    def process_event(self, event):
+        """
+        sends the event to the worker of its room
+        """
+        worker = self.workers[self.worker_for(event)]
+        if worker is None or not worker.ready:
+            self.log.warning('no worker running for {0!r}, dropping it'.format(event))
+            self.stats['dropped'] += 1
+            return
+
+        event_id = next(self.event_ids)
+        try:
+            worker.send('event', event_id, event.snapshot())
+        except Exception as e:
+            self.log.exception('failed to send {0!r} to worker: {1!r}'.format(event, e))
+            self.stats['dropped'] += 1
+            return
+
+        self.events[event_id] = event
+        worker.in_flight.add(event_id)
+        self.stats['sent'] += 1
+
+    def action_received(self, event_id, details):
+        event = self.events.get(event_id)
+        try:
+            action = Action.from_snapshot(self.bot, details, source_event=event)
+        except Exception as e:
+            self.log.exception('failed to rebuild action from worker: {0!r}'.format(e))
+        else:
+            self.bot.route_response(action, action.source_event)
+
+    def event_done(self, event_id):
+        self.events.pop(event_id, None)
+
+
+# worker side
+
+class WorkerConnection(object):
+    """
+    stands in for a protocol backend of the bot in a worker
+    """
+    def __init__(self, client_id, default_room):
+        self.id = client_id
+        self.default_room = default_room
+
+
+class WorkerConnectionManager(object):
+    def __init__(self, clients):
+        self.clients = OrderedDict((client_id, WorkerConnection(client_id, room))
+                                   for client_id, room in clients.items())
+
+    @property
+    def default_connection(self):
+        for client in self.clients:
+            return client
+
+
+class WorkerBot(object):
+    """
+    the bot as seen by plugins running in a worker. actions are sent back to
+    the real bot instead of being queued.
+    """
+    def __init__(self, channel, details):
+        from brutal.core.plugin import PluginManager
+
+        self.channel = channel
+        self.index = details['index']
+        self.workers = details.get('workers', 1)
+        self.nick = details['nick']
+        self.id = '{0}-worker-{1}'.format(self.nick, self.index)
+        self.command_token = details['command_token']
+        self.enabled_plugins = details['enabled_plugins']
+        self.handler_timeout = details.get('handler_timeout', DEFAULT_HANDLER_TIMEOUT)
+        self.handler_timeout_reply = details.get('handler_timeout_reply')
+        self.connection_manager = WorkerConnectionManager(details['clients'])
+        self.bot_manager = None
+
+        self.log = logging.getLogger('{0}.{1}.{2}'.format(self.__class__.__module__, self.__class__.__name__,
+                                                          self.id))
+        self.plugin_manager = PluginManager(bot=self)
+
+    def __repr__(self):
+        return '<{0}: {1!r} ({2!s})>'.format(self.__class__.__name__, self.nick, self.id)
+
+    def start(self):
+        self.plugin_manager.start(self.enabled_plugins)
+
+    def shutdown(self, *args, **kwargs):
+        self.plugin_manager.shutdown(*args, **kwargs)
+
+    def handle_event(self, event_id, details):
+        details['event_id'] = event_id
+        event = Event(source_bot=self, raw_details=details)
+
+        responses = self.plugin_manager.process_event(event)
+        for response in responses:
+            response.addCallback(self.route_response, event)
+
+        d = defer.DeferredList(responses)
+        d.addCallback(lambda _: self.channel.send('done', event_id))
+
+    def route_response(self, response, event):
+        if not isinstance(response, Action):
+            if response is not None:
+                self.log.error('got invalid response type')
+            return
+
+        event = response.source_event or event
+        if event is None and self.index != 0:
+            # tasks not tied to an event run in every worker, only let the
+            # first one talk so their output isn't repeated
+            return
+
+        event_id = event.raw_details.get('event_id') if event is not None else None
+        self.channel.send('action', event_id, response.snapshot())
+
+
+class WorkerChannel(protocol.Protocol):
+    """
+    the worker's end of the connection to its bot
+    """
+    def __init__(self):
+        self.reader = MessageReader(self.message_received)
+        self.bot = None
+        self.log = logging.getLogger('{0}.{1}'.format(self.__class__.__module__, self.__class__.__name__))
+
+    def send(self, *message):
+        self.transport.write(pack_message(*message))
+
+    def dataReceived(self, data):
+        self.reader.feed(data)
+
+    def message_received(self, message):
+        kind = message[0]
+        if kind == 'event':
+            try:
+                self.bot.handle_event(message[1], message[2])
+            except Exception as e:
+                self.log.exception('failed handling event {0!r}: {1!r}'.format(message[1], e))
+                self.send('done', message[1])
+        elif kind == 'setup':
+            self.bot = WorkerBot(self, message[1])
+            self.bot.start()
+            self.send('ready')
+        elif kind == 'stop':
+            self.transport.loseConnection()
+
+    def connectionLost(self, reason):
+        if self.bot is not None:
+            self.bot.shutdown()
+        if reactor.running:
+            reactor.stop()
+
+
+def run_worker():
+    from twisted.internet import stdio
+    from brutal.conf import config
+
+    # the same reactor the bot runs on
+    install_reactor(config.REACTOR)
+    logging.basicConfig(level=config.LOG_LEVEL, format=config.LOG_FORMAT, stream=sys.stderr)
+
+    stdio.StandardIO(WorkerChannel(), stdin=0, stdout=WORKER_OUT_FD)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    run_worker()
@@ -0,0 +1,59 @@
+"""
+Profiling a running bot from chat, for the nicks given as admins in the bot
+config:
+
+    'enabled_plugins': {
+        'brutal.plugins.profiling': {'admins': ['nick']},
+    }
+
+The pstats file ends up in DATA_DIR, see brutal.core.profiling.
+"""
+from brutal.conf import config
+from brutal.core.plugin import BotPlugin, cmd
+from brutal.core.profiling import profiler, handler_summary
+
+
+class Profiling(BotPlugin):
+    def is_admin(self, event):
+        admins = (self.config or {}).get('admins', [])
+        return isinstance(event.meta, dict) and event.meta.get('nick') in admins
+
+    @cmd
+    def profile(self, event):
+        """Profiles the bot for a while and lists its slowest handlers.
+
+        Examples:
+
+            !profile
+            !profile 60 5
+        """
+        if not self.is_admin(event):
+            return 'no...'
+
+        try:
+            duration = float(event.args[0]) if event.args else config.PROFILE_DURATION
+            top = int(event.args[1]) if len(event.args) > 1 else config.PROFILE_TOP
+        except ValueError:
+            return 'usage: profile [seconds] [top]'
+        # nan compares false to anything
+        if not 0 < duration < float('inf'):
+            return 'usage: profile [seconds] [top]'
+        duration = min(duration, config.PROFILE_MAX_DURATION)
+
+        if profiler.active:
+            return 'already profiling'
+
+        d = profiler.start(duration, config.DATA_DIR, self.bot.nick)
+        d.addCallback(self.report, event, top)
+        d.addErrback(lambda failure: self.msg('profiling failed: {0}'.format(failure.getErrorMessage()), event=event))
+        return 'profiling for {0}s'.format(duration)
+
+    def report(self, result, event, top):
+        path, stats = result
+        parsers = []
+        for event_parsers in self.bot.plugin_manager.event_parsers.values():
+            parsers.extend(event_parsers)
+
+        self.msg('profile written to {0}'.format(path), event=event)
+        for line in handler_summary(stats, parsers, top):
+            self.msg(line, event=event)
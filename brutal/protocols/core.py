@@ -1,9 +1,11 @@
 import uuid
 import logging
-from twisted.internet.defer import DeferredQueue
+from twisted.internet.defer import Deferred, DeferredQueue
 
 from brutal.core.utils import PluginRoot
 from brutal.core.models import Event, Action
+from brutal.core.tracing import clock
+from brutal.core.metrics import CONNECTION_QUEUE_DEPTH
 
 
 def catch_error(failure):
@@ -29,6 +31,8 @@ class ProtocolBackend(object):
 
         self.action_queue = DeferredQueue()
         self.consume_actions(self.action_queue)
+        CONNECTION_QUEUE_DEPTH.labels(getattr(bot, 'nick', None), self.protocol_name, self.id).set_function(
+            lambda: len(self.action_queue.pending))
 
         self.log = logging.getLogger('{0}.{1}'.format(self.__class__.__module__, self.__class__.__name__))
 
@@ -54,6 +58,8 @@ class ProtocolBackend(object):
             event.source_client_id = self.id
             self.bot.new_event(event)
         elif isinstance(event, dict):
+            # protocols stamp this as early as they can, see tracing
+            event.setdefault('received', clock())
             event['client'] = self
             event['client_id'] = self.id
             self.bot.new_event(event)
@@ -72,19 +78,60 @@ class ProtocolBackend(object):
         """
         def consumer(action):
             if isinstance(action, Action):
-                self.handle_action(action)
+                sent = self.handle_action(action)
+                if isinstance(sent, Deferred):
+                    # fails when flood control dropped the lines
+                    sent.addCallbacks(self._action_sent, self._action_dropped,
+                                      callbackArgs=(action,), errbackArgs=(action,))
+                elif action.trace is not None:
+                    action.trace.finish('sent')
             else:
                 self.log.warning('invalid action put in queue: {0!r}'.format(action))
 
             queue.get().addCallback(consumer)
         queue.get().addCallback(consumer)
 
+    def _action_sent(self, result, action):
+        if action.trace is not None:
+            action.trace.finish('sent')
+
+    def _action_dropped(self, failure, action):
+        self.log.info('{0!r} not sent: {1}'.format(action, failure.getErrorMessage()))
+        if action.trace is not None:
+            action.trace.finish('dropped')
+
     def handle_action(self, action):
         """
-        should take an action and act on it
+        should take an action and act on it, returning a deferred firing once
+        it's sent if that happens later
         """
         raise NotImplementedError
 
+    @property
+    def transport(self):
+        """
+        the transport of the active connection, if the backend has one
+        """
+        return None
+
+    def pause_reading(self):
+        """
+        stops reading from the connection through twisted's producer api, used when the bot can't keep up
+        """
+        transport = self.transport
+        if transport is not None:
+            self.log.debug('pausing transport on {0!r}'.format(self))
+            transport.pauseProducing()
+
+    def resume_reading(self):
+        """
+        resumes reading from a connection paused with pause_reading
+        """
+        transport = self.transport
+        if transport is not None:
+            self.log.debug('resuming transport on {0!r}'.format(self))
+            transport.resumeProducing()
+
     def configure(self, *args, **kwargs):
         """
         should read in the config options and setup client
@@ -1,14 +1,246 @@
+import os
+import string
 import logging
 from twisted.internet import reactor, protocol
 from twisted.python import log
 from twisted.words.protocols import irc
 
+from brutal.conf import config
+from brutal.core.capture import CaptureWriter
+from brutal.core.tracing import clock
+from brutal.core.metrics import RECONNECTS, SEND_QUEUE_DEPTH, SEND_DROPPED
+from brutal.core.ratelimit import SendScheduler, LANES, LANE_CONTROL, LANE_REPLY, LANE_TASK
 from brutal.protocols.core import ProtocolBackend
 #from brutal.protocols.core import catch_error
 
-import re
-
 IRC_DEFAULT_PORT = 6667
+# flood control: lines a second, lines sent at once after a quiet spell and
+# lines each lane behind control holds before dropping its oldest
+IRC_FLOOD_RATE = 1.0
+IRC_FLOOD_BURST = 5
+IRC_FLOOD_QUEUE_LIMIT = 100
+# bytes in a line the server relays, without its \r\n
+IRC_MAX_LINE = 510
+# lengths to assume for our user and host until the server tells us
+IRC_USERLEN = 10
+IRC_HOSTLEN = 63
+
+
+# ISUPPORT CASEMAPPING -> table folding names to the case they compare in
+CASEMAPPINGS = {
+    'ascii': string.maketrans(string.ascii_uppercase, string.ascii_lowercase),
+    'rfc1459': string.maketrans(string.ascii_uppercase + '[]\\~', string.ascii_lowercase + '{}|^'),
+    'strict-rfc1459': string.maketrans(string.ascii_uppercase + '[]\\', string.ascii_lowercase + '{}|'),
+}
+IRC_DEFAULT_CASEMAPPING = 'rfc1459'
+
+
+# characters of nicks, anything else before a ':' means it isn't addressing one
+NICK_CHARS = string.ascii_letters + string.digits + '[]\\`_^{|}-'
+
+# twisted logs through this logger, see brutal.run.setup_logging
+twisted_log = logging.getLogger('twisted')
+
+
+def split_recipients(message):
+    """
+    'alice: bob: hi' -> (['alice', 'bob'], 'hi'), ([], message) when message
+    doesn't start with nicks it's addressed to
+    """
+    recipients = []
+    position = 0
+    while True:
+        colon = message.find(':', position)
+        if colon < 0:
+            break
+        recipient = message[position:colon].strip()
+        if recipient.translate(None, NICK_CHARS):
+            break
+        recipients.append(recipient)
+        position = colon + 1
+
+    if not recipients:
+        return recipients, message
+    return recipients, message[position:].strip()
+
+
+class ChannelMembers(object):
+    """
+    who is in which of the bot's rooms, indexed both ways by casefolded name,
+    so joins, parts, quits and renames only touch the rooms involved. the
+    protocol keeps it up to date, plugins only query it: members, channels,
+    is_member and nick in members.
+    """
+    def __init__(self, casemapping=IRC_DEFAULT_CASEMAPPING):
+        self.casemapping = casemapping
+        self.table = CASEMAPPINGS[casemapping]
+
+        # folded channel -> set of folded nicks, and folded nick -> set of
+        # folded channels
+        self.by_channel = {}
+        self.by_nick = {}
+        # folded name -> name as last seen
+        self.channel_names = {}
+        self.nick_names = {}
+
+    def __repr__(self):
+        return '<{0}: {1} nicks in {2} channels>'.format(self.__class__.__name__, len(self.by_nick),
+                                                         len(self.by_channel))
+
+    def __len__(self):
+        return len(self.by_nick)
+
+    def __contains__(self, nick):
+        return self.fold(nick) in self.by_nick
+
+    def fold(self, name):
+        # names come off the wire as bytes, plugins may ask with unicode
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        return name.translate(self.table)
+
+    #-- queries
+    def members(self, channel):
+        """
+        nicks in channel
+        """
+        names = self.nick_names
+        return frozenset(names[nick] for nick in self.by_channel.get(self.fold(channel), ()))
+
+    def channels(self, nick):
+        """
+        channels nick is in, as far as the bot can see
+        """
+        names = self.channel_names
+        return frozenset(names[channel] for channel in self.by_nick.get(self.fold(nick), ()))
+
+    def is_member(self, channel, nick):
+        return self.fold(nick) in self.by_channel.get(self.fold(channel), ())
+
+    #-- updates
+    def set_casemapping(self, casemapping):
+        """
+        switches to the casemapping the server announced, unknown ones are
+        ignored
+        """
+        casemapping = casemapping.lower()
+        if casemapping == self.casemapping or casemapping not in CASEMAPPINGS:
+            return
+
+        memberships = [(self.channel_names[channel], self.nick_names[nick])
+                       for channel, nicks in self.by_channel.items() for nick in nicks]
+        channels = self.channel_names.values()
+        self.casemapping = casemapping
+        self.table = CASEMAPPINGS[casemapping]
+        self.clear()
+        for channel in channels:
+            self.add_channel(channel)
+        for channel, nick in memberships:
+            self.join(channel, nick)
+
+    def add_channel(self, channel):
+        folded = self.fold(channel)
+        self.channel_names[folded] = channel
+        return self.by_channel.setdefault(folded, set())
+
+    def join(self, channel, nick):
+        folded = self.fold(nick)
+        self.nick_names[folded] = nick
+        self.add_channel(channel).add(folded)
+        self.by_nick.setdefault(folded, set()).add(self.fold(channel))
+
+    def part(self, channel, nick):
+        """
+        returns whether nick was in channel
+        """
+        folded_channel, folded = self.fold(channel), self.fold(nick)
+        nicks = self.by_channel.get(folded_channel)
+        if not nicks or folded not in nicks:
+            return False
+
+        nicks.discard(folded)
+        self._leave(folded, folded_channel)
+        return True
+
+    def quit(self, nick):
+        """
+        takes nick out of every channel, returns the channels they were in
+        """
+        folded = self.fold(nick)
+        self.nick_names.pop(folded, None)
+        channels = self.by_nick.pop(folded, ())
+        for channel in channels:
+            self.by_channel[channel].discard(folded)
+        return [self.channel_names[channel] for channel in channels]
+
+    def rename(self, old, new):
+        """
+        returns the channels the renamed nick is in
+        """
+        folded_old, folded_new = self.fold(old), self.fold(new)
+        self.nick_names.pop(folded_old, None)
+        channels = self.by_nick.pop(folded_old, None)
+        if not channels:
+            return []
+
+        for channel in channels:
+            nicks = self.by_channel[channel]
+            nicks.discard(folded_old)
+            nicks.add(folded_new)
+        self.by_nick.setdefault(folded_new, set()).update(channels)
+        self.nick_names[folded_new] = new
+        return [self.channel_names[channel] for channel in channels]
+
+    def remove_channel(self, channel):
+        """
+        forgets channel and who was in it, once the bot isn't there anymore
+        """
+        folded_channel = self.fold(channel)
+        self.channel_names.pop(folded_channel, None)
+        for folded in self.by_channel.pop(folded_channel, ()):
+            self._leave(folded, folded_channel)
+
+    def clear(self):
+        self.by_channel.clear()
+        self.by_nick.clear()
+        self.channel_names.clear()
+        self.nick_names.clear()
+
+    def _leave(self, folded, folded_channel):
+        channels = self.by_nick[folded]
+        channels.discard(folded_channel)
+        if not channels:
+            del self.by_nick[folded]
+            del self.nick_names[folded]
+
+
+def split_message(text, limit):
+    """
+    splits text into utf-8 lines of at most limit bytes, on its newlines and
+    between words where it can, never inside a character. empty lines are
+    left out, irc can't send them.
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+
+    lines = []
+    for line in text.splitlines():
+        while len(line) > limit:
+            cut = line.rfind(' ', 0, limit + 1)
+            if cut > 0:
+                rest = line[cut + 1:]
+            else:
+                # a word longer than a line, back off to the start of a character
+                cut = limit
+                while cut > 0 and 0x80 <= ord(line[cut]) < 0xc0:
+                    cut -= 1
+                cut = cut or limit
+                rest = line[cut:]
+            lines.append(line[:cut])
+            line = rest
+        if line:
+            lines.append(line)
+    return lines
 
 # OLD
 # def irc_event_parser(raw_event):
@@ -318,8 +550,9 @@ class SimpleIrcBotProtocol(irc.IRCClient):
     """
     event_version = '1'
 
-    RECIPIENTS_SPLIT_REGEX = '^((?:[\s]*[0-9A-Za-z_-~]{0,12}[\s]*:[\s]*)+)(.*)$'
     DIRECT_REPLY = '{who}: {what}'
+    # joins replies packed into one line, see pack_lines
+    PACK_SEPARATOR = ' | '
 
     def __init__(self):
         self.channel_users = {}
@@ -328,7 +561,18 @@ class SimpleIrcBotProtocol(irc.IRCClient):
         self.realname = 'brutal_bot'
         self.username = 'brutal_bot'
 
-        self.recipients_regex = re.compile(self.RECIPIENTS_SPLIT_REGEX)
+        # folded names the bot answers to, and what they were built from
+        self.bot_names = frozenset()
+        self.bot_names_span = 0
+        self.bot_names_key = None
+
+        # user@host the server shows us with, learned when we join a room
+        self.userhost = None
+
+        # SendScheduler the lines go out through, None without flood control
+        self.scheduler = None
+        # lane of the lines sent right now, see _bot_process_action
+        self.lane = LANE_CONTROL
 
     @property
     def nickname(self):
@@ -338,42 +582,144 @@ class SimpleIrcBotProtocol(irc.IRCClient):
     def channels(self):
         return self.factory.channels
 
+    def connectionMade(self):
+        factory = self.factory
+        if factory.flood_rate:
+            backend = factory.backend
+            labels = (getattr(getattr(backend, 'bot', None), 'nick', None), getattr(backend, 'id', None))
+            self.scheduler = scheduler = SendScheduler(self._reallySendLine, factory.flood_rate, factory.flood_burst,
+                                                       factory.flood_queue_limit,
+                                                       on_drop=lambda lane: SEND_DROPPED.labels(*labels + (lane,)).inc(),
+                                                       merge=self.pack_lines)
+            for lane in LANES:
+                SEND_QUEUE_DEPTH.labels(*labels + (lane,)).set_function(lambda lane=lane: scheduler.depth[lane])
+        irc.IRCClient.connectionMade(self)
+
+    def connectionLost(self, reason):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        self.members.clear()
+        irc.IRCClient.connectionLost(self, reason)
+
+    def sendLine(self, line):
+        if self.scheduler is None:
+            irc.IRCClient.sendLine(self, line)
+        else:
+            self.scheduler.put(line, self.lane)
+
+    def irc_JOIN(self, prefix, params):
+        nick, _, userhost = prefix.partition('!')
+        if nick == self.nickname and userhost:
+            self.userhost = userhost
+        irc.IRCClient.irc_JOIN(self, prefix, params)
+
+    def message_limit(self, target):
+        """
+        bytes of text that fit in a privmsg to target, once the server puts
+        our nick!user@host in front of it
+        """
+        userhost = self.userhost or '{0}@{1}'.format('u' * IRC_USERLEN, 'h' * IRC_HOSTLEN)
+        # :nick!user@host PRIVMSG target :text
+        return IRC_MAX_LINE - len(':{0}!{1} PRIVMSG {2} :'.format(self.nickname, userhost, target))
+
+    def send_message(self, target, text, prefix=''):
+        """
+        sends text to target in as many privmsgs as it takes, prefix starting
+        each of them
+        """
+        for line in split_message(text, self.message_limit(target) - len(prefix)):
+            self.sendLine('PRIVMSG {0} :{1}{2}'.format(target, prefix, line))
+
+    def pack_lines(self, previous, line):
+        """
+        joins two privmsgs to the same target waiting for flood control into
+        one if it fits, None if they don't go together
+        """
+        if not line.startswith('PRIVMSG ') or '\x01' in line or '\x01' in previous:
+            return None
+
+        head, _, text = line.partition(' :')
+        if not previous.startswith(head + ' :'):
+            return None
+
+        # replies to the same nick only need to address it once
+        who, separator, _ = text.partition(': ')
+        if separator and who and ' ' not in who:
+            prefix = self.DIRECT_REPLY.format(who=who, what='')
+            if previous[len(head) + 2:].startswith(prefix):
+                text = text[len(prefix):]
+
+        packed = previous + self.PACK_SEPARATOR + text
+        if len(packed) - len(head) - 2 > self.message_limit(head[len('PRIVMSG '):]):
+            return None
+        return packed
+
+    def update_bot_names(self):
+        """
+        folds the nick and aliases of the bot, again once either or the
+        casemapping changed
+        """
+        members = self.members
+        key = (self.nickname, members.casemapping)
+        if key != self.bot_names_key:
+            names = [self.nickname] + list(self.factory.aliases)
+            self.bot_names = frozenset(members.fold(name) for name in names)
+            self.bot_names_span = max(len(name) for name in names) + 1
+            self.bot_names_key = key
+        return self.bot_names
+
+    def split_highlight(self, message):
+        """
+        (recipients, body, highlight) of a room message, the body without the
+        recipients when it's addressed to the bot, as 'bot: hi' or 'bot, hi'
+        """
+        recipients, body = split_recipients(message)
+        names = self.update_bot_names()
+        fold = self.members.fold
+        if recipients:
+            for recipient in recipients:
+                if fold(recipient) in names:
+                    return recipients, body, True
+            return recipients, message, False
+
+        # only as far in as the longest name could reach
+        comma = message.find(',', 0, self.bot_names_span)
+        if comma > 0:
+            recipient = message[:comma].rstrip()
+            if fold(recipient) in names:
+                return [recipient], message[comma + 1:].strip(), True
+        return recipients, message, False
+
     def privmsg(self, user, channel, message):
         """
         handle a new msg on irc
         """
-        log.msg('privmsg - user: {0!r}, channel: {1!r}, msg: {2!r}'.format(user, channel, message),
-                logLevel=logging.DEBUG)
+        received = clock()
+        if twisted_log.isEnabledFor(logging.DEBUG):
+            log.msg('privmsg - user: {0!r}, channel: {1!r}, msg: {2!r}'.format(user, channel, message),
+                    logLevel=logging.DEBUG)
 
         nick, _, host = user.partition('!')
         message = message.strip()
-
-        recipients = []
-        match = self.recipients_regex.findall(message)
-        if match != []:
-            cleaned_recipients = match[0][0].strip().split(':')[:-1]
-            recipients = [recip.strip() for recip in cleaned_recipients]
-
-        event_data = {'type': 'message',
-                      'scope': 'private',
-                      'source': 'query',
-                      'meta': {
-                          'from': user,
-                          'body': message,
-                          'nick': nick,
-                          'host': host}
-                      }
+        meta = {'from': user, 'body': message, 'nick': nick, 'host': host}
+        event_data = {'type': 'message', 'scope': 'private', 'received': received, 'meta': meta}
 
         # parse if we're the owner / message was to bot directly
         if channel == self.nickname:
             event_data['source'] = 'query'
-            event_data['meta']['recipients'] = [self.nickname]
+            meta['recipients'] = [self.nickname]
         else:
             event_data['channel'] = channel
-            event_data['meta']['recipients'] = recipients
-            if self.nickname in recipients:
+            # nothing but 'nick:' and 'nick,' can address anyone
+            if ':' in message or ',' in message:
+                recipients, body, highlight = self.split_highlight(message)
+            else:
+                recipients, body, highlight = [], message, False
+
+            meta['recipients'] = recipients
+            if highlight:
                 event_data['source'] = 'highlight'
-                event_data['meta']['body'] = match[0][1].strip()
+                meta['body'] = body
             else:
                 event_data['source'] = 'room'
 
@@ -425,6 +771,28 @@ class SimpleIrcBotProtocol(irc.IRCClient):
         log.msg('irc_unknown - prefix: {0!r}, cmd: {1!r}, params: {2!r}'.format(prefix, command, params),
                 logLevel=logging.DEBUG)
 
+    @property
+    def members(self):
+        return self.factory.backend.members
+
+    def isupport(self, options):
+        self.members.set_casemapping(self.supported.getFeature('CASEMAPPING', (IRC_DEFAULT_CASEMAPPING,))[0])
+
+    def joined(self, channel):
+        log.msg('joined: {0!r}'.format(channel), logLevel=logging.DEBUG)
+        # whoever is there comes with the names reply
+        self.members.remove_channel(channel)
+        self.members.join(channel, self.nickname)
+
+    def left(self, channel):
+        log.msg('left: {0!r}'.format(channel), logLevel=logging.DEBUG)
+        self.members.remove_channel(channel)
+
+    def kickedFrom(self, channel, kicker, message):
+        log.msg('kickedFrom - channel: {0!r}, kicker: {1!r}, msg: {2!r}'.format(channel, kicker, message),
+                logLevel=logging.DEBUG)
+        self.members.remove_channel(channel)
+
     def userJoined(self, user, channel):
         log.msg('userJoined - user: {0!r}, channel: {1!r}'.format(user, channel), logLevel=logging.DEBUG)
 
@@ -438,7 +806,7 @@ class SimpleIrcBotProtocol(irc.IRCClient):
                             'from': user
                           }}
 
-        self.factory.backend.nick_list[channel].append(user)
+        self.members.join(channel, nick)
         self._bot_process_event(event_data)
 
     def userLeft(self, user, channel):
@@ -453,13 +821,14 @@ class SimpleIrcBotProtocol(irc.IRCClient):
                             'from': user
                           }}
 
-        self.factory.backend.nick_list[channel].remove(user)
+        self.members.part(channel, nick)
         self._bot_process_event(event_data)
 
     def userQuit(self, user, quitMessage):
         log.msg('userQuit - user: {0!r}, quit msg: {1!r}'.format(user, quitMessage), logLevel=logging.DEBUG)
         nick, _, host = user.partition('!')
-        for channel in self.channels:
+        # one event for each room they were in
+        for channel in self.members.quit(nick):
             event_data = {'type': 'quit',
                           'scope': 'public',
                           'channel': channel,
@@ -470,7 +839,6 @@ class SimpleIrcBotProtocol(irc.IRCClient):
                                 'message': quitMessage
                               }}
 
-            self.factory.backend.nick_list[channel].remove(user)
             self._bot_process_event(event_data)
 
 
@@ -483,11 +851,11 @@ class SimpleIrcBotProtocol(irc.IRCClient):
                       'meta': {
                             'nick': nick,
                             'host': host,
-                            'from': user,
+                            'from': kicker,
                             'kickee': kickee
                           }}
 
-        self.factory.backend.nick_list[channel].remove(user)
+        self.members.part(channel, kickee)
         self._bot_process_event(event_data)
 
 
@@ -512,7 +880,7 @@ class SimpleIrcBotProtocol(irc.IRCClient):
         log.msg('userRenamed - old: {0!r}, new: {1!r}'.format(oldname, newname), logLevel=logging.DEBUG)
 
         nick, _, host = oldname.partition('!')
-        for channel in self.channels:
+        for channel in self.members.rename(nick, newname):
             event_data = {'type': 'rename',
                           'scope': 'public',
                           'channel': channel,
@@ -522,66 +890,125 @@ class SimpleIrcBotProtocol(irc.IRCClient):
                                 'from': oldname,
                                 'new_name': newname
                               }}
-            self.factory.backend.nick_list[channel].remove(oldname)
-            self.factory.backend.nick_list[channel].append(newname)
             self._bot_process_event(event_data)
 
+    def lineReceived(self, line):
+        capture = self.factory.capture
+        if capture is not None:
+            capture.write(line)
+        irc.IRCClient.lineReceived(self, line)
+
     def irc_RPL_NAMREPLY(self, prefix, params):
         log.msg('irc_RPL_NAMREPLY - prefix: {0!r}, {1!r}'.format(prefix, params), logLevel=logging.DEBUG)
-        channel = params[2].lower()
-        nicklist = []
-        for name in params[3].split(' '):
-            nicklist.append(name)
-        self.factory.backend.nick_list[channel] = nicklist
+        channel = params[2]
+        # status prefixes like @ and +, several with multi-prefix
+        statuses = ''.join(status for status, _ in self.supported.getFeature('PREFIX').values())
+        members = self.members
+        for name in params[3].split():
+            # nick!user@host with userhost-in-names
+            nick = name.lstrip(statuses).partition('!')[0]
+            if nick:
+                members.join(channel, nick)
 
     #-- BOT SPECIFIC
+    def pause_reading(self):
+        """
+        stops reading lines from the server until resume_reading is called
+        """
+        if self.transport is not None:
+            self.transport.pauseProducing()
+
+    def resume_reading(self):
+        if self.transport is not None:
+            self.transport.resumeProducing()
+
     def _bot_process_event(self, raw_event):
         """
         passes raw data to bot
         """
 
-        log.msg('sending raw event {0!r}'.format(raw_event),
-                logLevel=logging.DEBUG)
+        if twisted_log.isEnabledFor(logging.DEBUG):
+            log.msg('sending raw event {0!r}'.format(raw_event), logLevel=logging.DEBUG)
         self.factory.new_event(raw_event)
 
+    def action_lane(self, action):
+        """
+        the lane an action's lines wait in: the priority it was given, reply
+        when it answers an event and task otherwise
+        """
+        lane = action.meta.get('priority')
+        if lane in LANES:
+            return lane
+        if action.source_event is not None:
+            return LANE_REPLY
+        return LANE_TASK
+
     def _bot_process_action(self, action):
-        log.msg('irc acting on {0!r}'.format(action), logLevel=logging.DEBUG)
+        """
+        sends an action, returns a deferred firing once its lines are out if
+        flood control queued them
+        """
+        debug = twisted_log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.msg('irc acting on {0!r}'.format(action), logLevel=logging.DEBUG)
         if action.action_type != 'message':
             return
 
-        body = str(action.meta.get('body'))
+        body = action.meta.get('body')
         if not body:
             return
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        body = str(body)
+
+        if debug:
+            log.msg('action {0!r} to {1!r}: {2!r}'.format(action, action.destination_rooms, action.meta),
+                    logLevel=logging.DEBUG)
+        self.lane = self.action_lane(action)
+        try:
+            for dest in action.destination_rooms:
+                if not dest:
+                    continue
 
-        log.msg('action {0!r}'.format(vars(action)), logLevel=logging.DEBUG)
-        for dest in action.destination_rooms:
-            if not dest:
-                continue
-
-            if dest[0] == '#':
-                if action.source == 'highlight':
-                    msg = self.DIRECT_REPLY.format(**{
+                if dest[0] == '#' and action.source == 'highlight':
+                    # every line of the reply addresses whoever asked
+                    prefix = self.DIRECT_REPLY.format(**{
                         'who': action.source_event.meta['nick'],
-                        'what': body
+                        'what': ''
                     })
-                    self.say(dest, msg)
+                    self.send_message(dest, body, prefix)
                 else:
-                    self.say(dest, body)
-            else:
-                self.msg(dest, body)
+                    self.send_message(dest, body)
+        finally:
+            lane, self.lane = self.lane, LANE_CONTROL
+
+        if self.scheduler is not None:
+            return self.scheduler.when_sent(lane)
 
 
 class IrcBotClient(protocol.ReconnectingClientFactory):
     protocol = SimpleIrcBotProtocol
 
-    def __init__(self, channels, nickname, backend=None):
+    def __init__(self, channels, nickname, backend=None, capture=None, flood_rate=IRC_FLOOD_RATE,
+                 flood_burst=IRC_FLOOD_BURST, flood_queue_limit=IRC_FLOOD_QUEUE_LIMIT, aliases=None):
         self.channels = channels
         self.nickname = nickname
+        # other names messages can address the bot by
+        self.aliases = aliases or []
         self.backend = backend
+        # CaptureWriter recording the lines received, see log_traffic
+        self.capture = capture
+        # flood control of the connections, off with a flood_rate of None
+        self.flood_rate = flood_rate
+        self.flood_burst = flood_burst
+        self.flood_queue_limit = flood_queue_limit
 
         # this might be bad?
         self.current_conn = None
 
+        bot = getattr(backend, 'bot', None)
+        self.reconnects = RECONNECTS.labels(getattr(bot, 'nick', None), 'irc')
+
     def buildProtocol(self, addr):
         p = self.protocol()
         p.factory = self
@@ -593,11 +1020,13 @@ class IrcBotClient(protocol.ReconnectingClientFactory):
 
     def clientConnectionLost(self, connector, reason):
         self.current_conn = None
+        self.reconnects.inc()
         log.msg('connection lost, reconnecting: ({0!r})'.format(reason), logLevel=logging.DEBUG)
         protocol.ReconnectingClientFactory.clientConnectionLost(self, connector, reason)
 
     def clientConnectionFailed(self, connector, reason):
         self.current_conn = None
+        self.reconnects.inc()
         log.msg('connection failed: {0!r}'.format(reason), logLevel=logging.DEBUG)
         protocol.ReconnectingClientFactory.clientConnectionFailed(self, connector, reason)
 
@@ -608,9 +1037,17 @@ class IrcBotClient(protocol.ReconnectingClientFactory):
         if self.backend:
             self.backend.handle_event(event)
 
+    def pause_reading(self):
+        if self.current_conn is not None:
+            self.current_conn.pause_reading()
+
+    def resume_reading(self):
+        if self.current_conn is not None:
+            self.current_conn.resume_reading()
+
     def handle_action(self, action):
         if self.current_conn is not None:
-            self.current_conn._bot_process_action(action)
+            return self.current_conn._bot_process_action(action)
         else:
             log.err('connection not active')
 
@@ -622,7 +1059,7 @@ class IrcBackend(ProtocolBackend):
     protocol_name = 'irc'
 
     def configure(self, *args, **kwargs):
-        # TODO: add log_traffic for IRC
+        # True, or the path of the capture file to record received lines to
         self.log_traffic = kwargs.get('log_traffic', False)
         self.server = kwargs.get('server', 'localhost')
         self.port = kwargs.get('port', IRC_DEFAULT_PORT)
@@ -630,13 +1067,34 @@ class IrcBackend(ProtocolBackend):
 
         self.nick = kwargs.get('nick')
         self.password = kwargs.get('password')
+        # 'alias: hi' and 'alias, hi' are highlights too
+        self.aliases = kwargs.get('aliases', [])
 
         self.rooms = kwargs.get('channels') or kwargs.get('rooms', [])
-        self.nick_list = {}
+        # who is in the rooms, see ChannelMembers
+        self.members = ChannelMembers()
+
+        # lines a second the server takes before it kicks us for flooding
+        self.flood_rate = kwargs.get('flood_rate', IRC_FLOOD_RATE)
+        self.flood_burst = kwargs.get('flood_burst', IRC_FLOOD_BURST)
+        self.flood_queue_limit = kwargs.get('flood_queue_limit', IRC_FLOOD_QUEUE_LIMIT)
+
+        self.capture = None
+        if self.log_traffic:
+            if isinstance(self.log_traffic, basestring):
+                path = self.log_traffic
+            else:
+                path = os.path.join(config.DATA_DIR, 'traffic-{0}-{1}.capture'.format(self.nick, self.server))
+            self.capture = CaptureWriter(path)
 
         self.client = IrcBotClient(self.rooms,
                                    nickname=self.nick,
-                                   backend=self)
+                                   backend=self,
+                                   capture=self.capture,
+                                   flood_rate=self.flood_rate,
+                                   flood_burst=self.flood_burst,
+                                   flood_queue_limit=self.flood_queue_limit,
+                                   aliases=self.aliases)
 
     def connect(self, *args, **kwargs):
         """
@@ -650,6 +1108,21 @@ class IrcBackend(ProtocolBackend):
                 logLevel=logging.DEBUG)
         reactor.connectTCP(self.server, self.port, self.client)
         reactor.addSystemEventTrigger('before', 'shutdown', self.bot.shutdown)
+        if self.capture is not None:
+            reactor.addSystemEventTrigger('before', 'shutdown', self.capture.close)
+
+    @property
+    def nick_list(self):
+        """
+        room -> nicks in it, a snapshot of members
+        """
+        return dict((channel, sorted(self.members.members(channel))) for channel in self.members.channel_names.values())
+
+    def pause_reading(self):
+        self.client.pause_reading()
+
+    def resume_reading(self):
+        self.client.resume_reading()
 
     def handle_action(self, action):
-        self.client.handle_action(action)
+        return self.client.handle_action(action)
@@ -74,5 +74,9 @@ class TestConsoleBackend(ProtocolBackend):
         self.log.debug('connecting {0}'.format(self))
         stdio.StandardIO(self.client)
 
+    @property
+    def transport(self):
+        return self.client.transport
+
     def handle_action(self, action):
         self.client.bot_process_action(action)
\ No newline at end of file
@@ -8,6 +8,7 @@ from wokkel import xmppim
 from wokkel.client import XMPPClient
 from wokkel.subprotocols import XMPPHandler
 
+from brutal.core.metrics import RECONNECTS
 from brutal.protocols.core import ProtocolBackend
 
 import re
@@ -140,7 +141,8 @@ class PrivateChatBot(xmppim.MessageProtocol):
         self.send(xmppim.AvailablePresence())
 
     def connectionLost(self, reason):
-        pass
+        # the client reconnects on its own
+        RECONNECTS.labels(getattr(self.backend.bot, 'nick', None), 'xmpp').inc()
 
     def onMessage(self, message):
         if message is not None and hasattr(message, "body") and message.body != None:
@@ -227,6 +229,12 @@ class XmppBackend(ProtocolBackend):
         self.keepalive = ClientKeepalive(interval=self.keepalive_freq)
         self.keepalive.setHandlerParent(self.client)
 
+    @property
+    def transport(self):
+        xmlstream = getattr(self.client, 'xmlstream', None)
+        if xmlstream is not None:
+            return xmlstream.transport
+
     def handle_action(self, action):
         self.log.debug('XMPP ACTION : {0!r}'.format(action))
 
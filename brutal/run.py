@@ -1,16 +1,14 @@
+import sys
 import logging
+import argparse
 
 from twisted.python import log
 
-from brutal.core.bot import BotManager
+from brutal.core.runtime import install_reactor
 
 
-def main(config):
-    """
-    this is the primary run loop, should probably catch quits here?
-    """
+def setup_logging(config, filename=None, stream=None):
     # TODO: move logging to BotManager, make configurable
-    filename = config.LOG_FILE
     level = config.LOG_LEVEL
     fmt = config.LOG_FORMAT
 
@@ -20,11 +18,97 @@ def main(config):
         for handler in root.handlers:
             root.removeHandler(handler)
 
-    logging.basicConfig(level=level, format=fmt,
-                        filename=filename)
+    if stream is not None:
+        logging.basicConfig(level=level, format=fmt, stream=stream)
+    else:
+        logging.basicConfig(level=level, format=fmt, filename=filename)
 
     observer = log.PythonLoggingObserver()
     observer.start()
 
+
+def main(config, supervise=False):
+    """
+    this is the primary run loop, should probably catch quits here?
+
+    with supervise, every bot gets its own process, see
+    brutal.core.supervisor
+    """
+    setup_logging(config, filename=config.LOG_FILE)
+    install_reactor(config.REACTOR)
+
+    if supervise:
+        from brutal.core.supervisor import BotSupervisor
+        supervisor = BotSupervisor(config)
+        supervisor.start()
+        return
+
+    from brutal.core.bot import BotManager
     bot_manager = BotManager(config)
     bot_manager.start()
+
+
+def run_bot(config, nick, heartbeat_fd=None):
+    """
+    runs a single bot of the config, this is what the supervisor starts in
+    each of its child processes. logs go to stderr for the supervisor to
+    collect.
+    """
+    setup_logging(config, stream=sys.stderr)
+    install_reactor(config.REACTOR)
+
+    from brutal.core.bot import BotManager
+    from brutal.core.supervisor import start_heartbeat
+
+    bot_manager = BotManager(config, bot_nicks=[nick])
+    if heartbeat_fd is not None:
+        start_heartbeat(heartbeat_fd, config.SUPERVISOR_HEARTBEAT_INTERVAL)
+    bot_manager.start()
+
+
+def replay(config, path, nick=None, speed=None):
+    """
+    replays a traffic capture into a bot of the config (the first one if no
+    nick is given) without connecting it, then prints how it went. see
+    brutal.core.capture
+    """
+    setup_logging(config, filename=config.LOG_FILE)
+    reactor = install_reactor(config.REACTOR)
+
+    from brutal.core.bot import BotManager
+    from brutal.core.capture import replay as replay_capture
+
+    if nick is None:
+        bots = [bot for bot in getattr(config, 'BOTS', None) or [] if isinstance(bot, dict)]
+        if not bots:
+            raise ValueError('no bots found in configuration')
+        nick = bots[0].get('nick')
+
+    bot_manager = BotManager(config, bot_nicks=[nick])
+    if nick not in bot_manager.bots:
+        raise ValueError('no bot {0!r} in configuration'.format(nick))
+    bot = bot_manager.bots[nick]['bot']
+    bot.start(connect=False)
+
+    def report(stats):
+        print 'replayed {lines} lines in {seconds:.3f}s ({lines_per_second:.1f} lines/s), ' \
+              '{sent} messages sent by the bot'.format(**stats)
+
+    def failed(failure):
+        print 'replay failed: {0}'.format(failure.getErrorMessage())
+
+    d = replay_capture(bot, path, speed=speed)
+    d.addCallbacks(report, failed)
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
+
+
+if __name__ == '__main__':
+    from brutal.conf import config
+
+    parser = argparse.ArgumentParser(description='run a single bot')
+    parser.add_argument('--bot', required=True, help='nick of the bot to run')
+    parser.add_argument('--heartbeat-fd', type=int, help='fd to send heartbeats to')
+    args = parser.parse_args()
+
+    run_bot(config, args.bot, heartbeat_fd=args.heartbeat_fd)
@@ -3,6 +3,9 @@ INSTALLED_PLUGINS = (
     # 'brutal.plugins.logging',
 )
 
+# REACTOR = 'asyncio'  # twisted reactor to run on, see brutal.core.runtime
+# METRICS_PORT = 9100  # serve prometheus metrics on http://127.0.0.1:9100/metrics
+
 BOTS = [
     # bot 1
     {
@@ -27,6 +30,10 @@ BOTS = [
             #     'port': 6667,
             #     'use_ssl': False, # default or irc
             #     'password': '',
+            #     'log_traffic': True, # record received lines in DATA_DIR, for: ./hive.py replay <capture>
+            #     'flood_rate': 1.0, # lines a second sent at most, None to turn flood control off
+            #     'flood_burst': 5, # lines sent at once after a quiet spell
+            #     'aliases': ['brutal'], # other names 'name: hi' and 'name, hi' reach the bot by
             #     'channels': ['#room', ('#private_room', 'pass')]
             # }
         ],
@@ -36,8 +43,10 @@ BOTS = [
             #   'id': 1,
             #   'name': 'John',
             #   'surename': 'Doe',
-            #   'nick': 'jdoe'
-            # }
+            #   'nick': 'jdoe',
+            #   'thread_pool': {'size': 2, 'queue_limit': 10, 'policy': 'reject'}
+            # },
+            # 'brutal.plugins.profiling': {'admins': ['jdoe']},
         },  # if this isn't set, load all
         'plugin_settings': {}
     },
@@ -55,6 +64,18 @@ BOTS = [
     #         }
     #     ],
     #     'plugin_settings': {},
-    #     'command_token': '.'
+    #     'command_token': '.',
+    #     'queue_drain_limit': 100,  # max queued events/actions handled per reactor turn
+    #     'event_queue_size': 1000,  # max queued events, unbounded if not set
+    #     'event_queue_policy': 'drop_oldest',  # or 'drop_messages', 'pause'
+    #     'event_queue_low_water': 500,  # resume reading below this when paused
+    #     'fair_scheduling': True,  # handle events round-robin between rooms
+    #     'room_weights': {'#room': 2},  # events per round for a room, default 1
+    #     'plugin_workers': 4,  # run plugins in this many processes, sharded by room, 1 if they open_storage
+    #     'handler_timeout': 60,  # cancel handlers and tasks running longer, None for no limit
+    #     'handler_timeout_reply': 'that took too long, try again later',
+    #     'tracing': True,  # keep per stage latency histograms of events and replies
+    #     'trace_sample_rate': 0.01,  # fraction of traces to log
+    #     'trace_slow_threshold': 1.0  # always log traces slower than this, in seconds
     # }
 ]
@@ -0,0 +1,123 @@
+"""Basic tests for brutal.core.bot"""
+
+from twisted.internet import task
+
+from brutal.core import bot as bot_module
+from brutal.core.bot import Bot
+from brutal.core.queues import BatchQueue, FairQueue
+
+
+def build_bot(monkeypatch, **kwargs):
+    clock = task.Clock()
+    monkeypatch.setattr(bot_module, 'reactor', clock)
+    return Bot('bot', [], **kwargs), clock
+
+
+def test_drain_queue(monkeypatch):
+    bot, clock = build_bot(monkeypatch, queue_drain_limit=3)
+    queue = BatchQueue()
+    for i in range(7):
+        queue.put(i)
+
+    handled = []
+    bot._consume_queue(queue, handled.append, 'test')
+    assert handled == [0, 1, 2]
+    assert bot.queue_stats['test']['last'] == 3
+
+    clock.advance(0)
+    assert handled == list(range(7))
+    assert bot.queue_stats['test']['last'] == 1
+    assert bot.queue_stats['test']['drains'] == 3
+    assert bot.queue_stats['test']['items'] == 7
+
+    queue.put(7)
+    assert handled[-1] == 7
+
+
+def test_drain_queue_handler_failure(monkeypatch):
+    bot, clock = build_bot(monkeypatch)
+    queue = BatchQueue()
+
+    def handler(item):
+        if item == 'bad':
+            raise ValueError(item)
+        handled.append(item)
+
+    handled = []
+    for item in ['a', 'bad', 'b']:
+        queue.put(item)
+    bot._consume_queue(queue, handler, 'test')
+    queue.put('c')
+    assert handled == ['a', 'b', 'c']
+
+
+def build_raw_event(body):
+    return {'type': 'message', 'source': 'room',
+            'meta': {'body': body, 'recipients': []}}
+
+
+def fill_queue(bot, bodies):
+    # keep the consumer from picking the events up
+    bot.event_queue.waiting = []
+    for body in bodies:
+        bot.new_event(build_raw_event(body))
+    return [e['meta']['body'] if isinstance(e, dict) else e.meta['body']
+            for e in bot.event_queue.pending]
+
+
+def test_event_queue_drop_oldest(monkeypatch):
+    bot, clock = build_bot(monkeypatch, event_queue_size=2)
+    pending = fill_queue(bot, ['a', 'b', 'c'])
+    assert pending == ['b', 'c']
+    assert bot.queue_stats['events']['dropped'] == 1
+
+
+def test_event_queue_drop_messages(monkeypatch):
+    bot, clock = build_bot(monkeypatch, event_queue_size=2,
+                           event_queue_policy='drop_messages')
+    pending = fill_queue(bot, ['!a', 'b', 'c', '!d', '!e'])
+    assert pending == ['!d', '!e']
+    assert bot.queue_stats['events']['dropped'] == 3
+
+
+def test_event_queue_pause(monkeypatch):
+    bot, clock = build_bot(monkeypatch, event_queue_size=2,
+                           event_queue_policy='pause')
+    calls = []
+    monkeypatch.setattr(bot.connection_manager, 'pause_reading',
+                        lambda: calls.append('pause'))
+    monkeypatch.setattr(bot.connection_manager, 'resume_reading',
+                        lambda: calls.append('resume'))
+
+    fill_queue(bot, ['a', 'b', 'c', 'd'])
+    assert len(bot.event_queue.pending) == 4
+    assert calls == ['pause']
+    assert bot.reading_paused is True
+
+    bot._events_drained()
+    assert calls == ['pause']
+
+    del bot.event_queue.pending[1:]
+    bot._events_drained()
+    assert calls == ['pause', 'resume']
+    assert bot.reading_paused is False
+
+
+def test_fair_event_queue(monkeypatch):
+    bot, clock = build_bot(monkeypatch, fair_scheduling=True,
+                           room_weights={'#b': 2})
+    assert isinstance(bot.event_queue, FairQueue)
+
+    handled = []
+    monkeypatch.setattr(bot, 'handle_event',
+                        lambda e: handled.append(e['meta']['body']))
+    bot.event_queue.waiting = []
+
+    for i in range(3):
+        bot.new_event(dict(build_raw_event('a%d' % i), channel='#a'))
+    for i in range(3):
+        bot.new_event(dict(build_raw_event('b%d' % i), channel='#b'))
+    bot._consume_events(bot.event_queue)
+
+    assert handled == ['a0', 'b0', 'b1', 'a1', 'b2', 'a2']
+    assert bot.queue_stats['events']['rooms'][(None, '#a')]['served'] == 3
@@ -0,0 +1,33 @@
+"""Basic tests for brutal.core.cache"""
+
+from brutal.core import cache as cache_module
+from brutal.core.cache import ResponseCache
+
+
+def test_lru(monkeypatch):
+    monkeypatch.setattr(cache_module, 'clock', lambda: 0.0)
+    cache = ResponseCache(ttl=60, size=2)
+    cache.put('a', '1')
+    cache.put('b', '2')
+    assert cache.get('a') == '1'
+
+    # b is the least recently used one now
+    cache.put('c', '3')
+    assert cache.get('b') is None
+    assert cache.get('a') == '1'
+    assert cache.get('c') == '3'
+    assert cache.stats == {'hits': 3, 'misses': 1, 'evictions': 1, 'expired': 0}
+
+
+def test_ttl(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(cache_module, 'clock', lambda: now[0])
+    cache = ResponseCache(ttl=10)
+    cache.put('a', '1')
+
+    now[0] = 9.9
+    assert cache.get('a') == '1'
+    now[0] = 10.0
+    assert cache.get('a') is None
+    assert len(cache) == 0
+    assert cache.stats['expired'] == 1
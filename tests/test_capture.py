@@ -0,0 +1,91 @@
+"""Basic tests for brutal.core.capture"""
+
+from twisted.internet import task
+
+from brutal.core import capture as capture_module
+from brutal.core.bot import Bot
+from brutal.core.capture import CaptureWriter, Replayer, ReplayTransport, read_capture
+from brutal.core.models import Action
+
+
+def test_capture_round_trip(tmpdir):
+    path = str(tmpdir.join('data', 'traffic.capture'))
+    writer = CaptureWriter(path)
+    writer.write(':srv 001 bot :welcome', at=10.0)
+    writer.write(u':user!u@host PRIVMSG #room :\u010dau', at=10.5)
+    writer.close()
+
+    # a record cut short by a crash
+    with open(path, 'ab') as capture:
+        capture.write('11.0')
+
+    assert list(read_capture(path)) == [(10.0, ':srv 001 bot :welcome'),
+                                        (10.5, ':user!u@host PRIVMSG #room :\xc4\x8dau')]
+
+
+def build_replayer(monkeypatch, records, **kwargs):
+    clock = task.Clock()
+    monkeypatch.setattr(capture_module, 'reactor', clock)
+    delivered = []
+    return Replayer(records, delivered.append, **kwargs), delivered, clock
+
+
+def test_replay_fast(monkeypatch):
+    records = [(0.0, str(i)) for i in range(5)]
+    replayer, delivered, clock = build_replayer(monkeypatch, records, batch=2)
+    done = []
+    replayer.start().addCallback(done.append)
+
+    assert delivered == ['0', '1']
+
+    # the bot's queue is full
+    replayer.pause()
+    clock.advance(1)
+    assert delivered == ['0', '1']
+
+    replayer.resume()
+    clock.advance(0)
+    assert len(delivered) == 5
+    assert done == [5]
+
+
+def test_replay_timed(monkeypatch):
+    records = [(100.0, 'a'), (101.0, 'b'), (103.0, 'c')]
+    replayer, delivered, clock = build_replayer(monkeypatch, records, speed=2)
+    replayer.start()
+
+    assert delivered == ['a']
+    clock.advance(0.4)
+    assert delivered == ['a']
+    clock.advance(0.1)
+    assert delivered == ['a', 'b']
+
+    # time spent paused doesn't count
+    replayer.pause()
+    clock.advance(5)
+    replayer.resume()
+    clock.advance(0.9)
+    assert delivered == ['a', 'b']
+    clock.advance(0.1)
+    assert delivered == ['a', 'b', 'c']
+    assert replayer.finished
+
+
+def test_irc_log_traffic(tmpdir):
+    path = str(tmpdir.join('irc.capture'))
+    bot = Bot('bot', [{'protocol': 'irc', 'channels': ['#room'], 'log_traffic': path}])
+    backend = bot.connection_manager.clients.values()[0]
+
+    protocol = backend.client.buildProtocol(None)
+    transport = ReplayTransport()
+    protocol.makeConnection(transport)
+    protocol.lineReceived('PING :irc.example.org')
+    backend.capture.close()
+
+    assert [line for _, line in read_capture(path)] == ['PING :irc.example.org']
+    # NICK, USER and the PONG
+    assert transport.written == 3
+
+    # only messages count as the bot's replies
+    backend.handle_action(Action(source_bot=bot, rooms=['#room']).msg('hi'))
+    assert (transport.written, transport.messages) == (4, 1)
@@ -0,0 +1,162 @@
+"""Basic tests for brutal.protocols.irc"""
+
+from twisted.internet import task
+
+from brutal.core import ratelimit
+from brutal.core.bot import Bot
+from brutal.core.capture import ReplayTransport
+from brutal.core.models import Action, Event
+from brutal.protocols.irc import ChannelMembers, split_message, split_recipients
+
+
+class LineTransport(ReplayTransport):
+    def __init__(self):
+        ReplayTransport.__init__(self)
+        self.lines = []
+
+    def write(self, data):
+        ReplayTransport.write(self, data)
+        self.lines.extend(data.splitlines())
+
+
+def test_split_message():
+    assert split_message('one two three\n\nfour', 9) == ['one two', 'three', 'four']
+    # no room for a whole word, cut between characters
+    assert split_message(u'\u010d\u010d\u010d', 5) == ['\xc4\x8d\xc4\x8d', '\xc4\x8d']
+    for line in split_message(u'\u017eltu\u010dk\xfd k\u016f\u0148 ' * 20, 17):
+        assert len(line) <= 17
+        line.decode('utf-8')
+
+
+def connect(monkeypatch, **options):
+    clock = task.Clock()
+    monkeypatch.setattr(ratelimit, 'reactor', clock)
+    options.update({'protocol': 'irc', 'nick': 'bot', 'channels': ['#room']})
+    bot = Bot('bot', [options])
+    backend = bot.connection_manager.clients.values()[0]
+
+    protocol = backend.client.buildProtocol(None)
+    transport = LineTransport()
+    protocol.makeConnection(transport)
+    protocol.lineReceived(':bot!bot@example.org JOIN #room')
+    # past the lines of signing on
+    clock.pump([10, 10])
+    del transport.lines[:]
+    return bot, backend, protocol, transport, clock
+
+
+def test_long_reply(monkeypatch):
+    bot, backend, protocol, transport, clock = connect(monkeypatch, flood_rate=None)
+    assert protocol.userhost == 'bot@example.org'
+
+    backend.handle_action(Action(source_bot=bot, rooms=['#room']).msg('word ' * 200))
+    assert len(transport.lines) == 3
+    for line in transport.lines:
+        assert line.startswith('PRIVMSG #room :word')
+        # as the server relays it
+        assert len(':bot!bot@example.org ' + line) <= 510
+
+
+def test_pack_queued_lines(monkeypatch):
+    bot, backend, protocol, transport, clock = connect(monkeypatch, flood_rate=1, flood_burst=1)
+
+    for i in range(3):
+        backend.handle_action(Action(source_bot=bot, rooms=['#room']).msg('line {0}'.format(i)))
+    backend.handle_action(Action(source_bot=bot, rooms=['#other']).msg('elsewhere'))
+    assert transport.lines == ['PRIVMSG #room :line 0']
+
+    clock.pump([1, 1])
+    assert transport.lines[1:] == ['PRIVMSG #room :line 1 | line 2', 'PRIVMSG #other :elsewhere']
+    assert protocol.scheduler.merged == 1
+
+    # replies to the same nick address it once
+    assert protocol.pack_lines('PRIVMSG #room :alice: a', 'PRIVMSG #room :alice: b') == 'PRIVMSG #room :alice: a | b'
+    assert protocol.pack_lines('PRIVMSG #room :alice: a', 'PRIVMSG #room :bob: b') == \
+        'PRIVMSG #room :alice: a | bob: b'
+
+
+def test_channel_members():
+    members = ChannelMembers()
+    members.join('#Room', 'Alice[away]')
+    members.join('#room', 'bob')
+    members.join('#other', 'ALICE{AWAY}')
+
+    # rfc1459: [] are the uppercase of {}
+    assert members.is_member('#ROOM', 'alice{away}')
+    assert members.channels('alice[away]') == frozenset(['#room', '#other'])
+    assert 'Bob' in members
+
+    assert sorted(members.rename('alice{away}', 'alice')) == ['#other', '#room']
+    assert members.members('#other') == frozenset(['alice'])
+    assert members.part('#room', 'bob')
+    assert not members.part('#room', 'bob')
+    assert 'bob' not in members
+    assert sorted(members.quit('alice')) == ['#other', '#room']
+    assert members.members('#room') == frozenset()
+
+    # plugins may ask with unicode
+    members.join('#room', 'Ji\xc5\x99\xc3\xad[x]')
+    assert members.is_member(u'#ROOM', u'Ji\u0159\xed{X}')
+    assert u'ji\u0159\xed[x]' in members
+    assert members.members(u'#Room') == frozenset(['Ji\xc5\x99\xc3\xad[x]'])
+    assert members.channels(u'JI\u0159\xed[X]') == frozenset(['#room'])
+    members.quit('Ji\xc5\x99\xc3\xad[x]')
+
+    members.join('#room', 'nick~')
+    members.set_casemapping('ascii')
+    assert not members.is_member('#room', 'nick^')
+    assert members.is_member('#ROOM', 'NICK~')
+
+
+def test_membership_tracking(monkeypatch):
+    bot, backend, protocol, transport, clock = connect(monkeypatch, flood_rate=None)
+    events = []
+    monkeypatch.setattr(protocol, '_bot_process_event', events.append)
+
+    protocol.lineReceived(':srv 005 bot CASEMAPPING=ascii PREFIX=(ov)@+ :are supported by this server')
+    protocol.lineReceived(':srv 353 bot = #room :bot @alice +Bob carol')
+    protocol.lineReceived(':srv 366 bot #room :End of /NAMES list.')
+    protocol.lineReceived(':bot!bot@example.org JOIN #other')
+    protocol.lineReceived(':srv 353 bot = #other :bot @ALICE')
+    # named as last seen
+    assert backend.members.members('#ROOM') == frozenset(['bot', 'ALICE', 'Bob', 'carol'])
+    assert backend.nick_list['#other'] == ['ALICE', 'bot']
+
+    protocol.lineReceived(':alice!a@host QUIT :*.net *.split')
+    assert sorted(event['channel'] for event in events) == ['#other', '#room']
+    del events[:]
+
+    protocol.lineReceived(':bob!b@host NICK robert')
+    protocol.lineReceived(':dave!d@host KICK #room carol :bye')
+    assert [event['type'] for event in events] == ['rename', 'kick']
+    assert backend.members.channels('ROBERT') == frozenset(['#room'])
+    assert not backend.members.is_member('#room', 'carol')
+
+    protocol.lineReceived(':bot!bot@example.org PART #other')
+    assert backend.members.channels('bot') == frozenset(['#room'])
+
+
+def test_split_recipients():
+    assert split_recipients('alice: bob:hi there') == (['alice', 'bob'], 'hi there')
+    assert split_recipients('see http://example.org') == ([], 'see http://example.org')
+    assert split_recipients('no one here') == ([], 'no one here')
+
+
+def test_highlights(monkeypatch):
+    bot, backend, protocol, transport, clock = connect(monkeypatch, flood_rate=None, aliases=['brutal'])
+    events = []
+    monkeypatch.setattr(protocol, '_bot_process_event', events.append)
+
+    for message in ('bot: ping', 'alice: BOT: ping', 'Brutal, ping', 'hey, bot: look', 'bot is here: ping',
+                    'http://example.org'):
+        protocol.privmsg('alice!a@host', '#room', message)
+
+    assert [(event['source'], event['meta']['body']) for event in events] == [
+        ('highlight', 'ping'), ('highlight', 'ping'), ('highlight', 'ping'), ('room', 'hey, bot: look'),
+        ('room', 'bot is here: ping'), ('room', 'http://example.org')]
+    assert events[2]['meta']['recipients'] == ['Brutal']
+
+    # highlights by alias or in another case are commands too
+    built = [Event(bot, dict(raw, client=backend, client_id=backend.id)) for raw in events]
+    assert [(event.event_type, event.cmd) for event in built[:3]] == [('cmd', 'ping')] * 3
+    assert [event.event_type for event in built[3:]] == ['message'] * 3
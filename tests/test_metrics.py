@@ -0,0 +1,81 @@
+"""Basic tests for brutal.core.metrics"""
+
+import pytest
+
+from brutal.core.metrics import Registry, HANDLER_SECONDS, HANDLER_ERRORS
+from brutal.core.plugin import cmd
+from brutal.core.models import Event
+from test_plugin import build_manager, run_body
+
+
+@cmd
+def metered(event):
+    return 'ok'
+
+
+@cmd
+def failing(event):
+    raise ValueError('failing')
+
+
+def test_render():
+    registry = Registry()
+    counter = registry.counter('test_total', 'a counter', ('bot',))
+    counter.labels('a"b').inc(2)
+    gauge = registry.gauge('test_depth', 'a gauge')
+    gauge.labels().set_function(lambda: 1.5)
+    histogram = registry.histogram('test_seconds', 'a histogram', ('bot',),
+                                   buckets=(0.1, 1.0))
+    histogram.labels('a').observe(0.5)
+    histogram.labels('a').observe(5)
+
+    assert registry.render().splitlines() == [
+        '# HELP test_total a counter',
+        '# TYPE test_total counter',
+        'test_total{bot="a\\"b"} 2',
+        '# HELP test_depth a gauge',
+        '# TYPE test_depth gauge',
+        'test_depth 1.5',
+        '# HELP test_seconds a histogram',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{bot="a",le="0.1"} 0',
+        'test_seconds_bucket{bot="a",le="1"} 1',
+        'test_seconds_bucket{bot="a",le="+Inf"} 2',
+        'test_seconds_sum{bot="a"} 5.5',
+        'test_seconds_count{bot="a"} 2',
+    ]
+
+
+def test_register():
+    registry = Registry()
+    counter = registry.counter('test_total', 'a counter', ('bot',))
+    assert registry.counter('test_total', 'a counter', ('bot',)) is counter
+    with pytest.raises(ValueError):
+        registry.gauge('test_total', 'a gauge', ('bot',))
+    with pytest.raises(ValueError):
+        counter.labels()
+
+
+def test_failing_gauge_function():
+    registry = Registry()
+    registry.gauge('test_depth', 'a gauge').labels().set_function(
+        lambda: 1 / 0)
+    assert registry.render().splitlines()[-1] == '# TYPE test_depth gauge'
+
+
+def test_handler_metrics():
+    manager = build_manager(metered, failing)
+    latency = HANDLER_SECONDS.labels('bot', 'test_plugin.metered')
+    errors = HANDLER_ERRORS.labels('bot', 'test_plugin.failing')
+    count, failed = latency.count, errors.get()
+
+    run_body(manager, '!metered')
+    event = Event(source_bot=manager.bot, raw_details={
+        'type': 'message',
+        'source': 'room',
+        'meta': {'body': '!failing', 'recipients': []}
+    })
+    for response in manager.process_event(event):
+        response.addErrback(lambda failure: None)
+    assert latency.count == count + 1
+    assert errors.get() == failed + 1
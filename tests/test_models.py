@@ -0,0 +1,58 @@
+"""Basic tests for brutal.core.models"""
+
+from brutal.core.models import Event, Action
+from collections import namedtuple
+import copy
+
+Bot = namedtuple('Bot', 'command_token nick')
+bot = Bot._make(['!', 'bot'])
+
+
+def build_event(body, source='room', recipients=None):
+    return Event(source_bot=bot, raw_details={
+        'type': 'message',
+        'source': source,
+        'client_id': 'client',
+        'channel': '#room',
+        'meta': {'body': body, 'recipients': recipients or []}
+    })
+
+
+def test_event_lazy_cmd():
+    event = build_event('!test  one two')
+    assert event.event_type == 'cmd'
+    assert event._cmd_body is not None
+    assert event.cmd == 'test'
+    assert event._cmd_body is None
+    assert event.args == ['one', 'two']
+
+
+def test_event_highlight_cmd():
+    event = build_event('test one', source='highlight', recipients=['bot'])
+    assert event.event_type == 'cmd'
+    assert event.cmd == 'test'
+    assert event.args == ['one']
+
+
+def test_event_message():
+    event = build_event('just talking')
+    assert event.event_type == 'message'
+    assert event.cmd is None
+    assert event.args is None
+
+
+def test_event_set_cmd_keeps_args():
+    event = copy.copy(build_event('!test one'))
+    event.cmd = 'other'
+    assert event.cmd == 'other'
+    assert event.args == ['one']
+
+
+def test_action_slots():
+    event = build_event('!test')
+    action = Action(source_bot=bot, source_event=event).msg('hi')
+    assert action.destination_client_ids == ['client']
+    assert action.destination_rooms == ['#room']
+    assert action.meta == {'body': 'hi'}
+    assert not hasattr(action, '__dict__')
+    assert not hasattr(event, '__dict__')
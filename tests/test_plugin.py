@@ -0,0 +1,257 @@
+"""Basic tests for brutal.core.plugin"""
+
+from brutal.core import plugin as plugin_module
+from brutal.core.plugin import PluginManager, MessageMatcher, Parser, cmd, \
+    match, literal_trigger, as_deferred, BotPlugin
+from brutal.core.models import Event
+from twisted.internet import defer, task
+from collections import namedtuple
+import sys
+
+Bot = namedtuple('Bot', 'command_token nick')
+
+
+@cmd
+def ping(event):
+    return 'pong'
+
+
+@cmd(command=r'^pi(ng|e)$')
+def pie(event, suffix):
+    return 'pi' + suffix
+
+
+@cmd(command='echo')
+def echo(event):
+    return 'echo'
+
+
+@match(regex=r'^hi$')
+def hi(event):
+    return 'hello'
+
+
+@match(regex=r'.*(https?)://(\S+)')
+def url(event, scheme, rest):
+    return '{0} {1}'.format(scheme, rest)
+
+
+@match(regex=r'(?i)^HI')
+def shout(event):
+    return 'HELLO'
+
+
+def build_manager(*funcs):
+    manager = PluginManager(bot=Bot._make(['!', 'bot']))
+    manager._build_parser([(f.__name__, f) for f in funcs],
+                          sys.modules[__name__], __name__)
+    return manager
+
+
+def run_body(manager, body):
+    event = Event(source_bot=manager.bot, raw_details={
+        'type': 'message',
+        'source': 'room',
+        'meta': {'body': body, 'recipients': []}
+    })
+
+    results = []
+    for response in manager.process_event(event):
+        response.addCallback(lambda a: results.append(a.meta['body']))
+    return results
+
+
+def test_literal_trigger():
+    assert literal_trigger('^ping$') == 'ping'
+    assert literal_trigger('ping') is None
+    assert literal_trigger('^ping') is None
+    assert literal_trigger(r'^pi(ng|e)$') is None
+
+
+def test_cmd_index():
+    manager = build_manager(ping, pie, echo)
+    assert [p.func_name for _, p in manager.cmd_index['ping']] == ['ping']
+    assert sorted(p.func_name for _, p in manager.cmd_patterns) == \
+        ['echo', 'pie']
+
+
+def test_cmd_dispatch():
+    manager = build_manager(ping, pie, echo)
+    assert sorted(run_body(manager, '!ping')) == ['ping', 'pong']
+    assert run_body(manager, '!pie') == ['pie']
+    assert run_body(manager, '!echoes') == ['echo']
+    assert run_body(manager, '!nope') == []
+
+
+def test_message_matcher():
+    parsers = [Parser(f, sys.modules[__name__]) for f in (hi, url, shout)]
+    matcher = MessageMatcher(parsers)
+    assert [p for _, p in matcher.single] == [parsers[2]]
+    assert matcher.candidates('hi') == [parsers[0], parsers[2]]
+    assert matcher.candidates('see http://x.org') == [parsers[1]]
+    assert matcher.candidates('nothing') == []
+
+
+def test_message_matcher_chunks():
+    parsers = [Parser(url, sys.modules[__name__]) for _ in range(50)]
+    matcher = MessageMatcher(parsers)
+    assert len(matcher.combined) == 2
+    assert matcher.candidates('http://x') == parsers
+
+
+def test_match_dispatch():
+    manager = build_manager(hi, url, shout)
+    assert run_body(manager, 'hi') == ['hello', 'HELLO']
+    assert run_body(manager, 'go to https://example.org now') == \
+        ['https example.org']
+    assert run_body(manager, 'bye') == []
+
+
+@cmd
+def later(event):
+    return defer.succeed('later')
+
+
+@cmd
+def broken(event):
+    raise ValueError('broken')
+
+
+def test_sync_fast_path():
+    manager = build_manager(ping, later, broken)
+    assert run_body(manager, '!ping') == ['pong']
+    assert run_body(manager, '!later') == ['later']
+
+    failures = []
+    event = Event(source_bot=manager.bot, raw_details={
+        'type': 'message',
+        'source': 'room',
+        'meta': {'body': '!broken', 'recipients': []}
+    })
+    for response in manager.process_event(event):
+        response.addErrback(failures.append)
+    assert failures[0].check(ValueError)
+
+
+def test_as_deferred():
+    d = defer.Deferred()
+    assert as_deferred(d) is d
+    fired = []
+    as_deferred('x').addCallback(fired.append)
+    assert fired == ['x']
+
+
+@cmd(timeout=5)
+def hang(event):
+    return defer.Deferred()
+
+
+def test_handler_timeout(monkeypatch):
+    clock = task.Clock()
+    monkeypatch.setattr(plugin_module, 'reactor', clock)
+    manager = build_manager(ping, hang)
+    manager.handler_timeout_reply = 'too slow'
+
+    # handlers that are done right away don't need a timer
+    assert run_body(manager, '!ping') == ['pong']
+    assert not clock.getDelayedCalls()
+
+    # the counter is process wide
+    timeouts = manager.event_parsers['cmd'][1].timeouts
+    before = timeouts.get()
+    results = run_body(manager, '!hang')
+    assert results == []
+    clock.advance(5)
+    assert results == ['too slow']
+    assert not clock.getDelayedCalls()
+    assert timeouts.get() == before + 1
+
+
+def test_late_reply_dropped(monkeypatch):
+    monkeypatch.setattr(plugin_module, 'isInIOThread', lambda: True)
+    routed = []
+    bot = namedtuple('Bot', 'command_token nick route_response')(
+        '!', 'bot', lambda action, event: routed.append(action))
+    plugin = BotPlugin(bot=bot)
+    other = BotPlugin(bot=bot)
+    event = Event(source_bot=bot, raw_details={
+        'type': 'message',
+        'source': 'room',
+        'meta': {'body': '!hang', 'recipients': []}
+    })
+
+    plugin.msg('on time', event=event)
+    event.timed_out = set([plugin])
+    plugin.msg('too late', event=event)
+    # only the plugin whose handler timed out is cut off
+    other.msg('still answering', event=event)
+    assert [action.meta['body'] for action in routed] == \
+        ['on time', 'still answering']
+
+
+def test_cached_cmd():
+    calls = []
+
+    @cmd(cache_ttl=60, cache_size=10)
+    def weather(event):
+        calls.append(event.args)
+        return 'sunny in ' + ' '.join(event.args)
+
+    manager = build_manager(weather)
+    assert run_body(manager, '!weather bratislava') == ['sunny in bratislava']
+    assert run_body(manager, '!weather bratislava') == ['sunny in bratislava']
+    assert run_body(manager, '!weather kosice') == ['sunny in kosice']
+    assert calls == [['bratislava'], ['kosice']]
+
+    stats = manager.cache_stats()['test_plugin.weather']
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 2, 2)
+
+
+def test_coalesced_cmd():
+    fetches = []
+
+    @cmd(coalesce=True)
+    def title(event):
+        d = defer.Deferred()
+        fetches.append(d)
+        return d
+
+    manager = build_manager(title)
+    coalesced = manager.event_parsers['cmd'][0].coalesced
+    before = coalesced.get()
+    first = run_body(manager, '!title http://example.com')
+    second = run_body(manager, '!title http://example.com')
+    other = run_body(manager, '!title http://example.org')
+    assert len(fetches) == 2
+
+    fetches[0].callback('Example Domain')
+    assert first == second == ['Example Domain']
+    assert other == []
+    assert coalesced.get() == before + 1
+
+    # done, so the next one runs the handler again
+    run_body(manager, '!title http://example.com')
+    assert len(fetches) == 3
+
+
+def test_coalesced_timeout_not_cached(monkeypatch):
+    clock = task.Clock()
+    monkeypatch.setattr(plugin_module, 'reactor', clock)
+    fetches = []
+
+    @cmd(timeout=5, coalesce=True, cache_ttl=60)
+    def slow(event):
+        d = defer.Deferred()
+        fetches.append(d)
+        return d
+
+    manager = build_manager(slow)
+    manager.handler_timeout_reply = 'too slow'
+    first = run_body(manager, '!slow x')
+    second = run_body(manager, '!slow x')
+    clock.advance(5)
+    assert first == second == ['too slow']
+
+    # the timeout reply of the shared call isn't cached for the waiter
+    run_body(manager, '!slow x')
+    assert len(fetches) == 2
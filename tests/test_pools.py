@@ -0,0 +1,225 @@
+"""Basic tests for brutal.core.pools"""
+
+from brutal.core.pools import PluginThreadPool, ProcessPool, \
+    ProcessWorker, ProcessCallError, DEFAULT_BUSY_REPLY, call_handler, \
+    read_message
+from brutal.core.workers import WORKER_OUT_FD, pack_message
+from brutal.core.plugin import PluginManager
+from brutal.core.models import Event
+from brutal.core import pools as pools_module
+from twisted.internet import defer, task
+from collections import namedtuple
+import subprocess
+import types
+import sys
+import os
+
+Bot = namedtuple('Bot', 'command_token nick enabled_plugins')
+
+
+def results(d):
+    fired = []
+    d.addCallback(fired.append)
+    return fired
+
+
+def test_queue_policy():
+    # the pool isn't started, so every call stays queued
+    pool = PluginThreadPool('test', queue_limit=1)
+    pool.run(len, 'a')
+    pool.run(len, 'b')
+    assert pool.stats()['queued'] == 2
+    assert pool.stats()['rejected'] == 0
+
+
+def test_reject_policy():
+    pool = PluginThreadPool('test', queue_limit=1, policy='reject')
+    pool.run(len, 'a')
+    pool.run(len, 'b')
+    assert results(pool.run(len, 'c')) == [DEFAULT_BUSY_REPLY]
+    assert pool.stats()['queued'] == 2
+    assert pool.stats()['rejected'] == 1
+
+
+def test_drop_policy():
+    pool = PluginThreadPool('test', queue_limit=0, policy='drop')
+    pool.run(len, 'a')
+    assert results(pool.run(len, 'a')) == [None]
+    assert pool.stats()['dropped'] == 1
+
+
+def test_cancelled_call_keeps_its_slot():
+    # a timed out handler's thread is still busy, so still counts
+    pool = PluginThreadPool('test', queue_limit=0, policy='reject')
+    d = pool.run(len, 'a')
+    d.addErrback(lambda failure: failure.trap(defer.CancelledError))
+    d.cancel()
+    assert pool.pending == 1
+    assert results(pool.run(len, 'b')) == [DEFAULT_BUSY_REPLY]
+
+
+def test_unknown_policy():
+    assert PluginThreadPool('test', policy='nope').policy == 'queue'
+
+
+def test_call_counters():
+    pool = PluginThreadPool('test')
+    pool.queued = 1
+    assert pool._call(len, ('abc',), {}) == 3
+    stats = pool.stats()
+    assert (stats['queued'], stats['active'], stats['completed']) == (0, 0, 1)
+
+
+def test_thread_pool_for():
+    module = types.ModuleType('pool_plugin')
+    module.thread_pool = 3
+    other = types.ModuleType('other_plugin')
+    configured = types.ModuleType('configured_plugin')
+    configured.thread_pool = 3
+
+    enabled = {'configured_plugin': {'thread_pool': {'size': 5}}}
+    manager = PluginManager(bot=Bot._make(['!', 'bot', enabled]))
+    try:
+        assert manager.thread_pool_for(module).size == 3
+        assert manager.thread_pool_for(module) is \
+            manager.thread_pool_for(module)
+        assert manager.thread_pool_for(other) is None
+        assert manager.thread_pool_for(configured).size == 5
+        assert sorted(manager.thread_pool_stats()) == \
+            ['configured_plugin', 'pool_plugin']
+    finally:
+        manager.shutdown()
+    assert manager.thread_pools == {}
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.written = []
+        self.signals = []
+        self.closed = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def signalProcess(self, sig):
+        self.signals.append(sig)
+
+    def closeStdin(self):
+        self.closed = True
+
+
+def fake_spawn(pool):
+    def spawn():
+        worker = ProcessWorker(pool, len(pool.workers))
+        worker.transport = FakeTransport()
+        pool.workers.append(worker)
+        worker.connectionMade()
+    return spawn
+
+
+def add(event, a, b):
+    return '{0} {1}'.format(event.cmd, int(a) + int(b))
+
+
+def message_event(body):
+    return Event(source_bot=Bot._make(['!', 'bot', None]), raw_details={
+        'type': 'message',
+        'source': 'room',
+        'channel': '#room',
+        'meta': {'body': body, 'recipients': []}
+    })
+
+
+def test_call_handler():
+    event = message_event('!add 1 2')
+    bot = {'nick': 'bot', 'command_token': '!'}
+    assert call_handler(__name__, 'add', bot, event.snapshot(), ('1', '2')) \
+        == 'add 3'
+
+
+def spawn_worker(module, config_dir, reactor_name):
+    """
+    starts module as a worker process with REACTOR set to reactor_name,
+    returns the process and the read end of its fd 3
+    """
+    config_dir.join('reactor_config.py').write(
+        'REACTOR = {0!r}\n'.format(reactor_name))
+    env = dict(os.environ)
+    env['BRUTAL_CONFIG_MODULE'] = 'reactor_config'
+    env['PYTHONPATH'] = os.pathsep.join([str(config_dir)] +
+                                        [path for path in sys.path if path])
+
+    read_fd, write_fd = os.pipe()
+    process = subprocess.Popen(
+        [sys.executable, '-m', module], stdin=subprocess.PIPE,
+        stderr=subprocess.PIPE, env=env, close_fds=False,
+        preexec_fn=lambda: os.dup2(write_fd, WORKER_OUT_FD))
+    os.close(write_fd)
+    return process, os.fdopen(read_fd, 'rb')
+
+
+def test_process_worker_reactor(tmpdir):
+    process, out = spawn_worker('brutal.core.pools', tmpdir, 'poll')
+    event = message_event('!add 1 2')
+    bot = {'nick': 'bot', 'command_token': '!'}
+    process.stdin.write(pack_message(1, __name__, 'add', bot,
+                                     event.snapshot(), ('1', '2')))
+    process.stdin.close()
+
+    result = read_message(out)
+    errors = process.stderr.read()
+    assert process.wait() == 0, errors
+    assert result == ('result', 1, True, 'add 3')
+
+
+def test_process_pool_dispatch(monkeypatch):
+    monkeypatch.setattr(pools_module, 'reactor', task.Clock())
+    pool = ProcessPool('test', 1, max_tasks=2)
+    monkeypatch.setattr(pool, 'spawn', fake_spawn(pool))
+
+    first = results(pool.run(add, message_event('!add 1 2'), '1', '2'))
+    second = results(pool.run(add, message_event('!add 2 2'), '2', '2'))
+    worker = pool.workers[0]
+    assert len(worker.transport.written) == 1
+    assert len(pool.waiting) == 1
+
+    worker.message_received(('result', worker.call_id, True, 'add 3'))
+    assert first == ['add 3']
+    assert len(worker.transport.written) == 2
+
+    # second call reaches max_tasks, the worker gets replaced
+    worker.message_received(('result', worker.call_id, True, 'add 4'))
+    assert second == ['add 4']
+    assert worker.transport.closed
+    assert pool.workers == [] and pool.stats['recycled'] == 1
+
+
+def test_process_pool_timeout(monkeypatch):
+    clock = task.Clock()
+    monkeypatch.setattr(pools_module, 'reactor', clock)
+    pool = ProcessPool('test', 1, timeout=5)
+    monkeypatch.setattr(pool, 'spawn', fake_spawn(pool))
+
+    failures = []
+    pool.run(add, message_event('!add 1 2'), '1', '2').addErrback(
+        failures.append)
+    worker = pool.workers[0]
+    clock.advance(5)
+
+    assert failures[0].check(defer.TimeoutError)
+    assert worker.transport.signals == ['KILL']
+    assert pool.workers == [] and pool.stats['timeouts'] == 1
+
+
+def test_process_pool_error(monkeypatch):
+    monkeypatch.setattr(pools_module, 'reactor', task.Clock())
+    pool = ProcessPool('test', 1)
+    monkeypatch.setattr(pool, 'spawn', fake_spawn(pool))
+
+    failures = []
+    pool.run(add, message_event('!add x'), 'x', 'y').addErrback(
+        failures.append)
+    worker = pool.workers[0]
+    worker.message_received(('result', worker.call_id, False, 'Traceback'))
+    assert failures[0].check(ProcessCallError)
+    assert pool.idle[0] is worker
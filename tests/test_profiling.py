@@ -0,0 +1,111 @@
+"""Basic tests for brutal.core.profiling"""
+
+import os
+import sys
+from collections import namedtuple
+
+import pytest
+from twisted.internet import task
+
+from brutal.conf import global_config
+from brutal.core import profiling as profiling_module
+from brutal.core.profiling import Profiler, unwrap, handler_summary
+from brutal.core.plugin import Parser, cmd
+from brutal.plugins import profiling as profiling_plugin
+from brutal.plugins.profiling import Profiling
+
+
+def spin():
+    return sum(range(1000))
+
+
+@cmd
+def busy(event):
+    return str(spin())
+
+
+def test_unwrap():
+    assert unwrap(busy).__code__ is not busy.__code__
+    assert unwrap(busy).__name__ == 'busy'
+    assert unwrap(spin) is spin
+
+
+def test_profile_run(monkeypatch, tmpdir):
+    clock = task.Clock()
+    monkeypatch.setattr(profiling_module, 'reactor', clock)
+    profiler = Profiler()
+
+    results = []
+    profiler.start(5, str(tmpdir.join('data')), 'bot').addCallback(
+        results.append)
+    second = []
+    profiler.start(5, str(tmpdir.join('data')), 'bot').addCallback(
+        second.append)
+    assert profiler.active
+
+    busy(None)
+    # a threaded handler, run right here
+    profiler.wrap(busy)(None)
+    clock.advance(5)
+
+    assert not profiler.active
+    path, stats = results[0]
+    assert second[0][0] == path
+    assert os.path.exists(path)
+
+    parser = Parser(busy, sys.modules[__name__])
+    lines = handler_summary(stats, [parser])
+    assert len(lines) == 1 and ': ' in lines[0]
+    assert '2 calls' in lines[0]
+
+
+def test_wrap_inactive():
+    assert Profiler().wrap(spin) is spin
+
+
+def test_bad_duration(monkeypatch, tmpdir):
+    clock = task.Clock()
+    monkeypatch.setattr(profiling_module, 'reactor', clock)
+    profiler = Profiler()
+
+    for duration in (-1, 0, float('nan'), float('inf')):
+        failures = []
+        profiler.start(duration, str(tmpdir), 'bot').addErrback(failures.append)
+        assert failures[0].check(ValueError)
+        assert not profiler.active and not profiler.waiting
+    assert not clock.getDelayedCalls()
+
+
+def test_start_unscheduled(monkeypatch, tmpdir):
+    class BrokenReactor(object):
+        def callLater(self, delay, func):
+            raise RuntimeError('reactor gone')
+
+    monkeypatch.setattr(profiling_module, 'reactor', BrokenReactor())
+    profiler = Profiler()
+    with pytest.raises(RuntimeError):
+        profiler.start(5, str(tmpdir), 'bot')
+    # not left profiling forever
+    assert not profiler.active and not profiler.waiting
+
+
+def test_profile_command(monkeypatch, tmpdir):
+    clock = task.Clock()
+    monkeypatch.setattr(profiling_module, 'reactor', clock)
+    monkeypatch.setattr(global_config, 'DATA_DIR', str(tmpdir))
+    monkeypatch.setattr(profiling_plugin, 'config', global_config)
+    monkeypatch.setattr(profiling_plugin, 'profiler', Profiler())
+    plugin = Profiling(bot=namedtuple('Bot', 'nick')('bot'), config={'admins': ['alice']})
+    reports = []
+    monkeypatch.setattr(plugin, 'report', lambda result, event, top: reports.append(result[0]))
+    Event = namedtuple('Event', 'meta args')
+
+    for args in (['-1'], ['nan'], ['inf'], ['0'], ['soon']):
+        assert plugin.profile(Event({'nick': 'alice'}, args)) == 'usage: profile [seconds] [top]'
+    assert not profiling_plugin.profiler.active
+
+    assert plugin.profile(Event({'nick': 'alice'}, ['1e9'])) == 'profiling for 600.0s'
+    assert [call.getTime() for call in clock.getDelayedCalls()] == [600.0]
+    clock.advance(600)
+    assert not profiling_plugin.profiler.active
+    assert os.path.exists(reports[0])
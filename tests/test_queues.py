@@ -0,0 +1,77 @@
+"""Basic tests for brutal.core.queues"""
+
+from brutal.core.queues import BatchQueue, FairQueue
+
+
+def event(room, body):
+    return {'channel': room, 'client_id': 'client', 'meta': {'body': body}}
+
+
+def bodies(items):
+    return [item['meta']['body'] for item in items]
+
+
+def test_batch_queue():
+    queue = BatchQueue()
+    for i in range(5):
+        queue.put(i)
+
+    assert len(queue) == 5
+    assert queue.take(2) == [0, 1]
+    assert queue.drop(lambda i: i % 2 == 0) is True
+    assert queue.take(10) == [3, 4]
+    assert queue.drop() is False
+
+
+def test_fair_queue_round_robin():
+    queue = FairQueue()
+    for i in range(4):
+        queue.put(event('#flood', 'f%d' % i))
+    queue.put(event('#quiet', 'q0'))
+
+    assert len(queue) == 5
+    assert bodies(queue.take(3)) == ['f0', 'q0', 'f1']
+    assert bodies(queue.take(3)) == ['f2', 'f3']
+    assert len(queue) == 0
+
+
+def test_fair_queue_weights():
+    queue = FairQueue(weights={'#ops': 3})
+    for i in range(4):
+        queue.put(event('#ops', 'o%d' % i))
+        queue.put(event('#chat', 'c%d' % i))
+
+    assert bodies(queue.take(8)) == ['o0', 'o1', 'o2', 'c0', 'o3', 'c1',
+                                     'c2', 'c3']
+
+
+def test_fair_queue_drop_from_deepest():
+    queue = FairQueue()
+    queue.put(event('#quiet', 'q0'))
+    for i in range(3):
+        queue.put(event('#flood', 'f%d' % i))
+
+    assert queue.drop() is True
+    assert bodies(queue.take(5)) == ['q0', 'f1', 'f2']
+
+
+def test_fair_queue_stats():
+    queue = FairQueue()
+    queue.put(event('#a', 'a0'))
+    queue.put(event('#a', 'a1'))
+
+    stats = queue.stats[('client', '#a')]
+    assert stats['depth'] == 2
+    queue.get().addCallback(lambda item: None)
+    assert stats['depth'] == 1
+    assert stats['served'] == 1
+    assert stats['wait_max'] >= 0
+
+
+def test_fair_queue_get_waiting():
+    queue = FairQueue()
+    got = []
+    queue.get().addCallback(got.append)
+    queue.put(event('#a', 'a0'))
+    assert bodies(got) == ['a0']
+    assert len(queue) == 0
@@ -0,0 +1,134 @@
+"""Basic tests for brutal.core.ratelimit"""
+
+from twisted.internet import task
+
+from brutal.core import ratelimit
+from brutal.core.bot import Bot
+from brutal.core.capture import ReplayTransport
+from brutal.core.models import Action
+from brutal.core.ratelimit import TokenBucket, SendScheduler, LinesDropped
+
+
+def test_token_bucket(monkeypatch):
+    clock = task.Clock()
+    monkeypatch.setattr(ratelimit, 'reactor', clock)
+    bucket = TokenBucket(2, 3)
+
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+    assert bucket.delay() == 0.5
+
+    # refills up to the burst
+    clock.advance(10)
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+
+
+def test_scheduler_lanes(monkeypatch):
+    clock = task.Clock()
+    monkeypatch.setattr(ratelimit, 'reactor', clock)
+    sent = []
+    dropped = []
+    scheduler = SendScheduler(sent.append, 1, 1, queue_limit=2, on_drop=dropped.append)
+
+    scheduler.put('first', 'task')
+    for line in ('bulk', 'task 1', 'task 2', 'task 3'):
+        scheduler.put(line, line.split()[0])
+    scheduler.put('reply', 'reply')
+    scheduler.put('PONG', 'control')
+    replied = scheduler.when_sent('reply')
+
+    assert sent == ['first']
+    assert dropped == ['task']
+    assert len(scheduler) == 5
+
+    clock.advance(1)
+    assert sent == ['first', 'PONG']
+    assert not replied.called
+    clock.advance(1)
+    assert sent[-1] == 'reply'
+    assert replied.called
+    clock.pump([1] * 3)
+    assert sent[3:] == ['task 2', 'task 3', 'bulk']
+    assert scheduler.call is None
+
+
+def test_scheduler_dropped_markers(monkeypatch):
+    clock = task.Clock()
+    monkeypatch.setattr(ratelimit, 'reactor', clock)
+    sent = []
+    scheduler = SendScheduler(sent.append, 1, 1, queue_limit=2)
+    scheduler.put('first', 'task')
+
+    failed = []
+    markers = []
+    for reply in ('one', 'two', 'three'):
+        scheduler.put('{0} a'.format(reply), 'task')
+        markers.append(scheduler.when_sent('task'))
+        markers[-1].addErrback(lambda failure: failed.append(failure.check(LinesDropped)))
+    # 'one a' made room for 'three a', its reply is not reported as sent
+    assert failed == [LinesDropped]
+    assert not markers[1].called
+
+    clock.advance(1)
+    assert sent == ['first', 'two a']
+    assert markers[1].called and not markers[2].called
+
+    # what's still waiting when the connection goes never gets sent
+    scheduler.stop()
+    assert failed == [LinesDropped, LinesDropped]
+    assert markers[2].called
+
+
+def test_scheduler_dropped_merged_markers(monkeypatch):
+    clock = task.Clock()
+    monkeypatch.setattr(ratelimit, 'reactor', clock)
+    sent = []
+    scheduler = SendScheduler(sent.append, 1, 1, queue_limit=1,
+                              merge=lambda queued, line: None if line == 'c' else queued + ' | ' + line)
+    scheduler.put('first', 'task')
+
+    failed = []
+    markers = []
+    for reply in ('a', 'b', 'c'):
+        scheduler.put(reply, 'task')
+        markers.append(scheduler.when_sent('task'))
+        markers[-1].addErrback(lambda failure, reply=reply: failed.append(reply))
+    # 'b' was merged into 'a', both replies are gone with that line
+    assert failed == ['a', 'b']
+
+    clock.advance(1)
+    assert sent == ['first', 'c']
+    assert markers[2].called and failed == ['a', 'b']
+
+
+def test_irc_flood_control(monkeypatch):
+    clock = task.Clock()
+    monkeypatch.setattr(ratelimit, 'reactor', clock)
+    bot = Bot('bot', [{'protocol': 'irc', 'channels': ['#room'], 'flood_rate': 1, 'flood_burst': 2}])
+    backend = bot.connection_manager.clients.values()[0]
+
+    protocol = backend.client.buildProtocol(None)
+    transport = ReplayTransport()
+    protocol.makeConnection(transport)
+    # NICK and USER
+    assert transport.written == 2
+
+    announcement = Action(source_bot=bot).msg('news')
+    announcement.meta['priority'] = 'bulk'
+    sent = backend.handle_action(announcement)
+    assert transport.written == 2
+    protocol.lineReceived('PING :irc.example.org')
+
+    clock.advance(1)
+    # the PONG goes first
+    assert transport.written == 3
+    assert not sent.called
+    clock.advance(1)
+    assert transport.written == 4
+    assert sent.called
+
+    failures = []
+    backend.handle_action(announcement).addErrback(failures.append)
+
+    protocol.connectionLost(None)
+    assert protocol.scheduler.call is None
+    assert failures[0].check(LinesDropped)
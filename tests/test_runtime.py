@@ -0,0 +1,26 @@
+"""Basic tests for brutal.core.runtime"""
+
+import pytest
+from twisted.internet import reactor
+
+from brutal.core.runtime import install_reactor, REACTORS
+
+
+def test_install_default_reactor():
+    assert install_reactor() is reactor
+    assert install_reactor('default') is reactor
+
+
+def test_install_installed_reactor():
+    installed = reactor.__class__.__module__
+    for name, module in REACTORS.items():
+        if module == installed:
+            assert install_reactor(name) is reactor
+        else:
+            with pytest.raises(RuntimeError):
+                install_reactor(name)
+
+
+def test_unknown_reactor():
+    with pytest.raises(ValueError):
+        install_reactor('nope')
@@ -0,0 +1,47 @@
+"""Basic tests for brutal.core.supervisor"""
+
+from twisted.internet import task
+from twisted.python.failure import Failure
+
+from brutal.core import supervisor as supervisor_module
+from brutal.core.supervisor import BotSupervisor, BotProcess
+
+
+class Config(object):
+    SUPERVISOR_HEARTBEAT_INTERVAL = 1.0
+    SUPERVISOR_HEARTBEAT_TIMEOUT = 5.0
+    BOTS = [{'nick': 'one'}, {'nick': 'two'}, 'broken']
+
+
+def test_bot_nicks():
+    assert BotSupervisor(Config()).bot_nicks() == ['one', 'two']
+
+
+def test_restart_backoff(monkeypatch):
+    clock = task.Clock()
+    monkeypatch.setattr(supervisor_module, 'reactor', clock)
+    supervisor = BotSupervisor(Config())
+    spawned = []
+    monkeypatch.setattr(supervisor, 'spawn', spawned.append)
+    supervisor.running = True
+
+    reason = Failure(Exception('died'))
+    for _ in range(3):
+        supervisor.bot_ended(BotProcess(supervisor, 'one'), reason)
+    assert [call.getTime() for call in clock.getDelayedCalls()] == \
+        [1.0, 2.0, 4.0]
+
+    clock.advance(4)
+    assert spawned == ['one', 'one', 'one']
+
+
+def test_child_log_lines(monkeypatch):
+    child = BotProcess(BotSupervisor(Config()), 'one')
+    lines = []
+    monkeypatch.setattr(child.log, 'info', lines.append)
+    child.childDataReceived(2, 'first\nsec')
+    child.childDataReceived(2, 'ond\n')
+    assert lines == ['first', 'second']
+
+    child.childDataReceived(supervisor_module.HEARTBEAT_FD, '.')
+    assert child.last_heartbeat is not None
@@ -0,0 +1,75 @@
+"""Basic tests for brutal.core.tracing"""
+
+import sys
+
+from brutal.core.tracing import Histogram, Trace, Tracer
+from brutal.core.plugin import cmd
+from test_bot import build_bot, build_raw_event
+
+
+@cmd
+def ping(event):
+    return 'pong'
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(1, 2, 5))
+    for value in (0.5, 1.5, 1.5, 3, 10):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.count == 5 and histogram.sum == 16.5
+    assert histogram.percentile(0.5) == 2
+    assert histogram.percentile(1.0) is None
+    assert Histogram().percentile(0.5) is None
+
+
+def test_trace_fork_and_hops():
+    trace = Trace(stages=[('received', 1.0), ('built', 1.5)])
+    forked = trace.fork()
+    forked.mark('handled', 3.0)
+    assert len(trace.stages) == 2
+    assert forked.hops() == [('received->built', 0.5),
+                             ('built->handled', 1.5)]
+    assert forked.total() == 2.0
+
+
+def test_tracer_record(monkeypatch):
+    tracer = Tracer('bot', slow_threshold=1.0)
+    warnings = []
+    monkeypatch.setattr(tracer.log, 'warning', warnings.append)
+
+    trace = tracer.start(received=0.0)
+    trace.stages = [('received', 0.0), ('built', 0.5)]
+    trace.finish()
+    trace.finish()
+    assert tracer.histograms['received->built'].count == 1
+    assert tracer.total.count == 1
+    assert warnings == []
+
+    slow = Trace(tracer, [('received', 0.0), ('sent', 2.0)])
+    slow.finish()
+    assert len(warnings) == 1
+    assert sorted(tracer.stats()) == ['received->built', 'received->sent',
+                                      'total']
+
+
+def test_bot_tracing(monkeypatch):
+    bot, clock = build_bot(monkeypatch, tracing=True)
+    bot.plugin_manager._build_parser([('ping', ping)], sys.modules[__name__],
+                                     __name__)
+
+    actions = []
+    route_action = bot.connection_manager.route_action
+
+    def record(action):
+        route_action(action)
+        actions.append(action)
+    monkeypatch.setattr(bot.connection_manager, 'route_action', record)
+
+    bot.new_event(dict(build_raw_event('!ping'), received=0.0))
+    clock.advance(0)
+
+    assert [stage for stage, _ in actions[0].trace.stages] == \
+        ['received', 'built', 'processing', 'handled', 'routed', 'dispatched']
+    actions[0].trace.finish('sent')
+    assert bot.tracer.total.count == 1
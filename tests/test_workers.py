@@ -0,0 +1,103 @@
+"""Basic tests for brutal.core.workers"""
+
+import pytest
+
+from brutal.core.models import Action, Event
+from brutal.core.plugin import BotPlugin
+from brutal.core.workers import MessageReader, WorkerPool, WorkerBot, pack_message, shard_key
+from test_pools import spawn_worker
+from collections import namedtuple
+
+Bot = namedtuple('Bot', 'command_token nick')
+bot = Bot._make(['!', 'bot'])
+
+
+def build_event(room, body):
+    return Event(source_bot=bot, raw_details={
+        'type': 'message',
+        'source': 'room',
+        'client_id': 'client',
+        'channel': room,
+        'meta': {'body': body, 'recipients': [], 'nick': 'user'}
+    })
+
+
+def test_message_framing():
+    messages = []
+    reader = MessageReader(messages.append)
+    data = pack_message('event', 1, {'a': 1}) + pack_message('done', 1)
+
+    reader.feed(data[:3])
+    reader.feed(data[3:10])
+    assert messages == []
+    reader.feed(data[10:])
+    assert messages == [('event', 1, {'a': 1}), ('done', 1)]
+    assert reader.buffer == ''
+
+
+def test_shard_key():
+    assert shard_key(build_event('#a', 'x')) == \
+        shard_key(build_event('#a', 'y'))
+    assert shard_key(build_event(None, 'x')) == 'client:user'
+
+
+def test_snapshot_roundtrip():
+    event = build_event('#a', '!cmd arg')
+    copy = Event(source_bot=bot, raw_details=event.snapshot())
+    assert copy.cmd == 'cmd'
+    assert copy.source_room == '#a'
+
+    action = Action(source_bot=bot, source_event=event).msg('reply')
+    rebuilt = Action.from_snapshot(bot, action.snapshot())
+    assert rebuilt.meta == {'body': 'reply'}
+    assert rebuilt.destination_rooms == ['#a']
+    assert rebuilt.destination_bots == [bot]
+    assert rebuilt.source_event.args == ['arg']
+
+
+def test_worker_handler_timeout():
+    Client = namedtuple('Client', 'default_room')
+    ConnectionManager = namedtuple('ConnectionManager', 'clients')
+    Bot = namedtuple('Bot', 'nick command_token enabled_plugins '
+                            'connection_manager handler_timeout '
+                            'handler_timeout_reply')
+    bot = Bot('bot', '!', {}, ConnectionManager({'client': Client('#a')}),
+              None, 'too slow')
+
+    details = WorkerPool(bot, 1).setup_details(0)
+    worker_bot = WorkerBot(None, details)
+    assert worker_bot.plugin_manager.handler_timeout is None
+    assert worker_bot.plugin_manager.handler_timeout_reply == 'too slow'
+
+
+def test_worker_storage():
+    ConnectionManager = namedtuple('ConnectionManager', 'clients')
+    Bot = namedtuple('Bot', 'nick command_token enabled_plugins '
+                            'connection_manager')
+    bot = Bot('bot', '!', {}, ConnectionManager({}))
+
+    # the workers would each rewrite the same shelf
+    plugin = BotPlugin(bot=WorkerBot(None, WorkerPool(bot, 2).setup_details(1)))
+    with pytest.raises(RuntimeError):
+        plugin.open_storage('notes')
+    assert not plugin.shelves
+
+
+def test_worker_reactor(tmpdir):
+    process, out = spawn_worker('brutal.core.workers', tmpdir, 'poll')
+    messages = []
+    reader = MessageReader(messages.append)
+    process.stdin.write(pack_message('setup', {
+        'index': 0, 'nick': 'bot', 'command_token': '!',
+        'enabled_plugins': {}, 'clients': {'client': '#room'}}))
+    process.stdin.flush()
+    while not messages:
+        data = out.read(1)
+        if not data:
+            break
+        reader.feed(data)
+
+    process.stdin.close()
+    errors = process.stderr.read()
+    assert process.wait() == 0, errors
+    assert messages == [('ready',)]